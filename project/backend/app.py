@@ -1,32 +1,33 @@
 # app.py
 import os
 import json
-from flask import Flask, request, jsonify, make_response, Response, flash
-from modules.agent import app as agent_app
+from collections import deque
+from flask import Flask, request, jsonify, make_response, Response, flash, g
 from flask_cors import CORS
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 import traceback
 
-from modules.chatbot import ChatBot 
-from models.metacritic import process_userinput, predict_metascore
+from modules.registry import registry, WARMUP_ON_START
+from modules import metrics
+from modules.service import (
+    system_instruction, resolve_session_id, thread_config, conversation_messages,
+    remember_exchange, feedback_messages, feedback_turn, retry_messages, extract_answer, map_metacritic_input,
+    admin_authorized,
+)
+from modules.answer_cache import answer_cache
+from modules.fastpath import fast_path
+from modules import turn_store as turns
+from modules.agent_graph import is_partial
+from modules.chat_stream import sse, StepEvents, ThinkFilter, STREAM_MODES, SSE_HEADERS
+from modules.singleflight import SingleFlight, StreamFlight
 
 from dotenv import load_dotenv
 from flask_mail import Mail, Message
 
-os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
-import tensorflow as tf
-
 import warnings
 warnings.filterwarnings("ignore", message=".*flash attention.*")
 
 
 
-system_instruction = """
-You are an assistant connected to tools.
-- For any question about movies, genres, people, awards, reviews, or data stored in the Neo4j graph, ALWAYS use the Neo4jGraphQA tool.
-- For real-world facts not in the graph, use the WebSearch tool.
-- Do not answer directly without using a tool unless the question is purely about yourself or general instructions.
-"""
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 print("Current Working Directory:", os.getcwd())
@@ -47,51 +48,177 @@ CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
 
 
 mail = Mail(app)
-bot = ChatBot()
+rag_timings = deque(maxlen=int(os.getenv("RAG_TIMINGS_HISTORY", "200")))
+chat_flight = SingleFlight("chat")
+rag_flight = StreamFlight("rag")
+
+if WARMUP_ON_START:
+    registry.warmup_in_background()
+
+
+@app.before_request
+def start_request_trace():
+    g.metrics_state = metrics.begin_request(request.endpoint or "unmatched", request.headers)
+
+
+@app.after_request
+def finish_request_trace(response):
+    state = g.pop("metrics_state", None)
+    if state is not None:
+        method, status = request.method, response.status_code
+        # A streamed body (/rag, /chat/stream) is still to come: time the request until the response closes.
+        streamed = response.is_streamed
+        response.headers.update(metrics.finish_request(state, method, status, record=not streamed))
+        if streamed:
+            response.call_on_close(lambda: metrics.record_request(state[0], method, status))
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_view():
+    """Prometheus scrape endpoint."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status":"ok"}), 200
 
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """200 once every component in ENABLED_COMPONENTS is loaded, 503 before."""
+    status = registry.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
 
 @app.route("/chat", methods=["POST"])
 def chat():
     try:
         data = request.get_json()
         user_message = data.get("message", "")
-
-        # Invoke agent
-        result = agent_app.invoke(
-            {
-                "messages": [
-                    SystemMessage(content=system_instruction),  # inject instruction
-                    HumanMessage(content=user_message),
-                ]
-            },
-            config={"configurable": {"thread_id": "default-thread"}},
-        )
-
-        # Safely extract AI response
-        answer = None
-        if "messages" in result and result["messages"]:
-            # find the last AI message
-            ai_messages = [m for m in result["messages"] if isinstance(m, AIMessage)]
-            if ai_messages:
-                answer = ai_messages[-1].content
-            else:
-                answer = result["messages"][-1].content
+        session_id = resolve_session_id(data, request.headers)
+        config = thread_config(session_id)
+        agent_app = registry.get("agent")
+
+        messages, is_new_thread = conversation_messages(agent_app, config, system_instruction, user_message)
+        # What the answer was built from, so /feedback can re-synthesize instead of starting over.
+        turn_id = turns.turn_store.new_id()
+
+        # Only an opening question is cacheable; follow-ups depend on the thread. The data version
+        # is read now, so an answer that outlives a version bump is not stored under the new one.
+        cache_version = answer_cache.version()
+        if is_new_thread:
+            cached = answer_cache.get(user_message, cache_version)
+            if cached is not None:
+                remember_exchange(agent_app, config, messages, cached)
+                turns.turn_store.put(turn_id, session_id, user_message, cached, [])
+                return jsonify({"answer": cached, "session_id": session_id, "turn_id": turn_id, "cached": True}), 200
+
+        # Common graph questions are answered with one Cypher query, no LLM.
+        fast_answer = fast_path.answer(user_message)
+        if fast_answer is not None:
+            remember_exchange(agent_app, config, messages, fast_answer)
+            turns.turn_store.put(turn_id, session_id, user_message, fast_answer,
+                                 [turns.answered_call("Neo4jGraphQA", user_message, fast_answer)])
+            return jsonify({"answer": fast_answer, "session_id": session_id, "turn_id": turn_id,
+                            "fast_path": True}), 200
+
+        def run_agent():
+            with turns.capture() as notes:
+                result = agent_app.invoke({"messages": messages}, config=config)
+            messages_out = result.get("messages", [])
+            return (extract_answer(result), turns.tool_calls_from(messages_out, user_message, notes),
+                    is_partial(messages_out))
+
+        # Identical opening questions in flight at once share one agent run.
+        if is_new_thread:
+            (answer, tool_calls, partial), shared = chat_flight.do(user_message, run_agent)
         else:
-            # fallback
-            answer = result.get("output", "(no output)")
-
-        return jsonify({"answer": answer}), 200
+            (answer, tool_calls, partial), shared = run_agent(), False
+
+        if shared:
+            # The leader's run wrote to its own thread, not this one.
+            remember_exchange(agent_app, config, messages, answer)
+        turns.turn_store.put(turn_id, session_id, user_message, answer, tool_calls)
+        # A partial answer (a tool or the turn ran out of time) is not worth caching.
+        if is_new_thread and not shared and not partial:
+            answer_cache.put(user_message, answer, cache_version)
+        body = {"answer": answer, "session_id": session_id, "turn_id": turn_id}
+        if partial:
+            body["partial"] = True
+        if shared:
+            body["coalesced"] = True
+        return jsonify(body), 200
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """/chat as server-sent events: tool steps and the answer's tokens as they happen (see modules.chat_stream)."""
+    data = request.get_json() or {}
+    user_message = data.get("message", "")
+    session_id = resolve_session_id(data, request.headers)
+    config = thread_config(session_id)
+    try:
+        agent_app = registry.get("agent")
+        messages, is_new_thread = conversation_messages(agent_app, config, system_instruction, user_message)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    turn_id = turns.turn_store.new_id()
+    ids = {"session_id": session_id, "turn_id": turn_id}
+
+    def generate():
+        yield sse("start", ids)
+        try:
+            quick, calls, flags = None, [], {}
+            cache_version = answer_cache.version()
+            if is_new_thread:
+                quick, flags = answer_cache.get(user_message, cache_version), {"cached": True}
+            if quick is None:
+                quick, flags = fast_path.answer(user_message), {"fast_path": True}
+                calls = [turns.answered_call("Neo4jGraphQA", user_message, quick)] if quick is not None else []
+            if quick is not None:
+                remember_exchange(agent_app, config, messages, quick)
+                turns.turn_store.put(turn_id, session_id, user_message, quick, calls)
+                # Cached answers are stored as /chat produced them, <think> included.
+                text = ThinkFilter.clean(quick)
+                yield sse("token", {"text": text, "step": 0})
+                yield sse("done", {"answer": text, **ids, **flags})
+                return
+
+            with turns.capture() as notes:
+                events = StepEvents(notes)
+                stream = agent_app.stream({"messages": messages}, config=config, stream_mode=STREAM_MODES)
+                try:
+                    for mode, chunk in stream:
+                        for event, payload in events.feed(mode, chunk):
+                            yield sse(event, payload)
+                finally:
+                    # Also on disconnect: stops the agent before its next step.
+                    stream.close()
+            for event, payload in events.flush():
+                yield sse(event, payload)
+
+            final = agent_app.get_state(config).values.get("messages") or []
+            answer = extract_answer({"messages": final})
+            partial = is_partial(final)
+            turns.turn_store.put(turn_id, session_id, user_message, answer,
+                                 turns.tool_calls_from(final, user_message, notes))
+            if is_new_thread and not partial:
+                answer_cache.put(user_message, answer, cache_version)
+            yield sse("done", {"answer": ThinkFilter.clean(answer), **ids, **({"partial": True} if partial else {})})
+        except Exception as e:
+            traceback.print_exc()
+            yield sse("error", {"error": str(e)})
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
 @app.route("/feedback", methods=["OPTIONS", "POST"])
 def feedback():
     # respond to preflight quickly
@@ -103,76 +230,70 @@ def feedback():
         user_message = data.get("user_message", "")
         bot_message = data.get("bot_message", "")
         feedback = data.get("feedback", "down")  # 'up' or 'down'
+        session_id = resolve_session_id(data, request.headers)
 
-        # helpful debugging log (check your Flask console)
-        print(f"[FEEDBACK] user_message={user_message[:80]!r} bot_message={bot_message[:80]!r} feedback={feedback!r}")
-
-        # Build a retry prompt (adjust as needed)
-        system_txt = (
-            "You are an assistant that can use tools (Neo4j/WebSearch). "
-            "The user said the previous answer was not good; produce an improved, concise reply."
-        )
-
-        retry_prompt = (
-            f"The user originally asked: {user_message}\n\n"
-            f"The assistant responded:\n{bot_message}\n\n"
-            f"The user rated the previous answer: {feedback}.\n\n"
-            "Produce an improved, concise and actionable answer. Use the graph or web tools if necessary."
-        )
-
-        # Invoke the agent (adjust to match your agent API)
-        # If your agent expects a dict like earlier, use that; here I follow your existing pattern.
-        from modules.agent import app as agent_app  # import inside function to avoid import loops
-
+        # "retry" (default with a turn_id) re-synthesizes from the turn's stored tool
+        # results; "full" re-runs the agent from scratch.
+        turn_id = data.get("turn_id")
+        mode = data.get("mode") or ("retry" if turn_id else "full")
 
-        result = agent_app.invoke(
-            {
-                "messages": [
-                    SystemMessage(content=system_txt),
-                    HumanMessage(content=retry_prompt)
-                ]
-            },
-            config={"configurable": {"thread_id": "default-thread"}},
+        # helpful debugging log (check your Flask console)
+        print(f"[FEEDBACK] user_message={user_message[:80]!r} bot_message={bot_message[:80]!r} "
+              f"feedback={feedback!r} mode={mode!r}")
+
+        turn = turns.turn_store.get(turn_id, session_id) if mode == "retry" else None
+        if turn is not None:
+            agent_app = registry.get("agent")
+            from modules.agent import resynthesize
+
+            messages = retry_messages(turn, bot_message, feedback)
+            answer, new_calls = resynthesize(messages)
+            remember_exchange(agent_app, thread_config(session_id), feedback_turn(feedback), answer)
+            new_turn_id = turns.turn_store.new_id()
+            turns.turn_store.put(new_turn_id, session_id, turn["question"], answer, turn["tool_calls"] + new_calls)
+            return jsonify({"answer": answer, "session_id": session_id, "turn_id": new_turn_id, "mode": "retry",
+                            "reused_tool_calls": len(turn["tool_calls"]), "new_tool_calls": len(new_calls)}), 200
+
+        result = registry.get("agent").invoke(
+            {"messages": feedback_messages(user_message, bot_message, feedback)},
+            config=thread_config(session_id),
         )
 
-        # Robust extraction of AI text
-        answer = None
-        if "messages" in result and result["messages"]:
-            # prefer last AIMessage
-            ai_msgs = [m for m in result["messages"] if hasattr(m, "content") and m.__class__.__name__.endswith("AIMessage")]
-            if ai_msgs:
-                answer = ai_msgs[-1].content
-            else:
-                last = result["messages"][-1]
-                answer = getattr(last, "content", str(last))
-        else:
-            answer = result.get("output", "(no output)")
-
-        return jsonify({"answer": answer}), 200
+        answer = extract_answer(result)
+        return jsonify({"answer": answer, "session_id": session_id, "mode": "full"}), 200
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     
-bot = None
+@app.route("/admin/data-version", methods=["POST"])
+def bump_data_version():
+    """Invalidates every cached /chat answer; call after reloading the graph."""
+    if not admin_authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    version = answer_cache.bump_data_version()
+    fast_path.invalidate()
+    return jsonify({"data_version": version}), 200
+
+
+@app.route("/admin/cache-stats", methods=["GET"])
+def cache_stats():
+    if not admin_authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({"answer_cache": answer_cache.stats(), "turns": turns.turn_store.stats()}), 200
+
 
 def get_bot():
     """
     Lazy loader for ChatBot. Creates the ChatBot instance the first time it's needed.
     Returns the bot or raises an Exception if initialization fails (so route can respond).
     """
-    global bot
-    if bot is None:
-        try:
-            # Import inside function to avoid heavy imports at module import time
-            from modules.chatbot import ChatBot
-            bot = ChatBot()
-        except Exception as e:
-            # Log the error and re-raise so callers can handle it.
-            import traceback
-            traceback.print_exc()
-            raise RuntimeError(f"Failed to initialize ChatBot: {e}")
-    return bot
+    try:
+        return registry.get("chatbot")
+    except Exception as e:
+        # Log the error and re-raise so callers can handle it.
+        traceback.print_exc()
+        raise RuntimeError(f"Failed to initialize ChatBot: {e}")
 
 
 @app.route("/rag", methods=["POST"])
@@ -192,34 +313,55 @@ def rag_chat():
             "details": str(e)
         }), 500
 
+    from modules.chatbot import StreamTimings
+
+    timings = StreamTimings()
+    # Identical questions in flight share one stream; a late joiner replays what
+    # has been streamed so far and then follows along.
+    shared_stream, shared = rag_flight.open(
+        question, lambda cancel_event: bot_instance.stream_answer(question, timings=timings, cancel_event=cancel_event),
+        context=timings)
+
     def generate():
-        # stream_answer is expected to be a generator yielding chunks
-        for chunk in bot_instance.stream_answer(question):
-            yield chunk
+        stream = shared_stream.subscribe()
+        try:
+            for chunk in stream:
+                yield chunk
+        finally:
+            # Runs on normal completion and when werkzeug closes the response
+            # because the client went away; the last one to leave stops Groq.
+            stream.close()
+            record = {"question": question[:80], **shared_stream.context.as_dict(), "coalesced": shared}
+            rag_timings.append(record)
+            print(f"[RAG] timings={record}")
 
-    return Response(generate(), mimetype="text/plain")
+    # Tell reverse proxies not to buffer, otherwise tokens arrive in one lump.
+    response = Response(generate(), mimetype="text/plain",
+                        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+    # Leaves the stream even if the body never starts (a no-op once generate() has left it).
+    response.call_on_close(shared_stream.close)
+    return response
 
 
+@app.route("/rag/timings", methods=["GET"])
+def rag_timings_view():
+    """Recent per-request /rag timings (retrieval, first token, last token)."""
+    return jsonify({"recent": list(rag_timings)}), 200
 
 
-    
+METACRITIC_BATCH_LIMIT = int(os.getenv("METACRITIC_BATCH_LIMIT", "10000"))
+
 
 @app.route("/metacritic", methods=["POST"])
 def metacritic():
     try:
         data = request.get_json()
 
-        mapped_data = {
-            "year": data.get("year"),
-            "imdb user rating": data.get("imdb_rating"),
-            "number of imdb user votes": data.get("imdb_votes"),
-            "budget": data.get("budget"),
-            "opening weekend": data.get("opening_weekend"),
-            "text": data.get("text", ""),
-        }
+        mapped_data = map_metacritic_input(data)
+        metacritic_model = registry.get("metacritic")
 
-        preprocessed = process_userinput(mapped_data)
-        preds = predict_metascore(preprocessed)
+        preprocessed = metacritic_model.process_userinput(mapped_data)
+        preds = metacritic_model.predict_metascore(preprocessed)
 
         score = round(float(preds[0]), 2)
 
@@ -235,6 +377,29 @@ def metacritic():
         }), 500
 
 
+@app.route("/metacritic/batch", methods=["POST"])
+def metacritic_batch():
+    """
+    Scores many movies in one request: {"movies": [{year, imdb_rating, ...}, ...]}
+    -> {"scores": [float, ...]} in input order.
+    """
+    data = request.get_json(silent=True) or {}
+    movies = data.get("movies")
+    if not isinstance(movies, list) or not movies:
+        return jsonify({"error": "Expected a non-empty 'movies' list."}), 400
+    if len(movies) > METACRITIC_BATCH_LIMIT:
+        return jsonify({"error": f"At most {METACRITIC_BATCH_LIMIT} movies per request."}), 400
+    if not all(isinstance(m, dict) for m in movies):
+        return jsonify({"error": "Every entry in 'movies' must be an object."}), 400
+
+    try:
+        preds = registry.get("metacritic").predict_metascores([map_metacritic_input(m) for m in movies])
+        return jsonify({"scores": [round(float(p), 2) for p in preds]}), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": f"Batch scoring failed: {str(e)}"}), 500
+
+
 import traceback
 
 def send_email(name, email, message_text):
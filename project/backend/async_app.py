@@ -0,0 +1,444 @@
+# async_app.py
+"""
+Async serving mode for the LLM-bound endpoints (/chat, /rag, /feedback,
+/metacritic). A request waiting on Groq holds no worker thread, so one process
+can keep hundreds of conversations in flight.
+
+    hypercorn async_app:app --bind 0.0.0.0:8000
+
+Each endpoint has its own concurrency limit and wait queue; when the queue is
+full the request gets 429 with Retry-After instead of waiting indefinitely.
+Limits are set with LIMIT_<ENDPOINT>_CONCURRENCY / _QUEUE / _RETRY_AFTER.
+"""
+import os
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, request, jsonify, Response, g
+from quart.wrappers.response import IterableBody
+from quart_cors import cors
+
+from modules.registry import registry, WARMUP_ON_START
+from modules import metrics
+from modules.concurrency import EndpointLimiter, Overloaded
+from modules import http_clients
+from modules.service import (
+    system_instruction, resolve_session_id, thread_config, conversation_messages,
+    aconversation_messages, remember_exchange, aremember_exchange, feedback_messages, feedback_turn, retry_messages,
+    extract_answer, map_metacritic_input, admin_authorized,
+)
+from modules.answer_cache import answer_cache
+from modules.fastpath import fast_path
+from modules import turn_store as turns
+from modules.agent_graph import is_partial
+from modules.chat_stream import sse, StepEvents, ThinkFilter, iterate_in_thread, STREAM_MODES, SSE_HEADERS
+from modules.singleflight import AsyncSingleFlight, AsyncStreamFlight
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Sync tools (Neo4j, CSV) and CPU work run in this pool.
+ASYNC_WORKER_THREADS = int(os.getenv("ASYNC_WORKER_THREADS", "64"))
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
+
+limiters = {
+    "chat": EndpointLimiter.from_env("chat", max_concurrent=200, max_queue=400),
+    "rag": EndpointLimiter.from_env("rag", max_concurrent=200, max_queue=400),
+    "feedback": EndpointLimiter.from_env("feedback", max_concurrent=50, max_queue=100),
+    "metacritic": EndpointLimiter.from_env("metacritic", max_concurrent=8, max_queue=64),
+}
+
+# Identical questions in flight at once share one agent run / one token stream.
+chat_flight = AsyncSingleFlight("chat")
+rag_flight = AsyncStreamFlight("rag")
+
+
+
+@app.before_serving
+async def startup():
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_WORKER_THREADS))
+    if WARMUP_ON_START:
+        registry.warmup_in_background()
+
+
+@app.before_request
+async def start_request_trace():
+    g.metrics_state = metrics.begin_request(request.endpoint or "unmatched", request.headers)
+
+
+class _RecordOnClose:
+    """Response body wrapper that records the request once the body is done (or the client has gone)."""
+
+    def __init__(self, body, trace, method, status):
+        self.body = body
+        self.record = (trace, method, status)
+
+    async def __aenter__(self):
+        await self.body.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self.body.__aexit__(exc_type, exc, tb)
+        finally:
+            metrics.record_request(*self.record)
+
+    def __aiter__(self):
+        return self.body.__aiter__()
+
+
+@app.after_request
+async def finish_request_trace(response):
+    state = g.pop("metrics_state", None)
+    if state is not None:
+        method, status = request.method, response.status_code
+        # A streamed body (/rag, /chat/stream) is still to come: time the request until it is sent.
+        streamed = isinstance(response.response, IterableBody)
+        response.headers.update(metrics.finish_request(state, method, status, record=not streamed))
+        if streamed:
+            response.response = _RecordOnClose(response.response, state[0], method, status)
+    return response
+
+
+def _limiter_metrics():
+    samples = {key: [] for key in ("active", "waiting", "shed")}
+    for name, limiter in limiters.items():
+        stats = limiter.stats()
+        for key in samples:
+            if key in stats:
+                samples[key].append(({"endpoint": name}, stats[key]))
+    return [(f"cinegraph_limiter_{key}", "counter" if key == "shed" else "gauge",
+             f"Endpoint limiter: {key} requests.", values) for key, values in samples.items()]
+
+
+metrics.registry.add_collector(_limiter_metrics)
+
+
+@app.after_serving
+async def shutdown():
+    await http_clients.aclose()
+
+
+@app.errorhandler(Overloaded)
+async def overloaded(e):
+    response = jsonify({"error": f"Server busy ({e.name}); retry shortly."})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+async def component(name):
+    """Registry lookup that builds (blocking work) in the worker pool on first use."""
+    instance = registry.peek(name)
+    if instance is None:
+        instance = await asyncio.to_thread(registry.get, name)
+    return instance
+
+
+async def get_bot():
+    return await component("chatbot")
+
+
+def _async_native(agent_app):
+    return getattr(agent_app.checkpointer, "async_native", True)
+
+
+async def ainvoke_agent(inputs, config):
+    agent_app = await component("agent")
+    if _async_native(agent_app):
+        return await agent_app.ainvoke(inputs, config=config)
+    # e.g. the SQLite checkpointer: run the sync graph in the worker pool
+    return await asyncio.to_thread(agent_app.invoke, inputs, config=config)
+
+
+async def chat_messages(config, user_message):
+    agent_app = await component("agent")
+    if _async_native(agent_app):
+        return await aconversation_messages(agent_app, config, system_instruction, user_message)
+    return await asyncio.to_thread(conversation_messages, agent_app, config, system_instruction, user_message)
+
+
+async def remember(config, messages, answer):
+    agent_app = await component("agent")
+    if _async_native(agent_app):
+        await aremember_exchange(agent_app, config, messages, answer)
+    else:
+        await asyncio.to_thread(remember_exchange, agent_app, config, messages, answer)
+
+
+@app.route("/health", methods=["GET"])
+async def health():
+    return jsonify({"status": "ok", "limits": {k: v.stats() for k, v in limiters.items()}}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_view():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    status = registry.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+@app.route("/chat", methods=["POST"])
+async def chat():
+    async with limiters["chat"]:
+        try:
+            data = await request.get_json()
+            user_message = data.get("message", "")
+            session_id = resolve_session_id(data, request.headers)
+            config = thread_config(session_id)
+
+            messages, is_new_thread = await chat_messages(config, user_message)
+            turn_id = turns.turn_store.new_id()
+
+            # Read before answering, so an answer that outlives a data-version bump is not stored under the new one.
+            cache_version = answer_cache.version()
+            if is_new_thread:
+                cached = answer_cache.get(user_message, cache_version)
+                if cached is not None:
+                    await remember(config, messages, cached)
+                    turns.turn_store.put(turn_id, session_id, user_message, cached, [])
+                    return jsonify({"answer": cached, "session_id": session_id, "turn_id": turn_id,
+                                    "cached": True}), 200
+
+            fast_answer = await asyncio.to_thread(fast_path.answer, user_message)
+            if fast_answer is not None:
+                await remember(config, messages, fast_answer)
+                turns.turn_store.put(turn_id, session_id, user_message, fast_answer,
+                                     [turns.answered_call("Neo4jGraphQA", user_message, fast_answer)])
+                return jsonify({"answer": fast_answer, "session_id": session_id, "turn_id": turn_id,
+                                "fast_path": True}), 200
+
+            async def run_agent():
+                # Tool threads run in copies of this context, so their notes reach this list.
+                with turns.capture() as notes:
+                    result = await ainvoke_agent({"messages": messages}, config)
+                messages_out = result.get("messages", [])
+                return (extract_answer(result), turns.tool_calls_from(messages_out, user_message, notes),
+                        is_partial(messages_out))
+
+            if is_new_thread:
+                (answer, tool_calls, partial), shared = await chat_flight.do(user_message, run_agent)
+            else:
+                (answer, tool_calls, partial), shared = await run_agent(), False
+
+            if shared:
+                await remember(config, messages, answer)
+            turns.turn_store.put(turn_id, session_id, user_message, answer, tool_calls)
+            # A partial answer (a tool or the turn ran out of time) is not worth caching.
+            if is_new_thread and not shared and not partial:
+                answer_cache.put(user_message, answer, cache_version)
+            body = {"answer": answer, "session_id": session_id, "turn_id": turn_id}
+            if partial:
+                body["partial"] = True
+            if shared:
+                body["coalesced"] = True
+            return jsonify(body), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"error": str(e)}), 500
+
+
+@app.route("/chat/stream", methods=["POST"])
+async def chat_stream():
+    data = await request.get_json() or {}
+    user_message = data.get("message", "")
+    session_id = resolve_session_id(data, request.headers)
+    config = thread_config(session_id)
+
+    limiter = limiters["chat"]
+    # An overload is still a 429; the slot is held by the body for the whole
+    # stream, so a response whose body never runs holds none.
+    limiter.admit()
+    try:
+        agent_app = await component("agent")
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    turn_id = turns.turn_store.new_id()
+    ids = {"session_id": session_id, "turn_id": turn_id}
+
+    async def generate():
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            yield sse("error", {"error": f"Server busy ({e.name}); retry shortly."})
+            return
+        try:
+            yield sse("start", ids)
+            messages, is_new_thread = await chat_messages(config, user_message)
+            quick, calls, flags = None, [], {}
+            cache_version = answer_cache.version()
+            if is_new_thread:
+                quick, flags = answer_cache.get(user_message, cache_version), {"cached": True}
+            if quick is None:
+                quick, flags = await asyncio.to_thread(fast_path.answer, user_message), {"fast_path": True}
+                calls = [turns.answered_call("Neo4jGraphQA", user_message, quick)] if quick is not None else []
+            if quick is not None:
+                await remember(config, messages, quick)
+                turns.turn_store.put(turn_id, session_id, user_message, quick, calls)
+                # Cached answers are stored as /chat produced them, <think> included.
+                text = ThinkFilter.clean(quick)
+                yield sse("token", {"text": text, "step": 0})
+                yield sse("done", {"answer": text, **ids, **flags})
+                return
+
+            inputs = {"messages": messages}
+            with turns.capture() as notes:
+                events = StepEvents(notes)
+                if _async_native(agent_app):
+                    stream = agent_app.astream(inputs, config=config, stream_mode=STREAM_MODES)
+                else:
+                    stream = iterate_in_thread(agent_app.stream(inputs, config=config, stream_mode=STREAM_MODES))
+                try:
+                    async for mode, chunk in stream:
+                        for event, payload in events.feed(mode, chunk):
+                            yield sse(event, payload)
+                finally:
+                    await stream.aclose()
+            for event, payload in events.flush():
+                yield sse(event, payload)
+
+            if _async_native(agent_app):
+                final = (await agent_app.aget_state(config)).values.get("messages") or []
+            else:
+                final = (await asyncio.to_thread(agent_app.get_state, config)).values.get("messages") or []
+            answer = extract_answer({"messages": final})
+            partial = is_partial(final)
+            turns.turn_store.put(turn_id, session_id, user_message, answer,
+                                 turns.tool_calls_from(final, user_message, notes))
+            if is_new_thread and not partial:
+                answer_cache.put(user_message, answer, cache_version)
+            yield sse("done", {"answer": ThinkFilter.clean(answer), **ids, **({"partial": True} if partial else {})})
+        except Exception as e:
+            traceback.print_exc()
+            yield sse("error", {"error": str(e)})
+        finally:
+            limiter.release()
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.route("/admin/data-version", methods=["POST"])
+async def bump_data_version():
+    if not admin_authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    version = answer_cache.bump_data_version()
+    fast_path.invalidate()
+    return jsonify({"data_version": version}), 200
+
+
+@app.route("/admin/cache-stats", methods=["GET"])
+async def cache_stats():
+    if not admin_authorized(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify({"answer_cache": answer_cache.stats(), "turns": turns.turn_store.stats()}), 200
+
+
+@app.route("/feedback", methods=["OPTIONS", "POST"])
+async def feedback():
+    if request.method == "OPTIONS":
+        return "", 200
+
+    async with limiters["feedback"]:
+        try:
+            data = await request.get_json(force=True)
+            user_message = data.get("user_message", "")
+            bot_message = data.get("bot_message", "")
+            feedback = data.get("feedback", "down")
+            session_id = resolve_session_id(data, request.headers)
+            turn_id = data.get("turn_id")
+            mode = data.get("mode") or ("retry" if turn_id else "full")
+            print(f"[FEEDBACK] user_message={user_message[:80]!r} bot_message={bot_message[:80]!r} "
+                  f"feedback={feedback!r} mode={mode!r}")
+
+            turn = turns.turn_store.get(turn_id, session_id) if mode == "retry" else None
+            if turn is not None:
+                await component("agent")
+                from modules.agent import resynthesize
+
+                messages = retry_messages(turn, bot_message, feedback)
+                answer, new_calls = await asyncio.to_thread(resynthesize, messages)
+                await remember(thread_config(session_id), feedback_turn(feedback), answer)
+                new_turn_id = turns.turn_store.new_id()
+                turns.turn_store.put(new_turn_id, session_id, turn["question"], answer,
+                                     turn["tool_calls"] + new_calls)
+                return jsonify({"answer": answer, "session_id": session_id, "turn_id": new_turn_id,
+                                "mode": "retry", "reused_tool_calls": len(turn["tool_calls"]),
+                                "new_tool_calls": len(new_calls)}), 200
+
+            result = await ainvoke_agent(
+                {"messages": feedback_messages(user_message, bot_message, feedback)},
+                thread_config(session_id),
+            )
+            return jsonify({"answer": extract_answer(result), "session_id": session_id, "mode": "full"}), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"error": str(e)}), 500
+
+
+@app.route("/rag", methods=["POST"])
+async def rag_chat():
+    data = await request.get_json()
+    if not data or "question" not in data:
+        return jsonify({"error": "No question provided."}), 400
+    question = data["question"]
+
+    limiter = limiters["rag"]
+    # An overload is still a 429; the slot itself is taken inside the body, so a
+    # response whose body never runs holds none.
+    limiter.admit()
+    try:
+        bot_instance = await get_bot()
+    except Exception as e:
+        return jsonify({"error": "ChatBot initialization failed on the server.", "details": str(e)}), 500
+
+    from modules.chatbot import StreamTimings
+
+    async def generate():
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            yield f"Server busy ({e.name}); retry shortly."
+            return
+        try:
+            timings = StreamTimings()
+            shared_stream, shared = rag_flight.open(
+                question, lambda: bot_instance.astream_answer(question, timings=timings), context=timings)
+            stream = shared_stream.subscribe()
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+                record = {"question": question[:80], **shared_stream.context.as_dict(), "coalesced": shared}
+                print(f"[RAG] timings={record}")
+        finally:
+            limiter.release()
+
+    return Response(generate(), mimetype="text/plain",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+
+@app.route("/metacritic", methods=["POST"])
+async def metacritic():
+    async with limiters["metacritic"]:
+        try:
+            data = await request.get_json()
+            metacritic_model = await component("metacritic")
+            preprocessed = metacritic_model.process_userinput(map_metacritic_input(data))
+            preds = await asyncio.to_thread(metacritic_model.predict_metascore, preprocessed)
+            score = round(float(preds[0]), 2)
+            return jsonify({"output": f"🎯 Predicted Metacritic Score: {score}/100"}), 200
+        except Exception as e:
+            traceback.print_exc()
+            return jsonify({"error": f"⚠️ Oops! Something went wrong: {str(e)}"}), 500
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.getenv("PORT", "8000")))
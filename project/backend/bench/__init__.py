@@ -0,0 +1,8 @@
+# bench/
+"""
+Offline benchmarks for the backend: a deterministic stand-in chat model with
+configurable latency, a fixture-backed graph, a temp-dir Chroma collection and
+a synthetic question bank, driven through the Flask app.
+
+    python -m bench.run --scenarios chat,rag --requests 300 --concurrency 8 --out bench.json
+"""
@@ -0,0 +1,319 @@
+# bench/fakes.py
+"""
+Local stand-ins for Groq, Neo4j, the embedding model and the /rag retriever.
+All of them are deterministic so runs on different commits are comparable.
+"""
+import re
+import time
+import zlib
+import asyncio
+import hashlib
+from typing import Any, List, Optional
+
+import numpy as np
+from pydantic import Field
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+from langchain_neo4j.graphs.graph_store import GraphStore
+
+from modules import metrics
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _text(message) -> str:
+    content = message.content
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return str(content)
+
+
+def _clip(text: str, limit: int = 300) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def fake_cypher(question: str) -> str:
+    """The Cypher a well-behaved model would write for the question bank's templates."""
+    q = question.strip()
+    patterns = [
+        (r"who directed (.+?)\??$", "DIRECTED_BY"),
+        (r"who acted in (.+?)\??$", "ACTED_IN"),
+        (r"who wrote (.+?)\??$", "WRITTEN_BY"),
+    ]
+    for pattern, rel in patterns:
+        m = re.search(pattern, q, re.IGNORECASE)
+        if m:
+            return (f"MATCH (m:Movie)-[:{rel}]->(p:Person) WHERE toLower(m.title) = toLower({_quote(m.group(1))}) "
+                    f"RETURN p.name AS name")
+    m = re.search(r"which genre is (.+?)\??$", q, re.IGNORECASE)
+    if m:
+        return (f"MATCH (m:Movie)-[:HAS_GENRE]->(g:Genre) WHERE toLower(m.title) = toLower({_quote(m.group(1))}) "
+                f"RETURN g.name AS genre")
+    m = re.search(r"released in (\d{4})", q, re.IGNORECASE)
+    if m:
+        return f"MATCH (m:Movie) WHERE m.year = {m.group(1)} RETURN m.title AS title"
+    m = re.search(r"list (.+?) movies", q, re.IGNORECASE)
+    if m:
+        return (f"MATCH (m:Movie)-[:HAS_GENRE]->(g:Genre) WHERE toLower(g.name) = toLower({_quote(m.group(1))}) "
+                f"RETURN m.title AS title")
+    return (f"MATCH (m:Movie) WHERE toLower(m.title) CONTAINS toLower({_quote(q.rstrip('?'))}) "
+            f"RETURN m.title AS title, m.year AS year")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model with a fixed latency (and optional per-token delay when streaming).
+
+    - With tools bound, a user turn becomes one tool call and a tool result
+      becomes the final answer, which is one ReAct iteration.
+    - The Cypher-generation prompt gets fake_cypher(question).
+    - QA and /rag prompts get an answer built from their context.
+    """
+
+    latency_ms: float = 50.0
+    token_delay_ms: float = 0.0
+    tool_names: List[str] = Field(default_factory=list)
+    model_name: str = "bench-fake"
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        names = []
+        for tool in tools:
+            name = getattr(tool, "name", None)
+            if name is None and isinstance(tool, dict):
+                name = tool.get("name") or tool.get("function", {}).get("name")
+            names.append(name or getattr(tool, "__name__", "tool"))
+        return self.model_copy(update={"tool_names": names})
+
+    def _pick_tool(self, question: str) -> str:
+        if "CSVQuery" in self.tool_names and "sentiment" in question.lower():
+            return "CSVQuery"
+        if "Neo4jGraphQA" in self.tool_names:
+            return "Neo4jGraphQA"
+        return self.tool_names[0]
+
+    def _reply(self, messages) -> AIMessage:
+        last = messages[-1]
+        text = _text(last)
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Based on the data: {_clip(text)}")
+        if self.tool_names and isinstance(last, HumanMessage):
+            m = re.search(r"originally asked:\s*(.+)", text)  # /feedback retry prompt
+            question = (m.group(1) if m else text).strip()
+            call_id = "call_" + hashlib.sha1(f"{len(messages)}:{question}".encode("utf-8")).hexdigest()[:12]
+            return AIMessage(content="", tool_calls=[{
+                "name": self._pick_tool(question), "args": {"__arg1": question}, "id": call_id, "type": "tool_call",
+            }])
+        if "Cypher Query Language expert" in text:
+            m = re.search(r"Question:\s*(.+?)\s*\n\s*\n", text, re.DOTALL)
+            return AIMessage(content=fake_cypher(m.group(1) if m else text.splitlines()[-1]))
+        for marker in ("Information:", "Context:"):
+            if marker in text:
+                context = text.split(marker, 1)[1].split("Question:", 1)[0]
+                return AIMessage(content=f"Here is what I found: {_clip(context)}")
+        return AIMessage(content=f"Noted: {_clip(text, 120)}")
+
+    def _result(self, messages, message: AIMessage) -> ChatResult:
+        prompt_tokens = sum(len(_text(m).split()) for m in messages)
+        completion_tokens = max(1, len(_text(message).split()))
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"model_name": self.model_name,
+                        "token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return self._result(messages, self._reply(messages))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._result(messages, self._reply(messages))
+
+    def _chunks(self, messages):
+        words = _text(self._reply(messages)).split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        for i, piece in enumerate(self._chunks(messages)):
+            if i and self.token_delay_ms:
+                time.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_ms / 1000)
+        for i, piece in enumerate(self._chunks(messages)):
+            if i and self.token_delay_ms:
+                await asyncio.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+
+ROLE_FIELDS = {"DIRECTED_BY": "directors", "WRITTEN_BY": "writers", "ACTED_IN": "cast"}
+
+
+class FakeGraph(GraphStore):
+    """
+    Answers the Cypher shapes fake_cypher() produces over the fixture dataset,
+    after a fixed per-query latency. Anything else falls back to a title search.
+    """
+
+    def __init__(self, dataset, latency_ms: float = 2.0, max_rows: int = 50):
+        self.movies = dataset["movies"]
+        self.genres = sorted({g for m in self.movies for g in m["genres"]})
+        self.latency_ms = latency_ms
+        self.max_rows = max_rows
+        self.schema = (
+            "Node properties:\n"
+            "Movie {imdb_id: STRING, title: STRING, year: INTEGER, imdb_rating: FLOAT, plot: STRING}\n"
+            "Person {name: STRING}\nGenre {name: STRING}\n"
+            "The relationships:\n"
+            "(:Movie)-[:HAS_GENRE]->(:Genre)\n(:Movie)-[:DIRECTED_BY]->(:Person)\n"
+            "(:Movie)-[:WRITTEN_BY]->(:Person)\n(:Movie)-[:ACTED_IN]->(:Person)"
+        )
+        movie_props = [("imdb_id", "STRING"), ("title", "STRING"), ("year", "INTEGER"),
+                       ("imdb_rating", "FLOAT"), ("imdb_votes", "INTEGER"), ("budget", "INTEGER"), ("plot", "STRING")]
+        self.structured_schema = {
+            "node_props": {
+                "Movie": [{"property": p, "type": t} for p, t in movie_props],
+                "Person": [{"property": "name", "type": "STRING"}],
+                "Genre": [{"property": "name", "type": "STRING"}],
+            },
+            "rel_props": {},
+            "relationships": [{"start": "Movie", "type": t, "end": end} for t, end in
+                              [("HAS_GENRE", "Genre"), ("DIRECTED_BY", "Person"),
+                               ("WRITTEN_BY", "Person"), ("ACTED_IN", "Person")]],
+        }
+
+    @property
+    def get_schema(self) -> str:
+        return self.schema
+
+    @property
+    def get_structured_schema(self) -> dict:
+        return self.structured_schema
+
+    def refresh_schema(self) -> None:
+        pass
+
+    def add_graph_documents(self, graph_documents, include_source: bool = False) -> None:
+        raise NotImplementedError("FakeGraph is read-only")
+
+    def query(self, query: str, params: Optional[dict] = None, *args: Any, **kwargs: Any) -> List[dict]:
+        with metrics.stage("neo4j.query"):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+            return self._run(query, params or {})[: self.max_rows]
+
+    def _run(self, cypher: str, params: dict) -> List[dict]:
+        literals = [a or b for a, b in re.findall(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'', cypher)]
+        literals += [v for v in params.values() if isinstance(v, str)]
+        literal = literals[0].lower() if literals else ""
+
+        year = re.search(r"\.year\s*=\s*(\d{4})", cypher)
+        if year:
+            return [{"title": m["title"]} for m in self.movies if m["year"] == int(year.group(1))]
+
+        rel = re.search(r"\[:(\w+)\]", cypher)
+        rel = rel.group(1) if rel else None
+        if rel == "HAS_GENRE":
+            genre = next((g for g in self.genres if g.lower() == literal), None)
+            if genre:
+                return [{"title": m["title"]} for m in self.movies if genre in m["genres"]]
+            return [{"genre": g} for m in self.movies if m["title"].lower() == literal for g in m["genres"]]
+        if rel in ROLE_FIELDS:
+            field = ROLE_FIELDS[rel]
+            return [{"name": p} for m in self.movies if m["title"].lower() == literal for p in m[field]]
+        return [{"title": m["title"], "year": m["year"], "imdb_rating": m["imdb_rating"]}
+                for m in self.movies if literal in m["title"].lower()]
+
+    def run_fastpath(self, cypher: str, params: dict) -> List[dict]:
+        """Query runner for modules.fastpath: answers its prewritten queries over the fixtures."""
+        from modules.fastpath import CYPHER, ENTITY_QUERIES
+
+        with metrics.stage("neo4j.query"):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+            if cypher == ENTITY_QUERIES["MOVIE"]:
+                return [{"name": m["title"], "imdb_id": m["imdb_id"], "year": m["year"]} for m in self.movies]
+            if cypher == ENTITY_QUERIES["PERSON"]:
+                return [{"name": p} for p in sorted({p for m in self.movies for f in ROLE_FIELDS.values() for p in m[f]})]
+            if cypher == ENTITY_QUERIES["GENRE"]:
+                return [{"name": g} for g in self.genres]
+            if cypher == ENTITY_QUERIES["AWARD"]:
+                return []
+
+            intent = next((name for name, text in CYPHER.items() if text == cypher), None)
+            limit = params.get("limit", self.max_rows)
+            role = {"movie_cast": "cast", "movie_directors": "directors", "movie_writers": "writers",
+                    "movie_genres": "genres", "person_directed": "directors", "person_acted": "cast",
+                    "person_wrote": "writers"}.get(intent)
+            if intent in ("movie_cast", "movie_directors", "movie_writers", "movie_genres"):
+                rows = [{"imdb_id": m["imdb_id"], "name": name} for m in self.movies
+                        if m["imdb_id"] in params["imdb_ids"] for name in m[role]]
+                return sorted(rows, key=lambda r: r["name"])[:limit]
+            if intent in ("person_directed", "person_acted", "person_wrote"):
+                rows = [{"title": m["title"], "year": m["year"]} for m in self.movies if params["name"] in m[role]]
+                return sorted(rows, key=lambda r: -r["year"])[:limit]
+            if intent in ("genre_movies", "top_rated_year", "year_movies"):
+                rows = [{"title": m["title"], "year": m["year"], "rating": m["imdb_rating"]} for m in self.movies
+                        if (params["name"] in m["genres"] if intent == "genre_movies" else m["year"] == params["year"])]
+                return sorted(rows, key=lambda r: -r["rating"])[:limit]
+            return []  # movie_awards: the fixtures have no awards
+
+
+class HashEmbeddingService:
+    """Bag-of-words hashing vectors; same interface as modules.embeddings.EmbeddingService."""
+
+    def __init__(self, model_name: str = "bench-hash", dimension: int = 64):
+        self.model_name = model_name
+        self._dimension = dimension
+        self.stats = {"model_calls": 0, "texts": 0, "queued_requests": 0, "cache_hits": 0, "cache_misses": 0}
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def encode(self, texts) -> np.ndarray:
+        texts = list(texts)
+        self.stats["model_calls"] += 1
+        self.stats["texts"] += len(texts)
+        out = np.zeros((len(texts), self._dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in TOKEN_RE.findall(text.lower()):
+                out[i, zlib.crc32(token.encode("utf-8")) % self._dimension] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1, norms)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+
+class KeywordRetriever(BaseRetriever):
+    """Top-k documents by token overlap with the question; replaces the FAISS retriever."""
+
+    documents: List[Document]
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        words = set(TOKEN_RE.findall(query.lower()))
+        scored = []
+        for i, doc in enumerate(self.documents):
+            overlap = len(words & set(TOKEN_RE.findall(doc.page_content.lower())))
+            if overlap:
+                scored.append((-overlap, i, doc))
+        scored.sort(key=lambda item: item[:2])
+        return [doc for _, _, doc in scored[: self.k]]
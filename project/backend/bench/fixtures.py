@@ -0,0 +1,122 @@
+# bench/fixtures.py
+"""Small deterministic dataset and the question bank generated from it."""
+import random
+
+GENRES = ["Drama", "Comedy", "Thriller", "Sci-Fi", "Horror", "Romance", "Action", "Animation"]
+FIRST_NAMES = ["Ava", "Ben", "Cleo", "Dev", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonah", "Kira", "Luca"]
+LAST_NAMES = ["Alvarez", "Brooks", "Chen", "Duarte", "Eriksen", "Fontaine", "Gupta", "Hale", "Ibarra", "Jensen"]
+ADJECTIVES = ["Silent", "Crimson", "Last", "Hidden", "Broken", "Golden", "Midnight", "Distant", "Wild", "Frozen"]
+NOUNS = ["Harbor", "Signal", "Garden", "Orbit", "Witness", "Empire", "River", "Machine", "Letter", "Summer"]
+SENTIMENTS = ["positive", "negative", "neutral", "mixed"]
+
+
+def build_dataset(n_movies=60, seed=7):
+    """Movies with genres, directors, writers and cast, plus every person involved."""
+    rng = random.Random(seed)
+    people = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    titles = [f"The {adj} {noun}" for adj in ADJECTIVES for noun in NOUNS]
+    rng.shuffle(titles)
+
+    movies = []
+    for i, title in enumerate(titles[:n_movies]):
+        cast = rng.sample(people, 3)
+        movies.append({
+            "imdb_id": f"tt{1000000 + i}",
+            "title": title,
+            "year": rng.randint(1980, 2022),
+            "imdb_rating": round(rng.uniform(4.5, 9.0), 1),
+            "imdb_votes": rng.randint(1_000, 900_000),
+            "budget": rng.randint(1, 200) * 1_000_000,
+            "opening_weekend": rng.randint(1, 90) * 1_000_000,
+            "genres": rng.sample(GENRES, rng.randint(1, 2)),
+            "directors": [rng.choice(people)],
+            "writers": rng.sample(people, rng.randint(1, 2)),
+            "cast": cast,
+            "plot": f"A {rng.choice(ADJECTIVES).lower()} story about {cast[0]} and a {rng.choice(NOUNS).lower()}.",
+        })
+    return {"movies": movies, "people": sorted({p for m in movies for p in m["directors"] + m["writers"] + m["cast"]})}
+
+
+QUESTION_TEMPLATES = [
+    "Who directed {title}?",
+    "Who acted in {title}?",
+    "Who wrote {title}?",
+    "Which genre is {title}?",
+    "What movies were released in {year}?",
+    "List {genre} movies",
+    "What is the sentiment of characters in {title}?",
+]
+
+
+def question_bank(dataset, n=500, seed=11, repeat_ratio=0.3):
+    """
+    n questions over the dataset. With probability repeat_ratio a question
+    repeats an earlier one, so caches see a realistic share of duplicates.
+    """
+    rng = random.Random(seed)
+    movies = dataset["movies"]
+    questions = []
+    for _ in range(n):
+        if questions and rng.random() < repeat_ratio:
+            questions.append(rng.choice(questions))
+            continue
+        movie = rng.choice(movies)
+        template = rng.choice(QUESTION_TEMPLATES)
+        questions.append(template.format(title=movie["title"], year=movie["year"], genre=rng.choice(GENRES)))
+    return questions
+
+
+def sentiment_rows(dataset, seed=13):
+    """Rows shaped like processed_sentiment/character_sentiment.csv."""
+    rng = random.Random(seed)
+    rows = []
+    for movie in dataset["movies"]:
+        for person in movie["cast"]:
+            character = person.split()[0].upper()
+            rows.append({
+                "movie": movie["title"],
+                "character": character,
+                "sentiment": rng.choice(SENTIMENTS),
+                "score": round(rng.uniform(-1, 1), 3),
+                "lines": rng.randint(5, 400),
+            })
+    return rows
+
+
+def rag_passages(dataset):
+    """One short passage per movie for the /rag retriever."""
+    return [
+        f"{m['title']} ({m['year']}) is a {' and '.join(m['genres'])} film directed by "
+        f"{', '.join(m['directors'])}, starring {', '.join(m['cast'])}. {m['plot']}"
+        for m in dataset["movies"]
+    ]
+
+
+def dialogue_chunks(dataset, per_character=3):
+    """(ids, documents, metadatas) in the layout utils/embed_pipeline.py writes to Chroma."""
+    ids, documents, metadatas = [], [], []
+    for movie in dataset["movies"]:
+        for person in movie["cast"]:
+            character = person.split()[0].upper() + "_text"
+            for i in range(per_character):
+                ids.append(f"{movie['title'].replace(' ', '_')}_{movie['imdb_id']}__{character}__{i}")
+                documents.append(f"{character[:-5]} talks about the {movie['title'].split()[-1].lower()} "
+                                 f"in scene {i + 1} of {movie['title']}.")
+                metadatas.append({"imdb_id": movie["imdb_id"], "movie": movie["title"], "character": character,
+                                  "filename": f"{character}.txt", "chunk_index": i})
+    return ids, documents, metadatas
+
+
+def metacritic_payloads(dataset):
+    """Request bodies for /metacritic, one per movie."""
+    return [
+        {
+            "year": m["year"],
+            "imdb_rating": m["imdb_rating"],
+            "imdb_votes": m["imdb_votes"],
+            "budget": m["budget"],
+            "opening_weekend": m["opening_weekend"],
+            "text": m["plot"],
+        }
+        for m in dataset["movies"]
+    ]
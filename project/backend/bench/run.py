@@ -0,0 +1,326 @@
+# bench/run.py
+"""
+Runs the benchmark scenarios against the Flask app with every external
+service replaced by bench.fakes, and writes latency percentiles per scenario.
+
+    python -m bench.run --out baseline.json
+    python -m bench.run --compare baseline.json --max-regression 0.15
+
+Scenarios: chat (/chat through the fast path, or the agent and the graph QA
+chain; --fast-path off forces the latter), rag (/rag
+streaming), metacritic, metacritic_batch, csv (CSVQuery tool) and chroma
+(ChromaVectorDB tool over a temp-dir collection). A scenario whose setup fails,
+e.g. metacritic without the trained model files, is reported as skipped.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import fixtures
+
+SCENARIOS = ["chat", "rag", "metacritic", "metacritic_batch", "csv", "chroma"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline latency benchmark for the backend.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per scenario.")
+    parser.add_argument("--movies", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat-ratio", type=float, default=0.3,
+                        help="Share of questions that repeat an earlier one.")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0)
+    parser.add_argument("--token-delay-ms", type=float, default=2.0)
+    parser.add_argument("--graph-latency-ms", type=float, default=2.0)
+    parser.add_argument("--answer-cache", choices=["on", "off"], default="off")
+    parser.add_argument("--fast-path", choices=["on", "off"], default="on",
+                        help="Answer template questions with Cypher instead of the agent.")
+    parser.add_argument("--singleflight", choices=["on", "off"], default="off",
+                        help="Coalesce identical in-flight /chat and /rag requests.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Movies per /metacritic/batch request.")
+    parser.add_argument("--out", default=None, help="Write the results here as JSON.")
+    parser.add_argument("--compare", default=None, help="Earlier results to compare p95 latencies against.")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="Allowed p95 slowdown vs --compare, as a fraction; exit 1 beyond it.")
+    return parser.parse_args(argv)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return round(sorted_values[index], 2)
+
+
+def summarize(latencies_ms, errors, wall_seconds, stages):
+    ordered = sorted(latencies_ms)
+    return {
+        "requests": len(latencies_ms),
+        "errors": errors,
+        "rps": round(len(latencies_ms) / wall_seconds, 2) if wall_seconds else None,
+        "p50_ms": percentile(ordered, 50),
+        "p95_ms": percentile(ordered, 95),
+        "p99_ms": percentile(ordered, 99),
+        "mean_ms": round(sum(ordered) / len(ordered), 2) if ordered else None,
+        "max_ms": round(ordered[-1], 2) if ordered else None,
+        "stages": stages,
+    }
+
+
+class Bench:
+    """Builds the fakes, installs them into the app's modules and runs scenarios."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="cinegraph-bench-")
+        self.dataset = fixtures.build_dataset(args.movies, args.seed)
+        self.questions = fixtures.question_bank(self.dataset, args.requests + args.warmup,
+                                                seed=args.seed + 4, repeat_ratio=args.repeat_ratio)
+        self.skipped = {}
+        self.setup_errors = {}
+        self._local = threading.local()
+
+        # Must be in place before app (and the modules it imports) read their config.
+        os.environ["ANSWER_CACHE_ENABLED"] = "1" if args.answer_cache == "on" else "0"
+        os.environ["ANSWER_CACHE_PATH"] = ""
+        os.environ["FASTPATH_ENABLED"] = "1" if args.fast_path == "on" else "0"
+        os.environ["SINGLEFLIGHT_ENABLED"] = "1" if args.singleflight == "on" else "0"
+        os.environ["CYPHER_CACHE_PATH"] = ""
+        os.environ["WARMUP_ON_START"] = "0"
+        os.environ["CHECKPOINT_BACKEND"] = "memory"
+        os.environ["CHROMA_PATH"] = os.path.join(self.workdir, "chroma")
+        os.environ.setdefault("GROQ_API_KEY", "bench-offline")  # never used, the fakes answer
+
+        from bench.fakes import FakeChatModel
+        from modules import metrics
+
+        self.llm = FakeChatModel(latency_ms=args.llm_latency_ms, token_delay_ms=args.token_delay_ms,
+                                 callbacks=[metrics.LLMMetricsCallback()])
+
+    # --- setup ------------------------------------------------------------
+
+    def setup(self, scenarios):
+        import app as flask_app
+
+        self.app = flask_app.app
+        steps = {
+            "chat": self._setup_agent,
+            "rag": self._setup_chatbot,
+            "metacritic": self._setup_metacritic,
+            "metacritic_batch": self._setup_metacritic,
+            "csv": self._setup_csv,
+            "chroma": self._setup_chroma,
+        }
+        for name in scenarios:
+            step = steps[name]
+            if step not in self.setup_errors:
+                try:
+                    step()
+                    self.setup_errors[step] = None
+                except Exception as e:
+                    traceback.print_exc()
+                    self.setup_errors[step] = f"{type(e).__name__}: {e}"
+            if self.setup_errors[step]:
+                self.skipped[name] = self.setup_errors[step]
+
+    def _setup_agent(self):
+        from bench.fakes import FakeGraph
+        from modules import agent
+        from modules.fastpath import fast_path
+        from modules.checkpoint import make_checkpointer
+        from modules.registry import registry
+
+        graph = FakeGraph(self.dataset, latency_ms=self.args.graph_latency_ms)
+        agent.set_graph_qa(agent.build_graph_qa(graph, self.llm))
+        agent.cypher_cache.clear()
+        fast_path.query_runner = graph.run_fastpath
+        fast_path.invalidate()
+        app = agent.build_agent(self.llm, agent.tools, checkpointer=make_checkpointer(),
+                                pre_model_hook=agent.trim_history)
+        registry.override("agent", app)
+
+    def _setup_chatbot(self):
+        from langchain_core.documents import Document
+        from bench.fakes import KeywordRetriever
+        from modules.chatbot import ChatBot, LLMWrapper
+        from modules import metrics
+        from modules.registry import registry
+
+        docs = [Document(page_content=text) for text in fixtures.rag_passages(self.dataset)]
+        llm = self.llm.model_copy(update={"callbacks": [metrics.LLMMetricsCallback("llm.rag")]})
+        registry.override("chatbot", ChatBot.from_components(KeywordRetriever(documents=docs),
+                                                             LLMWrapper(None, llm=llm)))
+
+    def _setup_metacritic(self):
+        from modules.registry import registry
+        registry.get("metacritic")  # the real model; skipped when its files are missing
+
+    def _setup_csv(self):
+        from modules import csv_tool
+
+        rows = fixtures.sentiment_rows(self.dataset, seed=self.args.seed + 6)
+        path = os.path.join(self.workdir, "character_sentiment.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        csv_tool.CSV_PATH = path
+        csv_tool._table = None
+
+    def _setup_chroma(self):
+        from bench.fakes import HashEmbeddingService
+        from modules import chroma_client
+        from modules.embeddings import set_embedding_service
+
+        set_embedding_service(chroma_client.EMBEDDING_MODEL, HashEmbeddingService(chroma_client.EMBEDDING_MODEL))
+        chroma_client.CHROMA_PATH = os.environ["CHROMA_PATH"]
+        chroma_client._collection = None
+        ids, documents, metadatas = fixtures.dialogue_chunks(self.dataset)
+        service = HashEmbeddingService()
+        chroma_client.get_collection().upsert(ids=ids, documents=documents, metadatas=metadatas,
+                                              embeddings=service.encode(documents).tolist())
+
+    # --- requests -----------------------------------------------------------
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def _post(self, path, body):
+        response = self._client().post(path, json=body)
+        response.get_data()  # drains streamed bodies
+        return response.status_code == 200
+
+    def request_fn(self, name):
+        payloads = fixtures.metacritic_payloads(self.dataset)
+        if name == "chat":
+            return lambda i: self._post("/chat", {"message": self.questions[i], "session_id": f"bench-{i}"})
+        if name == "rag":
+            return lambda i: self._post("/rag", {"question": self.questions[i]})
+        if name == "metacritic":
+            return lambda i: self._post("/metacritic", payloads[i % len(payloads)])
+        if name == "metacritic_batch":
+            batch = [payloads[j % len(payloads)] for j in range(self.args.batch_size)]
+            return lambda i: self._post("/metacritic/batch", {"movies": batch})
+        if name == "csv":
+            from modules.csv_tool import query_csv
+            return lambda i: not query_csv(self.questions[i]).startswith("[CSV tool error]")
+        if name == "chroma":
+            from modules.chroma_client import query_chroma
+            return lambda i: not query_chroma(self.questions[i]).startswith("[VectorDB tool error]")
+        raise KeyError(name)
+
+    def run_scenario(self, name):
+        from modules import metrics
+
+        fn = self.request_fn(name)
+        for i in range(self.args.warmup):
+            fn(self.args.requests + i)
+
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+
+        def one(i):
+            started = time.perf_counter()
+            try:
+                ok = fn(i)
+            except Exception:
+                traceback.print_exc()
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+        before = metrics.stage_seconds.totals()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(one, range(self.args.requests)))
+        wall = time.perf_counter() - started
+
+        stages = {}
+        for key, (total, count) in metrics.stage_seconds.totals().items():
+            prev_total, prev_count = before.get(key, (0.0, 0))
+            if count > prev_count:
+                stages[key[0]] = {"count": count - prev_count,
+                                  "mean_ms": round((total - prev_total) / (count - prev_count) * 1000, 2)}
+        return summarize(latencies, errors[0], wall, dict(sorted(stages.items())))
+
+    def config(self):
+        return {k: v for k, v in vars(self.args).items() if k not in ("out", "compare")}
+
+
+def compare(results, baseline, max_regression):
+    """p95 regressions beyond max_regression, as printable lines."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not before.get("p95_ms") or not current.get("p95_ms"):
+            continue
+        change = current["p95_ms"] / before["p95_ms"] - 1
+        line = f"{name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms ({change:+.1%})"
+        print(f"[BENCH] {line}")
+        if change > max_regression:
+            regressions.append(line)
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    bench = Bench(args)
+    bench.setup(scenarios)
+
+    results = {"commit": git_commit(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "config": bench.config(), "scenarios": {}, "skipped": bench.skipped}
+    for name in scenarios:
+        if name in bench.skipped:
+            print(f"[BENCH] {name}: skipped ({bench.skipped[name]})")
+            continue
+        summary = bench.run_scenario(name)
+        results["scenarios"][name] = summary
+        print(f"[BENCH] {name}: p50={summary['p50_ms']}ms p95={summary['p95_ms']}ms "
+              f"p99={summary['p99_ms']}ms rps={summary['rps']} errors={summary['errors']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[BENCH] Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"[BENCH] p95 regressed by more than {args.max_regression:.0%}:\n  " + "\n  ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
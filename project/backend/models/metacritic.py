@@ -1,11 +1,25 @@
+import os
 import pickle
 import numpy as np
 import pandas as pd
 import re
+from scipy import sparse
 
-VECTORIZER_PATH = r"C:\Users\anura\OneDrive\Desktop\NPN Hackathon\Project\backend\models\tfidf_vectorizer.pkl"
-MODEL_PATH = r"C:\Users\anura\OneDrive\Desktop\NPN Hackathon\Project\backend\models\xgboost_model.pkl"
-TRAIN_DATA_PATH = r"C:\Users\anura\OneDrive\Desktop\NPN Hackathon\Project\backend\models\data\data.csv"
+from modules import metrics
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VECTORIZER_PATH = os.getenv("METACRITIC_VECTORIZER_PATH", os.path.join(MODELS_DIR, "tfidf_vectorizer.pkl"))
+MODEL_PATH = os.getenv("METACRITIC_MODEL_PATH", os.path.join(MODELS_DIR, "xgboost_model.pkl"))
+TRAIN_DATA_PATH = os.getenv("METACRITIC_TRAIN_DATA_PATH", os.path.join(MODELS_DIR, "data", "data.csv"))
+
+# Rows densified per model.predict call. The model was trained on dense input,
+# where a 0 is a value; XGBoost treats unstored CSR entries as *missing*, so the
+# sparse matrix is densified in bounded slices instead of handed over as-is.
+PREDICT_CHUNK_ROWS = int(os.getenv("METACRITIC_PREDICT_CHUNK_ROWS", "1024"))
+
+NUM_FEATURES = ["year", "imdb user rating", "number of imdb user votes", "budget", "opening weekend"]
+TEXT_FEATURE = "text"
 
 with open(VECTORIZER_PATH, "rb") as f:
     tfidf_vectorizer = pickle.load(f)
@@ -14,6 +28,23 @@ with open(MODEL_PATH, "rb") as f:
     model = pickle.load(f)
 
 
+def _load_feature_schema():
+    """
+    Column order of the training data. Only the header is read, once, at import;
+    without the training CSV the model's own inputs define the schema.
+    """
+    columns = []
+    if os.path.exists(TRAIN_DATA_PATH):
+        columns = list(pd.read_csv(TRAIN_DATA_PATH, nrows=0).columns)
+    for col in NUM_FEATURES + [TEXT_FEATURE]:
+        if col not in columns:
+            columns.append(col)
+    return columns
+
+
+FEATURE_COLUMNS = _load_feature_schema()
+
+
 def clean_money(x):
     if pd.isna(x):
         return np.nan
@@ -23,22 +54,15 @@ def clean_money(x):
     return x
 
 
-def process_userinput(user_input):
+def process_batch(user_inputs):
     """
-    Processes user input for movie metascore prediction.
-    Ensures consistency with training dataset.
+    Processes a list of user inputs (dicts) into one DataFrame laid out like the
+    training dataset.
     """
-    # Convert user input to a DataFrame
-    new_data_df = pd.DataFrame([user_input])
-    df = pd.read_csv(TRAIN_DATA_PATH)
+    new_data_df = pd.DataFrame(list(user_inputs))
 
-    # Add missing columns
-    for col in df.columns:
-        if col not in new_data_df.columns:
-            new_data_df[col] = np.nan
-
-    # Reorder columns
-    new_data_df = new_data_df[df.columns]
+    # Add missing columns and reorder in one pass
+    new_data_df = new_data_df.reindex(columns=FEATURE_COLUMNS)
 
     # Clean numeric fields
     new_data_df["budget"] = new_data_df["budget"].apply(clean_money)
@@ -51,23 +75,57 @@ def process_userinput(user_input):
     return new_data_df
 
 
+def process_userinput(user_input):
+    """
+    Processes user input for movie metascore prediction.
+    Ensures consistency with training dataset.
+    """
+    return process_batch([user_input])
+
+
+def build_features(preprocessed_data):
+    """
+    Builds one sparse (CSR) feature matrix for all rows: numeric features
+    followed by the TF-IDF columns.
+    """
+    X_num = sparse.csr_matrix(preprocessed_data[NUM_FEATURES].fillna(0).astype(float).values)
+    X_text = tfidf_vectorizer.transform(preprocessed_data[TEXT_FEATURE].fillna("").astype(str))
+    return sparse.hstack([X_num, X_text], format="csr")
+
+
+def predict_features(X, chunk_rows=PREDICT_CHUNK_ROWS):
+    """
+    Runs the model over a feature matrix from build_features(), one predict call
+    per chunk_rows rows.
+    """
+    n_rows = X.shape[0]
+    if n_rows == 0:
+        return np.empty(0)
+    if n_rows <= chunk_rows:
+        return model.predict(X.toarray())
+    parts = [model.predict(X[i:i + chunk_rows].toarray()) for i in range(0, n_rows, chunk_rows)]
+    return np.concatenate(parts)
+
+
 def predict_metascore(preprocessed_data):
     """
     Predicts the metascore for preprocessed movie data.
 
     Args:
-        preprocessed_data: A pandas DataFrame from process_userinput()
+        preprocessed_data: A pandas DataFrame from process_userinput() or process_batch()
 
     Returns:
         A NumPy array of predicted metascores.
     """
-    num_features = ["year", "imdb user rating", "number of imdb user votes", "budget", "opening weekend"]
-    X_num_new = preprocessed_data[num_features].fillna(0)
+    with metrics.stage("metacritic.features"):
+        X = build_features(preprocessed_data)
+    with metrics.stage("metacritic.predict"):
+        return predict_features(X)
 
-    X_text_new = tfidf_vectorizer.transform(preprocessed_data["text"].fillna("")).toarray()
-
-    X_new = np.hstack([X_num_new.values, X_text_new])
-
-    predictions = model.predict(X_new)
-    return predictions
 
+def predict_metascores(user_inputs):
+    """
+    Batch API: scores a list of movie dicts (same keys as process_userinput) with
+    one feature build and as few model calls as possible.
+    """
+    return predict_metascore(process_batch(user_inputs))
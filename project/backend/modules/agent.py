@@ -1,13 +1,12 @@
 # combined_agent.py
 import re
 import os
+import time
+import threading
 from typing import List, TypedDict
 import json
 from dotenv import load_dotenv
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-print("Current Working Directory:", os.getcwd())
-
 load_dotenv()
 
 # Neo4j / Graph QA LLM
@@ -15,8 +14,15 @@ from langchain_neo4j import Neo4jGraph, GraphCypherQAChain
 from langchain_groq import ChatGroq
 from langchain.tools import Tool
 from langchain.prompts import PromptTemplate
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.messages.utils import trim_messages, count_tokens_approximately
 from modules.csv_tool import csv_tool
+from modules.cypher_cache import CypherCache
+from modules.cypher_guard import CypherGuard, cap_context, CYPHER_TIMEOUT
+from modules.graph_schema import SchemaSnapshot, GRAPH_SCHEMA_COMPACT
+from modules.http_clients import get_sync_client, get_async_client
+from modules import metrics, turn_store
 
 
 
@@ -24,9 +30,9 @@ from modules.csv_tool import csv_tool
 # from modules.chroma_client import chroma_tool
 
 # LangGraph
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.prebuilt import create_react_agent
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from modules.agent_graph import build_agent, run_tool_calls
+from modules.checkpoint import make_checkpointer
 
 def clean_response(output: str) -> str:
     return re.sub(r"<think>.*?</think>", "", output, flags=re.DOTALL).strip()
@@ -36,14 +42,19 @@ NEO4J_URL = os.getenv("NEO4J_URL", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "12345678")
 NEO4J_DB = os.getenv("NEO4J_DB", "moviesdb")
+# Per HTTP request to Groq; the agent also bounds each model call by the turn's remaining budget.
+GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
 
 llm = ChatGroq(
     model="deepseek-r1-distill-llama-70b",
     temperature=0.0,
     max_tokens=10000,
     max_retries=2,
-    timeout=None,
-    api_key=GROQ_API_KEY
+    timeout=GROQ_TIMEOUT,
+    api_key=GROQ_API_KEY,
+    http_client=get_sync_client(),
+    http_async_client=get_async_client(),
+    callbacks=[metrics.LLMMetricsCallback()],
 )
 
 cypher_prompt = PromptTemplate(
@@ -65,29 +76,147 @@ Return only the Cypher query, nothing else.
 )
 
 
-graph = Neo4jGraph(
-    url="bolt://localhost:7687",
-    username="neo4j",
-    password="12345678",
-    database="moviesdb"
+# Generated Cypher keyed by question; a hit skips the Cypher-generation LLM call.
+CYPHER_CACHE_SCHEMA_TTL = float(os.getenv("CYPHER_CACHE_SCHEMA_TTL", "300"))
+cypher_cache = CypherCache(
+    max_entries=int(os.getenv("CYPHER_CACHE_SIZE", "1024")),
+    path=os.getenv("CYPHER_CACHE_PATH") or None,
+    slotting=os.getenv("CYPHER_CACHE_SLOTTING", "1") == "1",
 )
+_schema_checked_at = time.monotonic()
+metrics.registry.add_collector(lambda: [
+    ("cinegraph_cypher_cache_entries", "gauge", "Cached Cypher queries.", [({}, cypher_cache.stats()["entries"])]),
+])
 
-graph_qa = GraphCypherQAChain.from_llm(
-    llm=llm,
-    graph=graph,
-    cypher_prompt=cypher_prompt,
-    response_format="text",
-    allow_dangerous_requests=True
-)
 
-def neo4j_tool_fn(question: str) -> str:
+class InstrumentedNeo4jGraph(Neo4jGraph):
+    def query(self, query, params=None, *args, **kwargs):
+        with metrics.stage("neo4j.query"):
+            return super().query(query, params or {}, *args, **kwargs)
+
+
+def _timed(stage_name, runnable):
+    """Wraps a chain step so its latency shows up as its own stage."""
+    def run(inputs, config=None):
+        with metrics.stage(stage_name):
+            return runnable.invoke(inputs, config)
+
+    async def arun(inputs, config=None):
+        with metrics.stage(stage_name):
+            return await runnable.ainvoke(inputs, config)
+
+    return RunnableLambda(run, afunc=arun, name=stage_name)
+
+
+# The Neo4j connection (and its schema read) is made on first use, not at import.
+_graph_qa = None
+_graph_lock = threading.Lock()
+
+
+def build_graph_qa(graph, model=None) -> GraphCypherQAChain:
+    chain = GraphCypherQAChain.from_llm(
+        llm=model or llm,
+        graph=graph,
+        cypher_prompt=cypher_prompt,
+        response_format="text",
+        allow_dangerous_requests=True,
+        return_intermediate_steps=True,
+    )
+    generation = chain.cypher_generation_chain
+    if GRAPH_SCHEMA_COMPACT:
+        # Only the part of the schema the question needs goes into the prompt.
+        snapshot = SchemaSnapshot(graph)
+        compact = RunnableLambda(lambda inputs: {**inputs, "schema": snapshot.for_question(inputs["question"])})
+        generation = compact | generation
+    chain.cypher_generation_chain = _timed("neo4j.cypher_generation", generation)
+    # Generated Cypher is checked (read-only, bounded, EXPLAIN cost) before it runs.
+    chain.cypher_query_corrector = CypherGuard(graph)
+    capped = RunnableLambda(lambda inputs: {**inputs, "context": cap_context(inputs["context"])})
+    chain.qa_chain = _timed("neo4j.answer_synthesis", capped | chain.qa_chain)
+    return chain
+
+
+def set_graph_qa(chain: GraphCypherQAChain):
+    """Installs the chain the Neo4j tool uses (get_graph_qa builds the real one)."""
+    global _graph_qa, _schema_checked_at
+    cypher_cache.set_schema(chain.graph.schema)
+    _schema_checked_at = time.monotonic()
+    _graph_qa = chain
+
+
+def get_graph_qa() -> GraphCypherQAChain:
+    if _graph_qa is None:
+        with _graph_lock:
+            if _graph_qa is None:
+                graph = InstrumentedNeo4jGraph(url=NEO4J_URL, username=NEO4J_USER, password=NEO4J_PASSWORD,
+                                               database=NEO4J_DB, timeout=CYPHER_TIMEOUT)
+                set_graph_qa(build_graph_qa(graph))
+    return _graph_qa
+
+
+def refresh_cypher_cache_schema(force: bool = False):
+    """Re-reads the graph schema (at most every CYPHER_CACHE_SCHEMA_TTL seconds)."""
+    global _schema_checked_at
+    if not force and time.monotonic() - _schema_checked_at < CYPHER_CACHE_SCHEMA_TTL:
+        return
+    _schema_checked_at = time.monotonic()
     try:
-        raw = graph_qa.invoke(question)
-        return clean_response(raw)
+        graph = get_graph_qa().graph
+        graph.refresh_schema()
+        cypher_cache.set_schema(graph.schema)
     except Exception as e:
+        print(f"[CYPHER_CACHE] Schema refresh failed: {e}")
+
+
+def run_cached_cypher(cypher: str):
+    """Rows of a cached (possibly slot-filled) query, after the same guard generated Cypher gets; None if rejected."""
+    graph_qa = get_graph_qa()
+    guarded = graph_qa.cypher_query_corrector(cypher)
+    if not guarded:
+        return None
+    return graph_qa.graph.query(guarded)[: graph_qa.top_k]
+
+
+def answer_from_cypher(question: str, cypher: str, rows: list) -> str:
+    """Lets the QA prompt phrase rows of known Cypher, as GraphCypherQAChain would."""
+    graph_qa = get_graph_qa()
+    context = cap_context(rows)
+    turn_store.note("Neo4jGraphQA", question=question, cypher=cypher, rows=context)
+    result = graph_qa.qa_chain.invoke({"question": question, "context": context})
+    # Older langchain versions wrap the QA step in an LLMChain that returns {"text": ...}
+    return result.get("text", "") if isinstance(result, dict) else result
+
+
+def neo4j_tool_fn(question: str) -> str:
+    metrics.tool_calls_total.inc(tool="Neo4jGraphQA")
+    try:
+        with metrics.stage("tool.Neo4jGraphQA"):
+            return _neo4j_answer(question)
+    except Exception as e:  # already counted as an error by metrics.stage
         return f"[Neo4j tool error] {type(e).__name__}: {e}"
 
 
+def _neo4j_answer(question: str) -> str:
+    graph_qa = get_graph_qa()
+    refresh_cypher_cache_schema()
+    # A cached query that finds nothing (e.g. a slot filled as 'inception') falls through to generation.
+    cached = cypher_cache.resolve(question, run_cached_cypher)
+    metrics.cache_requests_total.inc(cache="cypher", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return clean_response(answer_from_cypher(question, *cached))
+
+    raw = graph_qa.invoke({graph_qa.input_key: question})
+    steps = raw.get("intermediate_steps") or []
+    cypher = steps[0].get("query") if steps else None
+    context = steps[1].get("context") if len(steps) > 1 else None
+    if cypher:
+        turn_store.note("Neo4jGraphQA", question=question, cypher=cypher, rows=cap_context(context or []))
+    # Only keep Cypher that ran and found something.
+    if cypher and context:
+        cypher_cache.store(question, cypher)
+    return clean_response(raw[graph_qa.output_key])
+
+
 neo4j_tool = Tool(
     name="Neo4jGraphQA",
     func=neo4j_tool_fn,
@@ -123,10 +252,75 @@ class AgentState(TypedDict):
     output: str
 
 
-memory = MemorySaver()
+# Per-thread history budget; older turns are dropped from the stored state.
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "6000"))
+
+
+def trim_history(state):
+    """
+    Keeps the system prompt plus the newest turns that fit HISTORY_MAX_TOKENS,
+    and rewrites the thread's state so it stops growing. The current turn (the
+    last human message and everything after it) is always kept, even when it
+    alone is over the budget; only older turns are dropped.
+    """
+    metrics.agent_iterations_total.inc()  # runs once before every agent model call
+    messages = state["messages"]
+    last_human = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), None)
+    if last_human is None:
+        return {"llm_input_messages": messages}
+    system = [m for m in messages[:1] if isinstance(m, SystemMessage)]
+    earlier, current = messages[len(system):last_human], messages[last_human:]
+    budget = HISTORY_MAX_TOKENS - count_tokens_approximately(system + current)
+    kept = trim_messages(
+        earlier,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        max_tokens=budget,
+        start_on="human",
+    ) if earlier and budget > 0 else []
+    if len(kept) == len(earlier):
+        return {"llm_input_messages": messages}
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *system, *kept, *current]}
+
+
+memory = make_checkpointer()
 
 tools = [neo4j_tool, ]
-app = create_react_agent(model=llm, tools=tools, checkpointer=memory,)
+app = build_agent(llm, tools, checkpointer=memory, pre_model_hook=trim_history)
+
+
+# Tool rounds a /feedback re-synthesis may add on top of the stored results.
+RETRY_MAX_TOOL_ROUNDS = int(os.getenv("RETRY_MAX_TOOL_ROUNDS", "2"))
+
+
+def resynthesize(messages, max_tool_rounds: int = RETRY_MAX_TOOL_ROUNDS):
+    """
+    Answers from messages that already carry a turn's tool results (service.retry_messages).
+    Tools run only for calls the model makes now; the last round has no tools
+    bound, so it must answer. Returns (answer, new tool calls).
+    """
+    get_graph_qa()
+    tools_by_name = {t.name: t for t in tools}
+    with_tools = llm.bind_tools(tools)
+    new_calls = []
+    with metrics.stage("agent.resynthesize"):
+        for round_no in range(max_tool_rounds + 1):
+            metrics.agent_iterations_total.inc()
+            reply = (with_tools if round_no < max_tool_rounds else llm).invoke(messages)
+            if not getattr(reply, "tool_calls", None):
+                break
+            results = run_tool_calls(tools_by_name, reply.tool_calls)
+            messages = messages + [reply] + results
+            for call, result in zip(reply.tool_calls, results):
+                new_calls.append({"id": call["id"], "name": call["name"], "args": call.get("args") or {},
+                                  "output": result.content})
+    return clean_response(reply.content), new_calls
+
+
+def get_agent():
+    """The compiled agent, with the Neo4j connection already open."""
+    get_graph_qa()
+    return app
 
 
 
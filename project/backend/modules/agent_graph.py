@@ -0,0 +1,253 @@
+# modules/agent_graph.py
+"""
+The tool-calling agent as a LangGraph StateGraph (start -> agent <-> tools).
+
+Unlike create_react_agent it keeps every request on a clock:
+- the tool calls of one model step run in parallel, each with its own deadline
+  (AGENT_TOOL_TIMEOUT, or AGENT_TOOL_TIMEOUT_<TOOL> e.g. AGENT_TOOL_TIMEOUT_NEO4JGRAPHQA);
+- the whole turn has AGENT_REQUEST_BUDGET seconds. Tools are cut short so that
+  AGENT_ANSWER_RESERVE seconds stay for the final model call, and model calls
+  are bounded by what is left;
+- a tool that times out answers "timed out" and the model works with the rest.
+  When there is no time left for the model, the answer is built from the tool
+  results gathered so far and marked partial (finish_reason "deadline").
+
+Each tool call is timed as stage agent.tool.<name> and counted by outcome in
+cinegraph_agent_tool_calls_total.
+"""
+import os
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Annotated, Callable, Dict, List, Optional, TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+
+from modules import metrics
+
+AGENT_REQUEST_BUDGET = float(os.getenv("AGENT_REQUEST_BUDGET", "90"))
+AGENT_TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", "30"))
+AGENT_ANSWER_RESERVE = float(os.getenv("AGENT_ANSWER_RESERVE", "15"))
+AGENT_MAX_TOOL_ROUNDS = int(os.getenv("AGENT_MAX_TOOL_ROUNDS", "5"))
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "64"))
+
+# Tool calls and sync model calls run here so they can be waited on with a timeout.
+# A call that times out keeps its worker until it returns (Neo4j and Groq calls have timeouts of their own).
+_executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix="agent-tool")
+
+
+class AgentGraphState(TypedDict):
+    messages: Annotated[list, add_messages]
+    deadline: float  # time.time() by which this turn must be answered
+
+
+def tool_timeout(name: str, default: float = AGENT_TOOL_TIMEOUT) -> float:
+    return float(os.getenv(f"AGENT_TOOL_TIMEOUT_{name.upper()}", default))
+
+
+def _turn_messages(messages) -> list:
+    """The messages after the last human message."""
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i + 1:]
+    return list(messages)
+
+
+def _tool_rounds(messages) -> int:
+    return sum(1 for m in _turn_messages(messages) if isinstance(m, AIMessage) and m.tool_calls)
+
+
+def _timed_out(message) -> bool:
+    return isinstance(message, ToolMessage) and bool(message.response_metadata.get("timed_out"))
+
+
+def is_partial(messages) -> bool:
+    """True when the last turn ran out of time somewhere (a tool or the whole budget)."""
+    turn = _turn_messages(messages)
+    if turn and isinstance(turn[-1], AIMessage) and turn[-1].response_metadata.get("finish_reason") == "deadline":
+        return True
+    return any(_timed_out(m) for m in turn)
+
+
+def partial_answer(messages) -> AIMessage:
+    """An answer from the tool results gathered so far, for when the model has no time left."""
+    found = [m.content for m in _turn_messages(messages)
+             if isinstance(m, ToolMessage) and m.status != "error" and m.content]
+    metrics.errors_total.inc(stage="agent.budget")
+    if found:
+        text = "I ran out of time before finishing the answer. Here is what I found so far:\n\n" + "\n\n".join(found)
+    else:
+        text = "Sorry, that took too long to answer. Please try again."
+    return AIMessage(content=text, response_metadata={"finish_reason": "deadline"})
+
+
+def _tool_message(call: dict, outcome: str, output, timeout: float) -> ToolMessage:
+    if outcome == "timeout":
+        return ToolMessage(content=f"[{call['name']} timed out after {timeout:.0f}s; no result]",
+                           tool_call_id=call["id"], name=call["name"], status="error",
+                           response_metadata={"timed_out": True})
+    return ToolMessage(content=str(output), tool_call_id=call["id"], name=call["name"],
+                       status="error" if outcome == "error" else "success")
+
+
+def _record(name: str, outcome: str, seconds: float):
+    metrics.observe_stage(f"agent.tool.{name}", seconds)
+    metrics.agent_tool_calls_total.inc(tool=name, result=outcome)
+
+
+def _invoke_tool(tool, call: dict, config=None):
+    """(outcome, output, seconds) for one call; errors become the tool's output, as ToolNode does."""
+    started = time.perf_counter()
+    try:
+        outcome, output = "ok", tool.invoke(call.get("args") or {}, config)
+    except Exception as e:
+        outcome, output = "error", f"[{call['name']} error] {type(e).__name__}: {e}"
+    return outcome, output, time.perf_counter() - started
+
+
+def _tool_budget(tool_name: str, deadline: Optional[float], timeouts: Dict[str, float]) -> float:
+    timeout = timeouts.get(tool_name) or tool_timeout(tool_name)
+    if deadline is not None:
+        timeout = min(timeout, deadline - AGENT_ANSWER_RESERVE - time.time())
+    return max(timeout, 0.0)
+
+
+def _unknown_tool(call: dict) -> ToolMessage:
+    return _tool_message(call, "error", f"[error] Unknown tool {call['name']}", 0)
+
+
+def run_tool_calls(tools_by_name: dict, calls: List[dict], deadline: Optional[float] = None,
+                   timeouts: Optional[Dict[str, float]] = None, config=None) -> List[ToolMessage]:
+    """Runs one model step's tool calls in parallel; one ToolMessage per call, in call order."""
+    timeouts = timeouts or {}
+    started = time.perf_counter()
+    pending = []
+    for call in calls:
+        tool = tools_by_name.get(call["name"])
+        budget = _tool_budget(call["name"], deadline, timeouts)
+        future = None
+        if tool is not None and budget > 0:
+            # Copied context: the request trace and turn_store notes follow the call into the worker.
+            future = _executor.submit(contextvars.copy_context().run, _invoke_tool, tool, call, config)
+        pending.append((call, future, budget))
+
+    out = []
+    for call, future, budget in pending:
+        if call["name"] not in tools_by_name:
+            out.append(_unknown_tool(call))
+            continue
+        try:
+            if future is None:
+                raise FutureTimeout()
+            outcome, output, seconds = future.result(timeout=max(0.0, started + budget - time.perf_counter()))
+        except FutureTimeout:
+            if future is not None:
+                future.cancel()
+            outcome, output, seconds = "timeout", None, budget
+        _record(call["name"], outcome, seconds)
+        out.append(_tool_message(call, outcome, output, budget))
+    return out
+
+
+async def arun_tool_calls(tools_by_name: dict, calls: List[dict], deadline: Optional[float] = None,
+                          timeouts: Optional[Dict[str, float]] = None, config=None) -> List[ToolMessage]:
+    """Async twin of run_tool_calls; a timed-out call is cancelled."""
+    timeouts = timeouts or {}
+
+    async def one(call):
+        tool = tools_by_name.get(call["name"])
+        if tool is None:
+            return _unknown_tool(call)
+        budget = _tool_budget(call["name"], deadline, timeouts)
+        started = time.perf_counter()
+        try:
+            output = await asyncio.wait_for(tool.ainvoke(call.get("args") or {}, config), budget)
+            outcome = "ok"
+        except asyncio.TimeoutError:
+            outcome, output = "timeout", None
+        except Exception as e:
+            outcome, output = "error", f"[{call['name']} error] {type(e).__name__}: {e}"
+        _record(call["name"], outcome, time.perf_counter() - started)
+        return _tool_message(call, outcome, output, budget)
+
+    return list(await asyncio.gather(*(one(call) for call in calls)))
+
+
+def build_agent(model, tools: list, checkpointer=None, pre_model_hook: Optional[Callable] = None,
+                request_budget: float = AGENT_REQUEST_BUDGET, max_tool_rounds: int = AGENT_MAX_TOOL_ROUNDS,
+                tool_timeouts: Optional[Dict[str, float]] = None):
+    """
+    Compiles the agent graph. pre_model_hook works as in create_react_agent: it
+    returns {"llm_input_messages": [...]} (model input only) or {"messages": [...]}
+    (rewrites the stored history).
+    """
+    tools_by_name = {t.name: t for t in tools}
+    with_tools = model.bind_tools(tools) if tools else model
+    timeouts = dict(tool_timeouts or {})
+
+    def start(state):
+        return {"deadline": time.time() + request_budget}
+
+    def _prepare(state):
+        hook = pre_model_hook(state) if pre_model_hook else {}
+        rewrite = list(hook.get("messages") or [])
+        model_input = hook.get("llm_input_messages") or \
+            [m for m in rewrite if not isinstance(m, RemoveMessage)] or state["messages"]
+        remaining = (state.get("deadline") or time.time() + request_budget) - time.time()
+        # Past the round limit, or short on time, the model must answer with what it has.
+        answer_now = (not tools or _tool_rounds(state["messages"]) >= max_tool_rounds
+                      or remaining < AGENT_ANSWER_RESERVE)
+        return rewrite, model_input, remaining, (model if answer_now else with_tools)
+
+    def call_model(state, config):
+        rewrite, model_input, remaining, runnable = _prepare(state)
+        reply = None
+        if remaining > 0:
+            future = _executor.submit(contextvars.copy_context().run, runnable.invoke, model_input, config)
+            try:
+                reply = future.result(timeout=remaining)
+            except FutureTimeout:
+                pass
+        if reply is None:
+            reply = partial_answer(state["messages"])
+        return {"messages": rewrite + [reply]}
+
+    async def acall_model(state, config):
+        rewrite, model_input, remaining, runnable = _prepare(state)
+        reply = None
+        if remaining > 0:
+            try:
+                reply = await asyncio.wait_for(runnable.ainvoke(model_input, config), remaining)
+            except asyncio.TimeoutError:
+                pass
+        if reply is None:
+            reply = partial_answer(state["messages"])
+        return {"messages": rewrite + [reply]}
+
+    def call_tools(state, config):
+        with metrics.stage("agent.tools"):
+            return {"messages": run_tool_calls(tools_by_name, state["messages"][-1].tool_calls,
+                                               state.get("deadline"), timeouts, config)}
+
+    async def acall_tools(state, config):
+        with metrics.stage("agent.tools"):
+            return {"messages": await arun_tool_calls(tools_by_name, state["messages"][-1].tool_calls,
+                                                      state.get("deadline"), timeouts, config)}
+
+    def route(state):
+        last = state["messages"][-1]
+        return "tools" if isinstance(last, AIMessage) and last.tool_calls else END
+
+    graph = StateGraph(AgentGraphState)
+    graph.add_node("start", start)
+    graph.add_node("agent", RunnableLambda(call_model, afunc=acall_model, name="agent"))
+    graph.add_node("tools", RunnableLambda(call_tools, afunc=acall_tools, name="tools"))
+    graph.add_edge(START, "start")
+    graph.add_edge("start", "agent")
+    graph.add_conditional_edges("agent", route, ["tools", END])
+    graph.add_edge("tools", "agent")
+    return graph.compile(checkpointer=checkpointer)
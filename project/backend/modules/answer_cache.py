@@ -0,0 +1,212 @@
+# modules/answer_cache.py
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from modules.cypher_cache import normalize_question
+from modules import metrics
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# When set, answers live in this SQLite file and are shared by every worker on the host.
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH") or None
+
+
+class MemoryBackend:
+    """LRU over OrderedDict, bounded by the approximate size of keys + answers."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.version = 0
+        self._items = OrderedDict()  # key -> (answer, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            answer, expires_at, size = item
+            if expires_at < time.time():
+                del self._items[key]
+                self.bytes -= size
+                return None
+            self._items.move_to_end(key)
+            return answer
+
+    def put(self, key, answer, expires_at):
+        size = len(key.encode("utf-8")) + len(answer.encode("utf-8")) + 64
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._items[key] = (answer, expires_at, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._items:
+                _, (_, _, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+
+    def get_version(self):
+        return self.version
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+            self._items.clear()
+            self.bytes = 0
+            return self.version
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._items), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+class SQLiteBackend:
+    """
+    Shared on-disk cache for several workers. The data version lives in the same
+    file, so a bump from any worker invalidates the cache for all of them.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY, answer TEXT, expires_at REAL, last_used REAL, size INTEGER)""")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('data_version', 0)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute("SELECT answer, expires_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        with conn:
+            if row[1] < now:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, answer, expires_at):
+        size = len(key.encode("utf-8")) + len(answer.encode("utf-8")) + 64
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                         (key, answer, expires_at, time.time(), size))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+            if total > self.max_bytes:
+                conn.execute("DELETE FROM answers WHERE expires_at < ?", (time.time(),))
+                # Drop the least recently used rows until back under ~90% of the budget.
+                conn.execute("""
+                    DELETE FROM answers WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS running FROM answers
+                        ) WHERE running > ?
+                    )""", (int(self.max_bytes * 0.9),))
+
+    def get_version(self):
+        return self._conn().execute("SELECT value FROM meta WHERE name = 'data_version'").fetchone()[0]
+
+    def bump_version(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'data_version'")
+            conn.execute("DELETE FROM answers")
+        return self.get_version()
+
+    def stats(self):
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers").fetchone()
+        return {"backend": "sqlite", "path": self.path, "entries": row[0], "bytes": row[1], "max_bytes": self.max_bytes}
+
+
+class AnswerCache:
+    """
+    Final /chat answers keyed by (data version, normalized question). Bumping the
+    data version (e.g. after a graph reload) invalidates everything at once.
+    """
+
+    def __init__(self, ttl=ANSWER_CACHE_TTL, max_bytes=ANSWER_CACHE_MAX_BYTES, path=ANSWER_CACHE_PATH,
+                 enabled=ANSWER_CACHE_ENABLED):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.backend = SQLiteBackend(path, max_bytes) if path else MemoryBackend(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, question, version=None):
+        return f"v{self.backend.get_version() if version is None else version}:{normalize_question(question)}"
+
+    def version(self):
+        """The data version; read it before answering and pass it to put()."""
+        return self.backend.get_version()
+
+    def get(self, question, version=None):
+        if not self.enabled:
+            return None
+        answer = self.backend.get(self._key(question, version))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.cache_requests_total.inc(cache="answer", result="miss" if answer is None else "hit")
+        return answer
+
+    def put(self, question, answer, version=None):
+        """
+        Stores under version, the data version the answer was computed against.
+        An answer started before a bump is dropped rather than filed under the
+        new version (at worst it lands under the old key, which is never read).
+        """
+        if not self.enabled or not answer or not isinstance(answer, str):
+            return
+        if version is not None and version != self.backend.get_version():
+            return
+        self.backend.put(self._key(question, version), answer, time.time() + self.ttl)
+
+    def bump_data_version(self):
+        version = self.backend.bump_version()
+        print(f"[ANSWER_CACHE] Data version bumped to {version}; cache cleared")
+        return version
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "data_version": self.backend.get_version(),
+            "ttl_seconds": self.ttl,
+            **self.backend.stats(),
+        }
+
+
+answer_cache = AnswerCache()
+
+
+def _answer_cache_metrics():
+    stats = answer_cache.backend.stats()
+    return [
+        ("cinegraph_answer_cache_entries", "gauge", "Cached /chat answers.", [({}, stats["entries"])]),
+        ("cinegraph_answer_cache_bytes", "gauge", "Approximate size of cached answers.", [({}, stats["bytes"])]),
+    ]
+
+
+metrics.registry.add_collector(_answer_cache_metrics)
@@ -0,0 +1,197 @@
+# modules/chat_stream.py
+"""
+/chat as server-sent events. The agent graph is streamed with
+stream_mode=["updates", "messages"] and turned into:
+
+    start       {"session_id", "turn_id"}               sent before any work
+    tool_start  {"id", "name", "args"}                  the model asked for a tool
+    cypher      {"tool", "cypher", "rows"}              Cypher a tool ran (from turn_store notes)
+    tool_end    {"id", "name", "status", "ms"}          a tool returned (status ok/error/timeout)
+    token       {"text", "step"}                        model text as it is produced, <think> removed
+    done        {"answer", "session_id", "turn_id", ...}
+    error       {"error"}
+
+Tokens of a step that ends in tool calls are interim (usually empty once the
+reasoning is filtered); "step" counts tool rounds so a client can start over
+when it changes, and "done" carries the final answer in full.
+"""
+import json
+import time
+import asyncio
+import threading
+from typing import List, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+STREAM_MODES = ["updates", "messages"]
+MAX_CYPHER_ROWS = 20
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class ThinkFilter:
+    """Drops <think>...</think> from text arriving in pieces; a tag may be split across pieces."""
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._inside = False
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        out = []
+        while True:
+            tag = self.CLOSE if self._inside else self.OPEN
+            i = self._buffer.find(tag)
+            if i >= 0:
+                if not self._inside:
+                    out.append(self._buffer[:i])
+                self._buffer = self._buffer[i + len(tag):]
+                self._inside = not self._inside
+                continue
+            # Hold back a tail that could be the start of the tag.
+            hold = next((n for n in range(min(len(tag) - 1, len(self._buffer)), 0, -1)
+                         if tag.startswith(self._buffer[-n:])), 0)
+            if not self._inside:
+                out.append(self._buffer[:len(self._buffer) - hold])
+            self._buffer = self._buffer[len(self._buffer) - hold:]
+            return self._visible("".join(out))
+
+    def flush(self) -> str:
+        rest, self._buffer = ("" if self._inside else self._buffer), ""
+        return self._visible(rest)
+
+    def _visible(self, text: str) -> str:
+        # Same shape as clean_response: no leading whitespace.
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+    @classmethod
+    def clean(cls, text: str) -> str:
+        f = cls()
+        return (f.feed(text or "") + f.flush()).strip()
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    # Content blocks: keep the text ones.
+    return "".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+class StepEvents:
+    """Translates agent stream output into (event, data) pairs; `notes` is the turn_store.capture() list."""
+
+    def __init__(self, notes=None):
+        self.notes = notes if notes is not None else []
+        self.step = 0
+        self._noted = 0
+        self._filters = {}
+        self._tool_started = {}
+
+    def feed(self, mode: str, chunk) -> List[Tuple[str, dict]]:
+        if mode == "messages":
+            return self._token(*chunk)
+        out = []
+        for node, update in (chunk or {}).items():
+            messages = (update.get("messages") or []) if isinstance(update, dict) else []
+            if node == "agent":
+                out += self._tool_starts(messages)
+            elif node == "tools":
+                out += self._cypher() + self._tool_ends(messages)
+        return out
+
+    def flush(self) -> List[Tuple[str, dict]]:
+        out = []
+        for f in self._filters.values():
+            text = f.flush()
+            if text:
+                out.append(("token", {"text": text, "step": self.step}))
+        self._filters.clear()
+        return out
+
+    def _token(self, message, metadata):
+        # Only the agent's own model calls; the tools' LLM calls (Cypher generation...) stay internal.
+        if metadata.get("langgraph_node") != "agent" or not isinstance(message, AIMessageChunk):
+            return []
+        f = self._filters.setdefault(message.id, ThinkFilter())
+        text = f.feed(_text(message.content))
+        return [("token", {"text": text, "step": self.step})] if text else []
+
+    def _tool_starts(self, messages):
+        out = []
+        for message in messages:
+            if isinstance(message, AIMessage) and message.tool_calls:
+                for call in message.tool_calls:
+                    self._tool_started[call["id"]] = time.perf_counter()
+                    out.append(("tool_start", {"id": call["id"], "name": call["name"], "args": call.get("args") or {}}))
+                self.step += 1
+        return out
+
+    def _cypher(self):
+        new, self._noted = self.notes[self._noted:], len(self.notes)
+        return [("cypher", {"tool": entry["tool"], "cypher": entry["cypher"],
+                            "rows": (entry.get("rows") or [])[:MAX_CYPHER_ROWS]})
+                for entry in new if entry.get("cypher")]
+
+    def _tool_ends(self, messages):
+        out = []
+        for message in messages:
+            if not isinstance(message, ToolMessage):
+                continue
+            started = self._tool_started.pop(message.tool_call_id, None)
+            status = "timeout" if message.response_metadata.get("timed_out") else \
+                ("error" if message.status == "error" else "ok")
+            out.append(("tool_end", {"id": message.tool_call_id, "name": message.name, "status": status,
+                                     "ms": round((time.perf_counter() - started) * 1000, 1) if started else None}))
+        return out
+
+
+class _Raised:
+    def __init__(self, error):
+        self.error = error
+
+
+async def iterate_in_thread(iterator):
+    """
+    Async iteration over a sync iterator that is advanced in a worker thread
+    (e.g. the sync graph's stream with the SQLite checkpointer).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in iterator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, _Raised(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    worker = asyncio.ensure_future(asyncio.to_thread(pump))
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, _Raised):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        worker.add_done_callback(lambda f: f.exception())  # nothing awaits it after a disconnect
@@ -1,55 +1,174 @@
 import os
 import time
-from typing import Generator
+import asyncio
+import threading
+from typing import AsyncIterator, Generator, Iterator, Optional
 
 from langchain_community.document_loaders import PyPDFLoader
-from utils.SemanticSplitter import SemanticSplitter
+from utils.SemanticSplitter import SemanticSplitter, pool_chunk_vectors
 
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 
 from langchain_groq import ChatGroq
 from langchain.prompts import PromptTemplate
+from langchain_core.documents import Document
+
+from modules import rag_index
+from modules.http_clients import get_sync_client, get_async_client
+from modules.embeddings import get_embeddings
+from modules import metrics
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
 
 class Config:
     def __init__(self):
         self.groq_api_key = os.getenv("GROQ_API_KEY")
         self.pdf_path = os.path.join("Question_bank", "Question_bank.pdf")
+        self.index_dir = os.getenv("RAG_INDEX_DIR", os.path.join("Question_bank", "faiss_index"))
+        # "embed": embed each chunk; "pool": average the splitter's sentence vectors instead
+        self.chunk_vectors = os.getenv("RAG_CHUNK_VECTORS", "embed")
 
 
 class DocumentLoader:
-    def __init__(self, pdf_path: str):
+    def __init__(self, pdf_path: str, splitter_model: str = DEFAULT_EMBEDDING_MODEL, threshold_type: str = "percentile",
+                 chunk_vectors: str = "embed"):
         self.pdf_path = pdf_path
+        self.splitter_model = splitter_model
+        self.threshold_type = threshold_type
+        self.chunk_vectors = chunk_vectors
 
-    def load_and_split(self):
+    def splitter_settings(self) -> dict:
+        return SemanticSplitter.settings_for(self.splitter_model, self.threshold_type, self.chunk_vectors)
+
+    def _transcript(self) -> str:
         loader = PyPDFLoader(self.pdf_path)
         documents = loader.load()
-        transcript = "\n".join([doc.page_content for doc in documents])
+        return "\n".join([doc.page_content for doc in documents])
 
-        splitter = SemanticSplitter()
-        docs = splitter.split_transcript(transcript)
+    def load_and_split(self):
+        splitter = SemanticSplitter(model_name=self.splitter_model, threshold_type=self.threshold_type)
+        docs = splitter.split_transcript(self._transcript())
         return docs
 
+    def load_split_and_pool(self):
+        """Documents plus pooled chunk vectors, with a single embedding pass over the PDF."""
+        splitter = SemanticSplitter(model_name=self.splitter_model, threshold_type=self.threshold_type)
+        chunks, spans, vectors = splitter.split_with_embeddings(self._transcript())
+        print(len(chunks))
+        return [Document(page_content=chunk) for chunk in chunks], pool_chunk_vectors(vectors, spans)
+
 
 class VectorStoreIndex:
-    def __init__(self, documents, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, documents, embedding_model: str = DEFAULT_EMBEDDING_MODEL, embeddings=None, vectorstore=None):
         self.documents = documents
         self.embedding_model = embedding_model
-        self.embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model)
-        self.vectorstore = FAISS.from_documents(self.documents, self.embeddings)
+        self.embeddings = embeddings or get_embeddings(self.embedding_model)
+        self.vectorstore = vectorstore or FAISS.from_documents(self.documents, self.embeddings)
+
+    @staticmethod
+    def key_for(pdf_path: str, embedding_model: str = DEFAULT_EMBEDDING_MODEL, chunk_vectors: str = "embed") -> str:
+        loader = DocumentLoader(pdf_path, chunk_vectors=chunk_vectors)
+        return rag_index.index_key(pdf_path, embedding_model, loader.splitter_settings())
+
+    @classmethod
+    def load_or_build(cls, pdf_path: str, index_dir: str, embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                      rebuild: bool = False, chunk_vectors: str = "embed"):
+        """
+        Loads the persisted index for this PDF/model/splitter combination, or
+        parses, splits and embeds the PDF and stores the result for next time.
+        With chunk_vectors="pool" the chunk vectors come from the splitter's
+        sentence embeddings instead of a second embedding pass.
+        """
+        loader = DocumentLoader(pdf_path, chunk_vectors=chunk_vectors)
+        key = cls.key_for(pdf_path, embedding_model, chunk_vectors)
+        embeddings = get_embeddings(embedding_model)
+        built = {}
+
+        def build():
+            if chunk_vectors == "pool":
+                documents, vectors = loader.load_split_and_pool()
+                built["documents"] = documents
+                pairs = [(doc.page_content, vec) for doc, vec in zip(documents, vectors.tolist())]
+                return FAISS.from_embeddings(pairs, embeddings, metadatas=[doc.metadata for doc in documents])
+            built["documents"] = loader.load_and_split()
+            return FAISS.from_documents(built["documents"], embeddings)
+
+        vectorstore, _ = rag_index.load_or_build(
+            index_dir, key, embeddings, build, rebuild=rebuild,
+            extra_meta={"pdf_path": pdf_path, "embedding_model": embedding_model, "chunk_vectors": chunk_vectors},
+        )
+        return cls(built.get("documents"), embedding_model, embeddings=embeddings, vectorstore=vectorstore)
 
     def get_retriever(self, k: int = 3):
         return self.vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k})
 
 
 class LLMWrapper:
-    def __init__(self, groq_api_key: str, model: str = "llama-3.1-8b-instant"):
-        self.llm = ChatGroq(groq_api_key=groq_api_key, model=model)
+    def __init__(self, groq_api_key: str, model: str = "llama-3.1-8b-instant", llm=None):
+        self.llm = llm or ChatGroq(
+            groq_api_key=groq_api_key,
+            model=model,
+            http_client=get_sync_client(),
+            http_async_client=get_async_client(),
+            callbacks=[metrics.LLMMetricsCallback("llm.rag")],
+        )
 
     def invoke(self, prompt: str):
         return self.llm.invoke(prompt)
 
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.llm.stream(prompt):
+            text = chunk.content if hasattr(chunk, "content") else str(chunk)
+            if text:
+                yield text
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        async for chunk in self.llm.astream(prompt):
+            text = chunk.content if hasattr(chunk, "content") else str(chunk)
+            if text:
+                yield text
+
+
+class StreamTimings:
+    """
+    Wall-clock marks for one streamed answer, in milliseconds since the request
+    started: retrieval done, first token out, last token out.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.retrieval_ms = None
+        self.first_token_ms = None
+        self.last_token_ms = None
+        self.chunks = 0
+        self.cancelled = False
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def mark_token(self):
+        now = self.elapsed_ms()
+        if self.first_token_ms is None:
+            self.first_token_ms = now
+        self.last_token_ms = now
+        self.chunks += 1
+
+    def record_metrics(self):
+        """Time to first token and total generation time, both measured from the end of retrieval."""
+        if self.retrieval_ms is None or self.first_token_ms is None:
+            return
+        metrics.observe_stage("rag.first_token", (self.first_token_ms - self.retrieval_ms) / 1000)
+        metrics.observe_stage("rag.generation", (self.last_token_ms - self.retrieval_ms) / 1000)
+
+    def as_dict(self) -> dict:
+        return {
+            "retrieval_ms": self.retrieval_ms,
+            "first_token_ms": self.first_token_ms,
+            "last_token_ms": self.last_token_ms,
+            "chunks": self.chunks,
+            "cancelled": self.cancelled,
+        }
+
 
 class PromptBuilder:
     def __init__(self):
@@ -71,27 +190,97 @@ class PromptBuilder:
 class ChatBot:
     def __init__(self):
         self.config = Config()
-        loader = DocumentLoader(self.config.pdf_path)
-        self.documents = loader.load_and_split()
-        index = VectorStoreIndex(self.documents)
+        index = VectorStoreIndex.load_or_build(self.config.pdf_path, self.config.index_dir,
+                                               chunk_vectors=self.config.chunk_vectors)
+        self.documents = index.documents  # None when the index was loaded from disk
         self.retriever = index.get_retriever()
         self.llm_wrapper = LLMWrapper(self.config.groq_api_key)
         self.prompt_builder = PromptBuilder()
 
-    def stream_answer(self, question: str) -> Generator[str, None, None]:
-        relevant_docs = self.retriever.get_relevant_documents(question)
+    @classmethod
+    def from_components(cls, retriever, llm_wrapper: LLMWrapper, prompt_builder: Optional[PromptBuilder] = None):
+        """A ChatBot around ready-made parts, without loading the PDF or index (e.g. for benchmarks)."""
+        bot = cls.__new__(cls)
+        bot.config = Config()
+        bot.documents = None
+        bot.retriever = retriever
+        bot.llm_wrapper = llm_wrapper
+        bot.prompt_builder = prompt_builder or PromptBuilder()
+        return bot
+
+    def stream_answer(self, question: str, timings: Optional[StreamTimings] = None,
+                      cancel_event: Optional[threading.Event] = None) -> Generator[str, None, None]:
+        """
+        Yields the model's tokens as they arrive. Stops early when cancel_event is
+        set or the consumer closes the generator (e.g. the client disconnected).
+        """
+        timings = timings or StreamTimings()
+        with metrics.stage("rag.retrieval"):
+            relevant_docs = self.retriever.invoke(question)
+        timings.retrieval_ms = timings.elapsed_ms()
 
         if not relevant_docs or len(relevant_docs) == 0:
             default_msg = "Im StuddyBuddy the chatbot and i can only answer website related questions"
+            timings.mark_token()
             yield default_msg
             return
         context = "\n".join([doc.page_content for doc in relevant_docs])
 
         prompt = self.prompt_builder.build(context, question)
-        response = self.llm_wrapper.invoke(prompt)
-        output = response.content if hasattr(response, 'content') else str(response)
-        answer = output.strip()
+        tokens = self.llm_wrapper.stream(prompt)
+        started = False
+        try:
+            for text in tokens:
+                if cancel_event is not None and cancel_event.is_set():
+                    timings.cancelled = True
+                    break
+                if not started:
+                    # Keep the old output shape: no leading whitespace.
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    started = True
+                timings.mark_token()
+                yield text
+        except GeneratorExit:
+            timings.cancelled = True
+            raise
+        finally:
+            # Closing the upstream generator drops the HTTP stream to Groq.
+            tokens.close()
+            timings.record_metrics()
 
-        for word in answer.split():
-            yield word + " "
-            time.sleep(0.05)
\ No newline at end of file
+    async def astream_answer(self, question: str, timings: Optional[StreamTimings] = None) -> AsyncIterator[str]:
+        """
+        Async twin of stream_answer for the async server; cancellation comes from
+        the server cancelling the consuming task.
+        """
+        timings = timings or StreamTimings()
+        with metrics.stage("rag.retrieval"):
+            relevant_docs = await self.retriever.ainvoke(question)
+        timings.retrieval_ms = timings.elapsed_ms()
+
+        if not relevant_docs:
+            timings.mark_token()
+            yield "Im StuddyBuddy the chatbot and i can only answer website related questions"
+            return
+        context = "\n".join([doc.page_content for doc in relevant_docs])
+
+        prompt = self.prompt_builder.build(context, question)
+        tokens = self.llm_wrapper.astream(prompt)
+        started = False
+        try:
+            async for text in tokens:
+                if not started:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    started = True
+                timings.mark_token()
+                yield text
+        except (GeneratorExit, asyncio.CancelledError):
+            timings.cancelled = True
+            raise
+        finally:
+            await tokens.aclose()
+            timings.record_metrics()
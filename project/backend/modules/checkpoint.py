@@ -0,0 +1,262 @@
+# modules/checkpoint.py
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory")  # "memory" or "sqlite"
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite")
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_TTL_SECONDS = float(os.getenv("CHECKPOINT_TTL_SECONDS", "3600"))
+# Checkpoints kept per thread; older ones (and their writes/blobs) are pruned.
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))
+# How often (seconds) the SQLite store looks for idle or surplus threads to delete.
+CHECKPOINT_EVICT_INTERVAL = float(os.getenv("CHECKPOINT_EVICT_INTERVAL", "60"))
+
+
+def _thread_id(config):
+    return config["configurable"]["thread_id"]
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    In-memory checkpointer with a cap on live threads (least recently used is
+    evicted first), an idle TTL per thread, and only the newest few checkpoints
+    kept per thread.
+
+    Writes go through _bounds_lock, and the blob/write keys of each thread are
+    indexed, so pruning touches only that thread's entries.
+    """
+
+    # MemorySaver's async methods delegate to the sync ones, so ainvoke works.
+    async_native = True
+
+    def __init__(self, max_threads=CHECKPOINT_MAX_THREADS, ttl_seconds=CHECKPOINT_TTL_SECONDS,
+                 keep_per_thread=CHECKPOINT_KEEP_PER_THREAD, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self.keep_per_thread = max(1, keep_per_thread)
+        self._last_used = OrderedDict()  # thread_id -> monotonic time
+        self._versions = {}  # thread_id -> {(ns, checkpoint_id): channel_versions}
+        self._blob_keys = {}  # thread_id -> set of keys in self.blobs
+        self._write_keys = {}  # thread_id -> set of keys in self.writes
+        self._bounds_lock = threading.RLock()
+
+    def _touch(self, thread_id):
+        with self._bounds_lock:
+            self._last_used[thread_id] = time.monotonic()
+            self._last_used.move_to_end(thread_id)
+
+    def _expired(self, thread_id, now):
+        last_used = self._last_used.get(thread_id)
+        return last_used is not None and self.ttl_seconds > 0 and now - last_used > self.ttl_seconds
+
+    def get_tuple(self, config):
+        thread_id = _thread_id(config)
+        with self._bounds_lock:
+            # Idle past the TTL: the thread is gone, even if no put has evicted it yet.
+            if self._expired(thread_id, time.monotonic()):
+                self.drop_thread(thread_id)
+                return None
+        result = super().get_tuple(config)
+        if result is not None:
+            self._touch(thread_id)
+        return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = _thread_id(config)
+        ns = config["configurable"].get("checkpoint_ns", "")
+        with self._bounds_lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            if getattr(self, "blobs", None) is not None:
+                self._blob_keys.setdefault(thread_id, set()).update(
+                    (thread_id, ns, channel, version) for channel, version in new_versions.items())
+            self._versions.setdefault(thread_id, {})[(ns, checkpoint["id"])] = \
+                dict(checkpoint.get("channel_versions", {}))
+            self._touch(thread_id)
+            self._prune_thread(thread_id, ns)
+            self._evict()
+        return result
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        thread_id = _thread_id(config)
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._bounds_lock:
+            result = super().put_writes(config, writes, task_id, *args, **kwargs)
+            self._write_keys.setdefault(thread_id, set()).add(key)
+        return result
+
+    def _prune_thread(self, thread_id, ns):
+        checkpoints = self.storage.get(thread_id, {}).get(ns)
+        if not checkpoints or len(checkpoints) <= self.keep_per_thread:
+            return
+        versions = self._versions.get(thread_id, {})
+        write_keys = self._write_keys.get(thread_id, set())
+        # Checkpoint ids are time-ordered (uuid6), so sorting gives age order.
+        ordered = sorted(checkpoints)
+        for checkpoint_id in ordered[:-self.keep_per_thread]:
+            checkpoints.pop(checkpoint_id, None)
+            self.writes.pop((thread_id, ns, checkpoint_id), None)
+            write_keys.discard((thread_id, ns, checkpoint_id))
+            versions.pop((ns, checkpoint_id), None)
+
+        blobs = getattr(self, "blobs", None)
+        if blobs is None:
+            return  # older langgraph keeps channel values inside the checkpoint
+        live = set()
+        for checkpoint_id in ordered[-self.keep_per_thread:]:
+            for channel, version in versions.get((ns, checkpoint_id), {}).items():
+                live.add((thread_id, ns, channel, version))
+        if not live:
+            return
+        blob_keys = self._blob_keys.get(thread_id, set())
+        for key in [k for k in blob_keys if k[1] == ns and k not in live]:
+            blobs.pop(key, None)
+            blob_keys.discard(key)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._last_used:
+            thread_id = next(iter(self._last_used))
+            if not self._expired(thread_id, now) and len(self._last_used) <= self.max_threads:
+                break
+            self.drop_thread(thread_id)
+
+    def drop_thread(self, thread_id):
+        with self._bounds_lock:
+            self._last_used.pop(thread_id, None)
+            self.storage.pop(thread_id, None)
+            for key in self._write_keys.pop(thread_id, ()):
+                self.writes.pop(key, None)
+            blobs = getattr(self, "blobs", None)
+            for key in self._blob_keys.pop(thread_id, ()):
+                if blobs is not None:
+                    blobs.pop(key, None)
+            self._versions.pop(thread_id, None)
+
+    def stats(self):
+        with self._bounds_lock:
+            return {"backend": "memory", "threads": len(self._last_used), "max_threads": self.max_threads}
+
+
+def _sqlite_saver(path):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class PrunedSqliteSaver(SqliteSaver):
+        """
+        SqliteSaver that keeps only the newest few checkpoints per thread on disk,
+        and deletes whole threads idle for CHECKPOINT_TTL_SECONDS or beyond the
+        CHECKPOINT_MAX_THREADS most recently used (checked every
+        CHECKPOINT_EVICT_INTERVAL seconds). Last use is kept in thread_activity.
+        """
+
+        # SqliteSaver has no async methods; async callers must use a thread.
+        async_native = False
+
+        def __init__(self, conn, max_threads=CHECKPOINT_MAX_THREADS, ttl_seconds=CHECKPOINT_TTL_SECONDS,
+                     evict_interval=CHECKPOINT_EVICT_INTERVAL, **kwargs):
+            super().__init__(conn, **kwargs)
+            self.max_threads = max_threads
+            self.ttl_seconds = ttl_seconds
+            self.evict_interval = evict_interval
+            self._evicted_at = 0.0
+            self.setup()
+            with self.lock, self.conn:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_used REAL NOT NULL)")
+                self.conn.execute("CREATE INDEX IF NOT EXISTS thread_activity_last_used ON thread_activity (last_used)")
+                # Threads saved before the table existed start their clock now.
+                self.conn.execute("INSERT OR IGNORE INTO thread_activity SELECT DISTINCT thread_id, ? FROM checkpoints",
+                                  (time.time(),))
+
+        def _expired(self, thread_id, now):
+            if self.ttl_seconds <= 0:
+                return False
+            with self.lock:
+                row = self.conn.execute("SELECT last_used FROM thread_activity WHERE thread_id = ?",
+                                        (thread_id,)).fetchone()
+            return row is not None and now - row[0] > self.ttl_seconds
+
+        def get_tuple(self, config):
+            thread_id = _thread_id(config)
+            if self._expired(thread_id, time.time()):
+                self.drop_thread(thread_id)
+                return None
+            return super().get_tuple(config)
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = _thread_id(config)
+            ns = config["configurable"].get("checkpoint_ns", "")
+            now = time.time()
+            with self.lock, self.conn:
+                keep = """
+                    SELECT checkpoint_id FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT ?
+                """
+                args = (thread_id, ns, thread_id, ns, CHECKPOINT_KEEP_PER_THREAD)
+                for table in ("checkpoints", "writes"):
+                    self.conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? "
+                        f"AND checkpoint_id NOT IN ({keep})",
+                        args,
+                    )
+                self.conn.execute("INSERT OR REPLACE INTO thread_activity (thread_id, last_used) VALUES (?, ?)",
+                                  (thread_id, now))
+            if now - self._evicted_at >= self.evict_interval:
+                self._evicted_at = now
+                self.evict(now)
+            return result
+
+        def evict(self, now=None):
+            """Deletes idle threads and the least recently used beyond max_threads; returns how many."""
+            now = time.time() if now is None else now
+            with self.lock, self.conn:
+                stale = "SELECT thread_id FROM thread_activity WHERE last_used < ?" if self.ttl_seconds > 0 else None
+                surplus = "SELECT thread_id FROM thread_activity ORDER BY last_used DESC LIMIT -1 OFFSET ?"
+                doomed = [row[0] for row in self.conn.execute(surplus, (max(self.max_threads, 0),))]
+                if stale:
+                    doomed += [row[0] for row in self.conn.execute(stale, (now - self.ttl_seconds,))]
+                doomed = list(dict.fromkeys(doomed))
+                self._delete_threads(doomed)
+            if doomed:
+                print(f"[CHECKPOINT] Evicted {len(doomed)} idle SQLite threads")
+            return len(doomed)
+
+        def drop_thread(self, thread_id):
+            with self.lock, self.conn:
+                self._delete_threads([thread_id])
+
+        def _delete_threads(self, thread_ids):
+            for table in ("checkpoints", "writes", "thread_activity"):
+                self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+
+        def stats(self):
+            with self.lock:
+                row = self.conn.execute("SELECT COUNT(*) FROM thread_activity").fetchone()
+            return {"backend": "sqlite", "threads": row[0] if row else 0, "max_threads": self.max_threads,
+                    "path": path}
+
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return PrunedSqliteSaver(conn)
+
+
+def make_checkpointer(backend: str = CHECKPOINT_BACKEND):
+    """
+    "memory" (default): bounded, evicting in-process store.
+    "sqlite": on-disk store at CHECKPOINT_SQLITE_PATH so a restart keeps conversations.
+    """
+    if backend == "sqlite":
+        try:
+            saver = _sqlite_saver(CHECKPOINT_SQLITE_PATH)
+            print(f"[CHECKPOINT] Using SQLite checkpoints at {CHECKPOINT_SQLITE_PATH}")
+            return saver
+        except ImportError:
+            print("[CHECKPOINT] langgraph-checkpoint-sqlite is not installed; falling back to memory")
+    return BoundedMemorySaver()
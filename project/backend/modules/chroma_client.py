@@ -1,37 +1,156 @@
-
 import os
+import json
+import threading
+from typing import Dict, List, Optional, Union
+
 import chromadb
 from langchain.tools import Tool
-from sentence_transformers import SentenceTransformer
+from modules.embeddings import get_embedding_service
+from modules import metrics
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./embedded")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "movies")
+
+# Same model the collection was built with (utils/Embed.ipynb), shared process-wide.
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Metadata fields that can narrow the search before the vector scan.
+FILTER_FIELDS = ("imdb_id", "movie", "character")
+
+_collection = None
+_collection_lock = threading.Lock()
+
+
+def get_collection():
+    global _collection
+    if _collection is None:
+        with _collection_lock:
+            if _collection is None:
+                client = chromadb.PersistentClient(path=CHROMA_PATH)
+                _collection = client.get_or_create_collection(CHROMA_COLLECTION)
+    return _collection
+
+
+def _match(field, value):
+    values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+    if field == "character":
+        # Ingestion stores the file stem, e.g. "JOKER_text" for JOKER_text.txt
+        values = values + [f"{v}_text" for v in values if not str(v).endswith("_text")]
+    return {field: values[0]} if len(values) == 1 else {field: {"$in": values}}
+
+
+def build_where(imdb_id=None, movie=None, character=None, where: Optional[dict] = None) -> Optional[dict]:
+    """
+    Chroma `where` clause from the common filters (each a value or a list of
+    values), combined with any extra raw clause.
+    """
+    clauses = []
+    for field, value in (("imdb_id", imdb_id), ("movie", movie), ("character", character)):
+        if value is not None and value != []:
+            clauses.append(_match(field, value))
+    if where:
+        clauses.append(where)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def search_chroma_batch(queries: List[Union[str, Dict]], k: int = 5, imdb_id=None, movie=None,
+                        character=None, where: Optional[dict] = None) -> List[List[dict]]:
+    """
+    Searches many questions at once. Each query is a string or a dict with
+    "query" plus its own imdb_id/movie/character/where filters (overriding the
+    call-level ones). All texts are embedded in one model call, and queries
+    sharing a filter go to Chroma in one request.
+
+    Returns, per query and in input order, a list of hits:
+    {"id", "distance", "document", "metadata"}.
+    """
+    items = []
+    for q in queries:
+        if isinstance(q, str):
+            q = {"query": q}
+        filters = {"imdb_id": imdb_id, "movie": movie, "character": character, "where": where}
+        filters.update({f: q[f] for f in FILTER_FIELDS + ("where",) if f in q})
+        items.append((q["query"], build_where(**filters)))
+
+    if not items:
+        return []
+
+    with metrics.stage("chroma.embed"):
+        vectors = get_embedding_service(EMBEDDING_MODEL).encode([text for text, _ in items])
+
+    groups = {}
+    for i, (_, clause) in enumerate(items):
+        groups.setdefault(json.dumps(clause, sort_keys=True), []).append(i)
+
+    collection = get_collection()
+    results: List[List[dict]] = [[] for _ in items]
+    for key, indices in groups.items():
+        with metrics.stage("chroma.query"):
+            res = collection.query(
+                query_embeddings=vectors[indices].tolist(),
+                n_results=k,
+                where=json.loads(key),
+                include=["documents", "metadatas", "distances"],
+            )
+        for row, i in enumerate(indices):
+            ids = (res.get("ids") or [[]])[row]
+            docs = (res.get("documents") or [[]])[row]
+            metas = (res.get("metadatas") or [[]])[row]
+            dists = (res.get("distances") or [[]])[row]
+            results[i] = [
+                {
+                    "id": ids[j],
+                    "distance": dists[j] if j < len(dists) else None,
+                    "document": docs[j] if j < len(docs) else None,
+                    "metadata": (metas[j] if j < len(metas) else None) or {},
+                }
+                for j in range(len(ids))
+            ]
+    return results
 
-client = chromadb.PersistentClient(path="./embedded")
-collection = client.get_or_create_collection("movies")
 
-emb_model = SentenceTransformer("all-MiniLM-L6-v2")
+def search_chroma(query: str, k: int = 5, **filters) -> List[dict]:
+    return search_chroma_batch([query], k=k, **filters)[0]
+
+
+def format_hits(hits: List[dict]) -> str:
+    pieces = []
+    for hit in hits:
+        meta = hit["metadata"]
+        movie = meta.get("movie", "unknown")
+        character = meta.get("character", "unknown")
+        header = f"[{movie} :: {character}]"
+        pieces.append(header + "\n" + (hit["document"] or ""))
+    return "\n\n---\n\n".join(pieces)
+
 
 def query_chroma(query: str, k: int = 5) -> str:
     """
     Query ChromaDB for top-k similar results with metadata.
+
+    The input may also be JSON, e.g. {"query": "...", "movie": "Inception", "k": 8},
+    to restrict the search to one movie/character/imdb_id.
     """
+    metrics.tool_calls_total.inc(tool="ChromaVectorDB")
     try:
-        embedding = emb_model.encode([query], convert_to_numpy=True).tolist()[0]
-        res = collection.query(query_embeddings=[embedding], n_results=k)
+        filters = {}
+        text = query
+        stripped = query.strip()
+        if stripped.startswith("{"):
+            try:
+                spec = json.loads(stripped)
+                text = spec.get("query", "")
+                k = int(spec.get("k", k))
+                filters = {f: spec[f] for f in FILTER_FIELDS if spec.get(f)}
+            except ValueError:
+                pass
 
-        docs = res.get("documents", [[]])[0]
-        metas = res.get("metadatas", [[]])[0]
-
-        if not docs:
+        hits = search_chroma(text, k=k, **filters)
+        if not hits:
             return "[VectorDB] No relevant context found."
-
-        pieces = []
-        for i, doc in enumerate(docs):
-            meta = metas[i] if i < len(metas) else {}
-            movie = meta.get("movie", "unknown")
-            character = meta.get("character", "unknown")
-            header = f"[{movie} :: {character}]"
-            pieces.append(header + "\n" + doc)
-
-        return "\n\n---\n\n".join(pieces)
+        return format_hits(hits)
 
     except Exception as e:
         return f"[VectorDB tool error] {type(e).__name__}: {e}"
@@ -40,5 +159,9 @@ def query_chroma(query: str, k: int = 5) -> str:
 chroma_tool = Tool(
     name="ChromaVectorDB",
     func=query_chroma,
-    description="Search dialogue/character embeddings and return relevant context with metadata."
-)
\ No newline at end of file
+    description=(
+        "Search dialogue/character embeddings and return relevant context with metadata. "
+        "Input: a question, or JSON {\"query\": ..., \"movie\"/\"character\"/\"imdb_id\": ...} "
+        "to search only that movie or character."
+    ),
+)
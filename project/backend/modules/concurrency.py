@@ -0,0 +1,90 @@
+# modules/concurrency.py
+import os
+import asyncio
+
+
+class Overloaded(Exception):
+    """Raised when an endpoint's wait queue is full; maps to 429 + Retry-After."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is overloaded")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class EndpointLimiter:
+    """
+    At most max_concurrent requests run at once; up to max_queue more wait for a
+    slot. Anything beyond that is shed immediately instead of piling up.
+
+        async with limiter:
+            ...
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, retry_after=1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+        self._semaphore = None
+
+    @classmethod
+    def from_env(cls, name, max_concurrent, max_queue, retry_after=1):
+        """LIMIT_<NAME>_CONCURRENCY / LIMIT_<NAME>_QUEUE / LIMIT_<NAME>_RETRY_AFTER override the defaults."""
+        prefix = f"LIMIT_{name.upper()}"
+        return cls(
+            name,
+            int(os.getenv(f"{prefix}_CONCURRENCY", str(max_concurrent))),
+            int(os.getenv(f"{prefix}_QUEUE", str(max_queue))),
+            int(os.getenv(f"{prefix}_RETRY_AFTER", str(retry_after))),
+        )
+
+    def _sem(self):
+        # Created lazily so it binds to the serving event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def admit(self):
+        """
+        Raises Overloaded if acquire() would shed right now. Streamed endpoints
+        call it before responding (so overload is still a 429) and acquire inside
+        the body, where the release is sure to run.
+        """
+        if self._sem().locked() and self.waiting >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(self.name, self.retry_after)
+
+    async def acquire(self):
+        self.admit()
+        sem = self._sem()
+        self.waiting += 1
+        try:
+            await sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._sem().release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "shed": self.shed,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
@@ -1,27 +1,171 @@
 # modules/csv_tool.py
+import os
+import re
+import threading
+
+import numpy as np
 import pandas as pd
 from langchain.tools import Tool
-import os
+
+from modules import metrics
 
 CSV_PATH = os.getenv("CSV_PATH", "./processed_sentiment/character_sentiment.csv")
+# Columns that get exact (normalized) value lookups, e.g. "joker" -> rows.
+CSV_KEY_COLUMNS = [c.strip() for c in os.getenv("CSV_KEY_COLUMNS", "movie,character").split(",") if c.strip()]
+CSV_MAX_RESULTS = int(os.getenv("CSV_MAX_RESULTS", "20"))
+# Longest entity name (in tokens) looked up inside a question.
+MAX_KEY_NGRAM = 6
+
+TOKEN_PATTERN = r"[a-z0-9]+"
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "how", "in", "is", "it", "me",
+    "of", "on", "or", "show", "the", "to", "what", "which", "who", "with", "about", "does",
+}
+
+
+def normalize_key(value: str) -> str:
+    return " ".join(re.findall(TOKEN_PATTERN, str(value).lower()))
+
+
+class CSVTable:
+    """
+    In-memory, typed copy of the sentiment CSV with a token inverted index over
+    the text columns and exact lookups on the key columns. The file is parsed
+    once and re-parsed only when its mtime changes.
+    """
+
+    def __init__(self, path: str, key_columns=None):
+        self.path = path
+        self.key_columns = key_columns if key_columns is not None else CSV_KEY_COLUMNS
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.df = None
+        self.key_index = {}    # column -> {normalized value -> row positions}
+        self.token_index = {}  # token -> row positions (sorted, unique)
+
+    def ensure_loaded(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+
+    def _load(self):
+        df = pd.read_csv(self.path).convert_dtypes()
+        df = df.reset_index(drop=True)
+
+        lower_cols = {str(c).lower(): c for c in df.columns}
+        key_index = {}
+        for name in self.key_columns:
+            col = lower_cols.get(name.lower())
+            if col is None:
+                continue
+            norm = df[col].astype("string").fillna("").map(normalize_key)
+            key_index[col] = {k: v for k, v in norm.groupby(norm, sort=False).indices.items() if k}
+
+        token_rows = []
+        for col in df.columns:
+            if not pd.api.types.is_string_dtype(df[col]):
+                continue
+            tokens = df[col].fillna("").str.lower().str.findall(TOKEN_PATTERN).explode().dropna()
+            if not tokens.empty:
+                token_rows.append(pd.DataFrame({"token": tokens.values, "row": tokens.index.values}))
+
+        token_index = {}
+        if token_rows:
+            postings = pd.concat(token_rows, ignore_index=True).drop_duplicates()
+            for token, rows in postings.groupby("token", sort=False)["row"]:
+                token_index[token] = np.sort(rows.to_numpy(dtype=np.int64))
+
+        self.df, self.key_index, self.token_index = df, key_index, token_index
+        print(f"[CSV] Loaded {len(df)} rows from {self.path} ({len(token_index)} tokens indexed)")
+
+    def _key_matches(self, tokens):
+        """Rows whose key columns match an n-gram of the question, intersected across columns."""
+        matched = None
+        used = set()
+        for col, index in self.key_index.items():
+            col_rows = []
+            for n in range(min(MAX_KEY_NGRAM, len(tokens)), 0, -1):
+                for i in range(len(tokens) - n + 1):
+                    if any(j in used for j in range(i, i + n)):
+                        continue
+                    rows = index.get(" ".join(tokens[i:i + n]))
+                    if rows is not None and not (n == 1 and tokens[i] in STOP_WORDS):
+                        col_rows.append(rows)
+                        used.update(range(i, i + n))
+            if col_rows:
+                rows = np.unique(np.concatenate(col_rows))
+                matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+        return matched, used
+
+    def _token_matches(self, tokens):
+        """Rows containing every token, or failing that the rows matching the most tokens."""
+        postings = [self.token_index[t] for t in tokens if t in self.token_index]
+        if not postings:
+            return None
+        if len(postings) == len(tokens):
+            rows = postings[0]
+            for p in postings[1:]:
+                rows = np.intersect1d(rows, p, assume_unique=True)
+            if len(rows):
+                return rows
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.df))
+        return np.flatnonzero(counts == counts.max())
+
+    def query(self, question: str, limit: int = CSV_MAX_RESULTS):
+        """Returns (records, total_matches)."""
+        self.ensure_loaded()
+        tokens = re.findall(TOKEN_PATTERN, question.lower())
+        if not tokens:
+            return [], 0
+
+        rows, used = self._key_matches(tokens)
+        rest = [t for i, t in enumerate(tokens) if i not in used and t not in STOP_WORDS]
+        if rest:
+            token_rows = self._token_matches(rest)
+            if rows is None:
+                rows = token_rows
+            elif token_rows is not None:
+                narrowed = np.intersect1d(rows, token_rows, assume_unique=True)
+                rows = narrowed if len(narrowed) else rows
+
+        if rows is None or len(rows) == 0:
+            return [], 0
+        records = self.df.iloc[rows[:limit]].astype(object).where(lambda d: d.notna(), None)
+        return records.to_dict(orient="records"), int(len(rows))
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table() -> CSVTable:
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = CSVTable(CSV_PATH)
+    return _table
+
 
 def query_csv(question: str) -> str:
+    metrics.tool_calls_total.inc(tool="CSVQuery")
     try:
         if not os.path.exists(CSV_PATH):
+            metrics.errors_total.inc(stage="csv.query")
             return f"[CSV tool error] File not found: {CSV_PATH}"
 
-        df = pd.read_csv(CSV_PATH)
-
-        # Very simple keyword search across all text columns
-        results = []
-        for col in df.columns:
-            matches = df[df[col].astype(str).str.contains(question, case=False, na=False)]
-            if not matches.empty:
-                results.append(matches.head(5).to_dict(orient="records"))
+        with metrics.stage("csv.query"):
+            results, total = get_table().query(question)
 
         if not results:
             return "[CSV] No matches found."
 
+        if total > len(results):
+            return f"{results}\n[CSV] Showing {len(results)} of {total} matching rows."
         return str(results)
     except Exception as e:
         return f"[CSV tool error] {type(e).__name__}: {e}"
@@ -0,0 +1,260 @@
+# modules/cypher_cache.py
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+# Quoted string literals in generated Cypher: 'Christopher Nolan' or "Inception"
+LITERAL_RE = re.compile(r"'((?:[^'\\]|\\.)*)'|\"((?:[^\"\\]|\\.)*)\"")
+SLOT_MARK = "\x00slot{}\x00"
+# Bumped when slot patterns change meaning; persisted entries from older versions are dropped.
+SLOT_PATTERN_VERSION = 2
+
+
+def normalize_question(question: str) -> str:
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip(" ?.!")
+
+
+def _squash(question: str) -> str:
+    """Whitespace/trailing punctuation only; keeps case for entity extraction."""
+    return re.sub(r"\s+", " ", question.strip()).rstrip(" ?.!")
+
+
+def schema_hash(schema_text: str) -> str:
+    return hashlib.sha256((schema_text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _slot_group(index: int, words: int) -> str:
+    return f"(?P<s{index}>\\S+" + (f"(?: \\S+){{{words - 1}}}" if words > 1 else "") + ")"
+
+
+def _escape_literal(value: str, quote: str) -> str:
+    return value.replace("\\", "\\\\").replace(quote, "\\" + quote)
+
+
+class CypherCache:
+    """
+    Generated Cypher keyed by the normalized question.
+
+    - Exact: "Who directed Inception?" and "who directed inception" share a key.
+    - Slotted: when a string literal in the Cypher appears verbatim in the
+      question, it is replaced by a slot in both, so "movies directed by
+      Christopher Nolan" also serves "movies directed by Greta Gerwig".
+    - Similar (optional): with embed_fn set, an unslotted entry whose question
+      embedding is within similarity_threshold is reused.
+
+    Every entry is tagged with the graph schema hash; set_schema() drops entries
+    from another schema.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None,
+                 embed_fn: Optional[Callable[[str], list]] = None,
+                 similarity_threshold: float = 0.95, slotting: bool = True):
+        self.max_entries = max_entries
+        self.path = path
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.slotting = slotting
+        self.schema = None
+        self.hits = 0
+        self.misses = 0
+        self.empty = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {"cypher", "schema", "slots", "pattern", "embedding"}
+        self._load()
+
+    # --- persistence -----------------------------------------------------------
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in data.get("entries", []):
+                if entry.get("slots") and entry.get("slot_version") != SLOT_PATTERN_VERSION:
+                    continue
+                self._entries[key] = entry
+        except (OSError, ValueError) as e:
+            print(f"[CYPHER_CACHE] Ignoring unreadable cache file {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"entries": list(self._entries.items())}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[CYPHER_CACHE] Could not write {self.path}: {e}")
+
+    # --- schema ----------------------------------------------------------------
+
+    def set_schema(self, schema_text: str):
+        new_hash = schema_hash(schema_text)
+        with self._lock:
+            if new_hash == self.schema:
+                return
+            self.schema = new_hash
+            stale = [k for k, e in self._entries.items() if e.get("schema") != new_hash]
+            for k in stale:
+                del self._entries[k]
+            if stale:
+                print(f"[CYPHER_CACHE] Schema changed; dropped {len(stale)} entries")
+                self._save()
+
+    # --- slotting --------------------------------------------------------------
+
+    def _slot(self, question: str, cypher: str):
+        """Returns (template_key, regex_pattern, cypher_template, slot_count) or None."""
+        squashed = _squash(question)
+        template_q = squashed
+        cypher_t = cypher
+        slots = 0
+        seen = set()
+        widths = []
+        for m in LITERAL_RE.finditer(cypher):
+            value = m.group(1) if m.group(1) is not None else m.group(2)
+            if len(value) < 2 or value in seen:
+                continue
+            if not re.search(r"(?<!\w)" + re.escape(value) + r"(?!\w)", template_q):
+                continue
+            seen.add(value)
+            mark = SLOT_MARK.format(slots)
+            template_q = re.sub(r"(?<!\w)" + re.escape(value) + r"(?!\w)", mark, template_q, count=1)
+            quote = "'" if m.group(1) is not None else '"'
+            cypher_t = cypher_t.replace(f"{quote}{value}{quote}", f"{quote}{mark}{quote}")
+            widths.append(len(value.split()))
+            slots += 1
+        if not slots:
+            return None
+
+        # A slot takes exactly as many words as the value it replaced, so
+        # "... by Christopher Nolan after 2010" does not fill "{0}" with the whole tail.
+        pattern_parts = re.split("(\x00slot\\d+\x00)", template_q)
+        pattern = "".join(
+            _slot_group(int(p[5:-1]), widths[int(p[5:-1])]) if p.startswith("\x00slot") else re.escape(p)
+            for p in pattern_parts
+        )
+        key = "slot:" + normalize_question(re.sub("\x00slot(\\d+)\x00", r"{\1}", template_q))
+        return key, pattern, cypher_t, slots
+
+    @staticmethod
+    def _fill(entry, match):
+        cypher = entry["cypher"]
+        for i in range(entry["slots"]):
+            value = match.group(f"s{i}")
+            mark = SLOT_MARK.format(i)
+            for quote in ("'", '"'):
+                cypher = cypher.replace(f"{quote}{mark}{quote}", f"{quote}{_escape_literal(value, quote)}{quote}")
+        return cypher
+
+    # --- lookup / store --------------------------------------------------------
+
+    def lookup(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        squashed = _squash(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.get("schema") == self.schema:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["cypher"]
+
+            if self.slotting:
+                for k, e in reversed(self._entries.items()):
+                    if not e.get("slots") or e.get("schema") != self.schema:
+                        continue
+                    m = re.fullmatch(e["pattern"], squashed, flags=re.IGNORECASE)
+                    if m:
+                        self._entries.move_to_end(k)
+                        self.hits += 1
+                        return self._fill(e, m)
+
+        if self.embed_fn is not None:
+            cypher = self._lookup_similar(question)
+            if cypher is not None:
+                return cypher
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def resolve(self, question: str, run: Callable[[str], Optional[list]]):
+        """
+        (cypher, rows) from a cached query that finds rows for this question, or
+        None to generate instead. run(cypher) returns the rows, or None when the
+        query must not run. A slot filled with the user's casing ("inception"
+        for 'Inception') matches nothing, since Neo4j compares strings
+        case-sensitively; that is counted as empty rather than a hit.
+        """
+        cypher = self.lookup(question)
+        if cypher is None:
+            return None
+        rows = run(cypher)
+        if not rows:
+            with self._lock:
+                self.hits -= 1
+                self.empty += 1
+            return None
+        return cypher, rows
+
+    def _lookup_similar(self, question: str) -> Optional[str]:
+        with self._lock:
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if not e.get("slots") and e.get("embedding") and e.get("schema") == self.schema]
+        if not candidates:
+            return None
+        q = np.asarray(self.embed_fn(question), dtype=np.float32)
+        mat = np.asarray([e["embedding"] for _, e in candidates], dtype=np.float32)
+        sims = mat @ q / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-12)
+        best = int(np.argmax(sims))
+        if sims[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return entry["cypher"]
+
+    def store(self, question: str, cypher: str):
+        slotted = self._slot(question, cypher) if self.slotting else None
+        if slotted is not None:
+            key, pattern, cypher_t, slots = slotted
+            entry = {"cypher": cypher_t, "slots": slots, "pattern": pattern, "slot_version": SLOT_PATTERN_VERSION}
+        else:
+            key = normalize_question(question)
+            entry = {"cypher": cypher, "slots": 0}
+            if self.embed_fn is not None:
+                try:
+                    entry["embedding"] = [float(x) for x in self.embed_fn(question)]
+                except Exception as e:
+                    print(f"[CYPHER_CACHE] Embedding failed, storing exact-only: {e}")
+        entry["schema"] = self.schema
+        entry["stored_at"] = time.time()
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "empty": self.empty,
+                    "schema": self.schema}
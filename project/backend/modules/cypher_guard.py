@@ -0,0 +1,200 @@
+# modules/cypher_guard.py
+"""
+Checks LLM-generated Cypher before it runs on Neo4j.
+
+- Read-only: write clauses and procedure calls outside a small allow-list are rejected.
+- Unbounded variable-length patterns ([*], [*2..]) get an upper bound of CYPHER_MAX_HOPS.
+- A RETURN without LIMIT gets LIMIT CYPHER_DEFAULT_LIMIT.
+- EXPLAIN is run first, and a plan estimating more than CYPHER_MAX_ESTIMATED_ROWS
+  rows in any operator (e.g. a Person x Movie cartesian product) is rejected.
+- Rows handed back to the QA prompt are capped at CYPHER_MAX_CONTEXT_CHARS.
+
+Rejected queries are logged with their plans (and appended to CYPHER_GUARD_LOG
+when set). The guard plugs into GraphCypherQAChain as its cypher_query_corrector:
+an empty string means "do not run", and the chain answers from no context.
+"""
+import os
+import re
+import json
+import time
+from typing import List, Optional
+
+from langchain_neo4j.chains.graph_qa.cypher_utils import CypherQueryCorrector
+from neo4j import Query
+
+from modules import metrics
+
+CYPHER_TIMEOUT = float(os.getenv("CYPHER_TIMEOUT", "10"))  # seconds, per transaction
+CYPHER_DEFAULT_LIMIT = int(os.getenv("CYPHER_DEFAULT_LIMIT", "100"))
+CYPHER_MAX_HOPS = int(os.getenv("CYPHER_MAX_HOPS", "3"))
+CYPHER_MAX_ESTIMATED_ROWS = float(os.getenv("CYPHER_MAX_ESTIMATED_ROWS", "1000000"))
+CYPHER_MAX_CONTEXT_CHARS = int(os.getenv("CYPHER_MAX_CONTEXT_CHARS", "8000"))
+CYPHER_GUARD_LOG = os.getenv("CYPHER_GUARD_LOG") or None
+
+# String literals, backticked names and comments, in one left-to-right scan ('http://...' is not a comment).
+OPAQUE_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|//[^\n]*|/\*.*?\*/", re.DOTALL)
+# Clause keywords only: not a property (m.set), label/type (:Merge), parameter ($set) or map key ({set: 1}).
+WRITE_RE = re.compile(r"(?<![\w.:$])(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|FOREACH|LOAD\s+CSV)\b(?!\s*:)",
+                      re.IGNORECASE)
+CALL_RE = re.compile(r"\bCALL\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+ALLOWED_PROCEDURES = ("db.index.fulltext.querynodes", "db.index.vector.querynodes", "db.labels",
+                      "db.relationshiptypes", "db.propertykeys")
+# -[*]-, <-[r*]-, -[:ACTED_IN*2..]-> -> the star and its bounds inside a relationship pattern
+# (not a product in a list expression such as [x IN xs | x * 2])
+VAR_LENGTH_RE = re.compile(r"(-\s*\[[^\[\]]*?)\*\s*(\d*)\s*(\.\.)?\s*(\d*)([^\[\]]*\]\s*-)")
+RETURN_RE = re.compile(r"\bRETURN\b", re.IGNORECASE)
+LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+UNION_RE = re.compile(r"\bUNION\b", re.IGNORECASE)
+MAX_VALUE_CHARS = 500
+
+
+class CypherRejected(Exception):
+    pass
+
+
+def _strip(cypher: str) -> str:
+    """
+    The query with comments and literals blanked out, for keyword checks.
+    Offsets are kept, so a match in the stripped text points into the query.
+    """
+    def blank(m):
+        text = m.group(0)
+        if text.startswith(("//", "/*")):
+            return " " * len(text)
+        return text[0] + " " * (len(text) - 2) + text[-1]
+    return OPAQUE_RE.sub(blank, cypher)
+
+
+def check_read_only(cypher: str):
+    text = _strip(cypher)
+    m = WRITE_RE.search(text)
+    if m:
+        raise CypherRejected(f"write clause {m.group(1).upper()}")
+    for name in CALL_RE.findall(text):
+        if not name.lower().startswith(ALLOWED_PROCEDURES):
+            raise CypherRejected(f"procedure call {name}")
+
+
+def bound_hops(cypher: str, max_hops: int = CYPHER_MAX_HOPS) -> str:
+    """[*] -> [*1..max_hops], [*2..] -> [*2..max(2, max_hops)]; bounded patterns are left alone."""
+    out, pos = [], 0
+    # Matched on the stripped text (a '*' in a string or comment is not a pattern), rewritten in the original.
+    for m in VAR_LENGTH_RE.finditer(_strip(cypher)):
+        _, low, dots, high, _ = m.groups()
+        if high or (low and not dots):
+            continue
+        start = int(low) if low else 1
+        out += [cypher[pos:m.end(1)], f"*{start}..{max(start, max_hops)}", cypher[m.start(5):m.end(5)]]
+        pos = m.end()
+    return "".join(out) + cypher[pos:]
+
+
+def ensure_limit(cypher: str, limit: int = CYPHER_DEFAULT_LIMIT) -> str:
+    """Appends LIMIT to the final RETURN when it has none (UNION queries are left alone)."""
+    text = _strip(cypher)
+    returns = list(RETURN_RE.finditer(text))
+    if not returns or UNION_RE.search(text) or LIMIT_RE.search(text, returns[-1].end()):
+        return cypher
+    return cypher.rstrip().rstrip(";").rstrip() + f"\nLIMIT {limit}"
+
+
+def _plan_args(plan: dict) -> dict:
+    return plan.get("args") or plan.get("arguments") or {}
+
+
+def plan_operators(plan: Optional[dict]) -> List[tuple]:
+    """[(operator, estimated rows), ...] for the whole plan tree, root first."""
+    if not plan:
+        return []
+    out = [(plan.get("operatorType", "?"), float(_plan_args(plan).get("EstimatedRows", 0) or 0))]
+    for child in plan.get("children") or []:
+        out += plan_operators(child)
+    return out
+
+
+def explain(graph, cypher: str, timeout: float = CYPHER_TIMEOUT) -> Optional[dict]:
+    """The EXPLAIN plan (nothing is executed), or None when the graph gives no driver access."""
+    driver = getattr(graph, "_driver", None)
+    if driver is None:
+        return None
+    with driver.session(database=getattr(graph, "_database", None)) as session:
+        summary = session.run(Query(f"EXPLAIN {cypher}", timeout=timeout)).consume()
+    return summary.plan
+
+
+def cap_context(rows, max_chars: int = CYPHER_MAX_CONTEXT_CHARS):
+    """Rows for the QA prompt: long values shortened, and no more rows than fit in max_chars."""
+    if not isinstance(rows, list):
+        return rows
+    kept, used = [], 0
+    for row in rows:
+        if isinstance(row, dict):
+            row = {k: (v[:MAX_VALUE_CHARS] + "..." if isinstance(v, str) and len(v) > MAX_VALUE_CHARS else v)
+                   for k, v in row.items()}
+        size = len(json.dumps(row, default=str))
+        if kept and used + size > max_chars:
+            break
+        kept.append(row)
+        used += size
+    return kept
+
+
+class CypherGuard(CypherQueryCorrector):
+    """Set as GraphCypherQAChain.cypher_query_corrector; returns the Cypher to run, or "" to run nothing."""
+
+    def __init__(self, graph, max_estimated_rows: float = CYPHER_MAX_ESTIMATED_ROWS,
+                 default_limit: int = CYPHER_DEFAULT_LIMIT, max_hops: int = CYPHER_MAX_HOPS,
+                 timeout: float = CYPHER_TIMEOUT, log_path: Optional[str] = CYPHER_GUARD_LOG):
+        super().__init__([])
+        self.graph = graph
+        self.max_estimated_rows = max_estimated_rows
+        self.default_limit = default_limit
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.log_path = log_path
+
+    def __call__(self, query: str) -> str:
+        try:
+            return self.check(query)
+        except CypherRejected:
+            return ""  # already logged
+        except Exception as e:
+            # EXPLAIN itself failed (syntax error, unknown label...); running it would fail too.
+            self._reject(query, f"EXPLAIN failed: {type(e).__name__}: {e}")
+            return ""
+
+    def check(self, cypher: str) -> str:
+        with metrics.stage("neo4j.cypher_guard"):
+            try:
+                check_read_only(cypher)
+            except CypherRejected as e:
+                self._reject(cypher, str(e))
+                raise
+
+            guarded = ensure_limit(bound_hops(cypher, self.max_hops), self.default_limit)
+            plan = explain(self.graph, guarded, self.timeout)
+            operators = plan_operators(plan)
+            worst = max(operators, key=lambda op: op[1], default=None)
+            if worst and worst[1] > self.max_estimated_rows:
+                reason = f"{worst[0]} estimates {worst[1]:.0f} rows (budget {self.max_estimated_rows:.0f})"
+                self._reject(guarded, reason, operators)
+                raise CypherRejected(reason)
+
+        if guarded != cypher:
+            metrics.cypher_guard_total.inc(result="rewritten")
+            print(f"[CYPHER_GUARD] Rewrote query:\n{cypher}\n->\n{guarded}")
+        else:
+            metrics.cypher_guard_total.inc(result="passed")
+        return guarded
+
+    def _reject(self, cypher: str, reason: str, operators=None):
+        metrics.cypher_guard_total.inc(result="rejected")
+        plan = ", ".join(f"{op}({rows:.0f})" for op, rows in operators or [])
+        print(f"[CYPHER_GUARD] Rejected ({reason}): {cypher!r}" + (f" plan: {plan}" if plan else ""))
+        if self.log_path:
+            record = {"ts": time.time(), "reason": reason, "cypher": cypher, "plan": operators or []}
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+            except OSError as e:
+                print(f"[CYPHER_GUARD] Could not write {self.log_path}: {e}")
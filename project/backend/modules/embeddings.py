@@ -0,0 +1,191 @@
+# modules/embeddings.py
+# One process-wide sentence-transformers model shared by the splitter, the /rag
+# FAISS index and the Chroma tool.
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from modules import metrics
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_DEVICE = os.getenv("EMBED_DEVICE") or None
+EMBED_NUM_THREADS = int(os.getenv("EMBED_NUM_THREADS", "0"))  # 0 keeps torch's default
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "2048"))
+
+
+def _canonical(model_name: str) -> str:
+    # "all-MiniLM-L6-v2" and "sentence-transformers/all-MiniLM-L6-v2" are the same model
+    return model_name.split("/", 1)[1] if model_name.startswith("sentence-transformers/") else model_name
+
+
+class EmbeddingService:
+    """
+    Wraps one SentenceTransformer.
+
+    Small encode() calls from concurrent threads are queued and merged into a
+    single model call: the first request waits up to EMBED_BATCH_WINDOW_MS for
+    others, up to EMBED_BATCH_SIZE texts. Calls that are already a full batch go
+    straight to the model. embed_query() also keeps an LRU of recent query vectors.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, device=EMBED_DEVICE, batch_size=EMBED_BATCH_SIZE,
+                 window_ms=EMBED_BATCH_WINDOW_MS, cache_size=EMBED_QUERY_CACHE_SIZE, num_threads=EMBED_NUM_THREADS):
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads > 0:
+            import torch
+            torch.set_num_threads(num_threads)
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+        self.window = window_ms / 1000.0
+        self.cache_size = cache_size
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.stats = {"model_calls": 0, "texts": 0, "queued_requests": 0, "cache_hits": 0, "cache_misses": 0}
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def _encode_now(self, texts: List[str]) -> np.ndarray:
+        with self._model_lock:
+            self.stats["model_calls"] += 1
+            self.stats["texts"] += len(texts)
+            return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                     show_progress_bar=False)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        if len(texts) >= self.batch_size:
+            return self._encode_now(texts)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        self.stats["queued_requests"] += 1
+        return future.result()
+
+    def embed_query(self, text: str) -> np.ndarray:
+        with self._cache_lock:
+            vec = self._cache.get(text)
+            if vec is not None:
+                self._cache.move_to_end(text)
+                self.stats["cache_hits"] += 1
+                return vec
+            self.stats["cache_misses"] += 1
+        vec = self.encode([text])[0]
+        vec.flags.writeable = False  # shared between callers via the cache
+        with self._cache_lock:
+            self._cache[text] = vec
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vec
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            count = len(pending[0][0])
+            deadline = time.monotonic() + self.window
+            while count < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            texts = [t for item, _ in pending for t in item]
+            try:
+                vectors = self._encode_now(texts)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for item, future in pending:
+                future.set_result(vectors[offset:offset + len(item)])
+                offset += len(item)
+
+
+class SharedEmbeddings(Embeddings):
+    """LangChain Embeddings backed by the shared EmbeddingService."""
+
+    def __init__(self, service: EmbeddingService, model_name: str = None):
+        self.service = service
+        self.model_name = model_name or service.model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed_query(text).tolist()
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str = EMBEDDING_MODEL) -> EmbeddingService:
+    key = _canonical(model_name)
+    service = _services.get(key)
+    if service is None:
+        with _services_lock:
+            service = _services.get(key)
+            if service is None:
+                service = EmbeddingService(model_name)
+                _services[key] = service
+    return service
+
+
+def set_embedding_service(model_name: str, service) -> None:
+    """Installs a ready-made service (anything with encode/embed_query/dimension), e.g. a benchmark stand-in."""
+    with _services_lock:
+        _services[_canonical(model_name)] = service
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL) -> SharedEmbeddings:
+    return SharedEmbeddings(get_embedding_service(model_name), model_name)
+
+
+def _embedding_metrics():
+    families = {
+        "model_calls": ("cinegraph_embedding_model_calls_total", "Embedding model calls."),
+        "texts": ("cinegraph_embedding_texts_total", "Texts embedded."),
+        "cache_hits": ("cinegraph_embedding_query_cache_hits_total", "Query-vector cache hits."),
+        "cache_misses": ("cinegraph_embedding_query_cache_misses_total", "Query-vector cache misses."),
+    }
+    services = dict(_services)
+    return [
+        (name, "counter", help_text, [({"model": model}, s.stats[stat]) for model, s in services.items()])
+        for stat, (name, help_text) in families.items()
+    ]
+
+
+metrics.registry.add_collector(_embedding_metrics)
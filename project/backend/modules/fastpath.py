@@ -0,0 +1,388 @@
+# modules/fastpath.py
+"""
+Answers the common graph questions (cast of a movie, movies by a director,
+genre lists, top rated by year, ...) without the agent. Entity names found in
+the question are replaced by typed placeholders ("who directed <MOVIE>"), the
+result is matched against a few regex templates per intent, and the intent's
+prewritten Cypher runs with the entity as a parameter on the pooled driver
+(modules.graph_db). The rows are formatted into an answer directly.
+
+answer() returns None for anything it does not recognize, or when the query
+finds nothing, and /chat falls back to the agent.
+
+Movie, Person, Genre and Award names are read from the graph on first use and
+refreshed every FASTPATH_ENTITY_TTL seconds (or after /admin/data-version).
+Add "fastpath" to ENABLED_COMPONENTS to load them at warmup.
+"""
+import os
+import re
+import time
+import threading
+import itertools
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from modules import metrics
+
+FASTPATH_ENABLED = os.getenv("FASTPATH_ENABLED", "1") == "1"
+FASTPATH_ENTITY_TTL = float(os.getenv("FASTPATH_ENTITY_TTL", "600"))
+FASTPATH_MAX_RESULTS = int(os.getenv("FASTPATH_MAX_RESULTS", "25"))
+# Longest entity name (in tokens) looked up inside a question.
+MAX_ENTITY_NGRAM = 12
+# Placeholder typings tried per question when a name is ambiguous (e.g. a movie
+# and a person with the same name).
+MAX_VARIANTS = 8
+
+TOKEN_PATTERN = r"[a-z0-9]+"
+YEAR_RE = re.compile(r"^(18|19|20)\d\d$")
+# Never treated as an entity on their own, e.g. movies called "It" or "Up".
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "the", "to", "up", "us", "we", "what", "when", "which", "who",
+    "with", "you", "movie", "movies", "film", "films", "best", "top", "cast", "genre", "genres",
+}
+
+
+def normalize(text) -> str:
+    return " ".join(re.findall(TOKEN_PATTERN, str(text).lower()))
+
+
+# --- entity names ---------------------------------------------------------------
+
+ENTITY_QUERIES = {
+    "MOVIE": "MATCH (m:Movie) WHERE m.title IS NOT NULL "
+             "RETURN m.title AS name, m.imdb_id AS imdb_id, m.year AS year",
+    "PERSON": "MATCH (p:Person) WHERE p.name IS NOT NULL RETURN p.name AS name",
+    "GENRE": "MATCH (g:Genre) WHERE g.name IS NOT NULL RETURN g.name AS name",
+    "AWARD": "MATCH (a:Award) WHERE a.name IS NOT NULL RETURN a.name AS name",
+}
+
+
+class EntityIndex:
+    """Normalized name -> {kind: [values]}; a movie's value is its row, others their name."""
+
+    def __init__(self):
+        self.names: Dict[str, Dict[str, list]] = {}
+        self.max_tokens = 1
+
+    @classmethod
+    def load(cls, run_query: Callable) -> "EntityIndex":
+        index = cls()
+        for kind, cypher in ENTITY_QUERIES.items():
+            for row in run_query(cypher, {}):
+                index.add(kind, row["name"], row if kind == "MOVIE" else row["name"])
+        return index
+
+    def add(self, kind: str, name: str, value):
+        key = normalize(name)
+        if not key or key in STOP_WORDS or key.isdigit() and not YEAR_RE.match(key):
+            return
+        self.names.setdefault(key, {}).setdefault(kind, []).append(value)
+        self.max_tokens = max(self.max_tokens, min(MAX_ENTITY_NGRAM, key.count(" ") + 1))
+
+    def spans(self, tokens: List[str]) -> List[tuple]:
+        """
+        Longest names first, left to right, without overlaps:
+        [(start, end, {kind: [values]}), ...]. Four-digit years count as YEAR.
+        """
+        found, i = [], 0
+        while i < len(tokens):
+            for n in range(min(self.max_tokens, len(tokens) - i), 0, -1):
+                kinds = dict(self.names.get(" ".join(tokens[i:i + n]), {}))
+                if n == 1 and YEAR_RE.match(tokens[i]):
+                    kinds["YEAR"] = [int(tokens[i])]
+                if kinds:
+                    found.append((i, i + n, kinds))
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+    def __len__(self):
+        return len(self.names)
+
+
+# --- intents ----------------------------------------------------------------------
+
+PREFIX = r"(?:(?:please|can you|could you|tell me|show me|give me|list|find|i want to know|do you know)\s+)*"
+SUFFIX = r"(?:\s+please)?"
+MOVIES = r"(?:movies|films)"
+
+# intent -> (entity kind, templates over the normalized question with the entity replaced)
+INTENTS = {
+    "movie_cast": ("MOVIE", [
+        r"who (?:acted|starred|stars|plays|played|appears|appeared|was|is) in <MOVIE>",
+        r"who (?:are|were) the (?:actors|cast|stars) (?:of|in) <MOVIE>",
+        r"(?:what is |who is in )?(?:the )?(?:cast|actors|stars) (?:of|in) <MOVIE>",
+    ]),
+    "movie_directors": ("MOVIE", [
+        r"who (?:directed|made) <MOVIE>",
+        r"who (?:is|was|were) the directors? of <MOVIE>",
+        r"(?:the )?directors? of <MOVIE>",
+    ]),
+    "movie_writers": ("MOVIE", [
+        r"who wrote <MOVIE>",
+        r"who (?:is|was|were) the (?:screen)?writers? (?:of|for) <MOVIE>",
+        r"(?:the )?(?:screen)?writers? of <MOVIE>",
+    ]),
+    "movie_genres": ("MOVIE", [
+        r"(?:what|which) genres? (?:is|are|was|does) <MOVIE>(?: in| belong to| have)?",
+        r"(?:the )?genres? of <MOVIE>",
+        r"what kind of (?:movie|film) is <MOVIE>",
+    ]),
+    "movie_awards": ("MOVIE", [
+        r"(?:what|which) awards? (?:did|has|have) <MOVIE> (?:win|won|get|got|receive|received)",
+        r"(?:what|which) awards? (?:was|is|has|have) <MOVIE> (?:been )?nominated for",
+        r"(?:the )?awards? (?:won by|for|of) <MOVIE>",
+        r"did <MOVIE> win (?:any )?awards?",
+    ]),
+    "person_directed": ("PERSON", [
+        rf"(?:what |which )?{MOVIES} (?:were |has been |have been )?directed by <PERSON>",
+        rf"(?:what|which) {MOVIES} (?:did|has) <PERSON> direct(?:ed)?",
+    ]),
+    "person_acted": ("PERSON", [
+        rf"(?:what |which )?{MOVIES} (?:with|starring|featuring) <PERSON>",
+        rf"(?:what|which) {MOVIES} (?:did|has) <PERSON> (?:act|acted|star|starred|appear|appeared|play|played) in",
+        rf"(?:what|which) {MOVIES} (?:is|was) <PERSON> in",
+    ]),
+    "person_wrote": ("PERSON", [
+        rf"(?:what |which )?{MOVIES} (?:were |has been |have been )?written by <PERSON>",
+        rf"(?:what|which) {MOVIES} (?:did|has) <PERSON> (?:write|written)",
+    ]),
+    "genre_movies": ("GENRE", [
+        rf"(?:what|which) (?:are )?(?:some |the )?(?:(?:top|best)(?: (?P<n>\d+))? )?<GENRE> {MOVIES}",
+        rf"(?:some |the )?(?:(?:top|best)(?: (?P<n>\d+))? )?<GENRE> {MOVIES}",
+        rf"{MOVIES} in (?:the )?<GENRE>(?: genre)?",
+    ]),
+    "top_rated_year": ("YEAR", [
+        rf"(?:(?:what|which) (?:are|were) )?(?:the )?(?:top|best|highest)(?: (?P<n>\d+))?(?: rated)? {MOVIES} (?:of|in|from) <YEAR>",
+        rf"(?:what|which) {MOVIES} (?:of|in|from) <YEAR> (?:are|were|have) (?:the )?(?:top|best|highest) rated",
+    ]),
+    "year_movies": ("YEAR", [
+        rf"(?:what|which) {MOVIES} (?:were released|came out|released) in <YEAR>",
+        rf"{MOVIES} (?:released in|from) <YEAR>",
+    ]),
+}
+
+_COMPILED = [
+    (intent, kind, re.compile(f"^{PREFIX}{template}{SUFFIX}$"))
+    for intent, (kind, templates) in INTENTS.items()
+    for template in templates
+]
+
+# Prewritten Cypher per intent; entities and limits are always parameters.
+CYPHER = {
+    "movie_cast": "MATCH (m:Movie)-[:ACTED_IN]->(p:Person) WHERE m.imdb_id IN $imdb_ids "
+                  "RETURN m.imdb_id AS imdb_id, p.name AS name ORDER BY name LIMIT $limit",
+    "movie_directors": "MATCH (m:Movie)-[:DIRECTED_BY]->(p:Person) WHERE m.imdb_id IN $imdb_ids "
+                       "RETURN m.imdb_id AS imdb_id, p.name AS name ORDER BY name LIMIT $limit",
+    "movie_writers": "MATCH (m:Movie)-[:WRITTEN_BY]->(p:Person) WHERE m.imdb_id IN $imdb_ids "
+                     "RETURN m.imdb_id AS imdb_id, p.name AS name ORDER BY name LIMIT $limit",
+    "movie_genres": "MATCH (m:Movie)-[:HAS_GENRE]->(g:Genre) WHERE m.imdb_id IN $imdb_ids "
+                    "RETURN m.imdb_id AS imdb_id, g.name AS name ORDER BY name LIMIT $limit",
+    "movie_awards": "MATCH (m:Movie)-[r:WON|NOMINATED_FOR]->(a:Award) WHERE m.imdb_id IN $imdb_ids "
+                    "RETURN m.imdb_id AS imdb_id, type(r) AS kind, a.name AS name ORDER BY kind DESC, name LIMIT $limit",
+    "person_directed": "MATCH (m:Movie)-[:DIRECTED_BY]->(:Person {name: $name}) "
+                       "RETURN m.title AS title, m.year AS year ORDER BY year DESC LIMIT $limit",
+    "person_acted": "MATCH (m:Movie)-[:ACTED_IN]->(:Person {name: $name}) "
+                    "RETURN m.title AS title, m.year AS year ORDER BY year DESC LIMIT $limit",
+    "person_wrote": "MATCH (m:Movie)-[:WRITTEN_BY]->(:Person {name: $name}) "
+                    "RETURN m.title AS title, m.year AS year ORDER BY year DESC LIMIT $limit",
+    "genre_movies": "MATCH (m:Movie)-[:HAS_GENRE]->(:Genre {name: $name}) WHERE m.imdb_rating IS NOT NULL "
+                    "RETURN m.title AS title, m.year AS year, m.imdb_rating AS rating "
+                    "ORDER BY rating DESC LIMIT $limit",
+    "top_rated_year": "MATCH (m:Movie) WHERE m.year = $year AND m.imdb_rating IS NOT NULL "
+                      "RETURN m.title AS title, m.year AS year, m.imdb_rating AS rating "
+                      "ORDER BY rating DESC LIMIT $limit",
+}
+CYPHER["year_movies"] = CYPHER["top_rated_year"]
+
+
+class Route(NamedTuple):
+    intent: str
+    entity: object  # movie rows for MOVIE, a name for PERSON/GENRE/AWARD, an int for YEAR
+    limit: int
+
+
+# --- answers ---------------------------------------------------------------------
+
+def _join(items: List[str]) -> str:
+    items = list(items)
+    if len(items) <= 1:
+        return "".join(items)
+    return ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def _movie_label(title, year) -> str:
+    return f"{title} ({year})" if year else str(title)
+
+
+def _movie_list(rows, rated=False) -> str:
+    labels = []
+    for row in rows:
+        if rated and row.get("rating") is not None:
+            year = f"{row['year']}, " if row.get("year") else ""
+            labels.append(f"{row['title']} ({year}IMDb {row['rating']})")
+        else:
+            labels.append(_movie_label(row["title"], row.get("year")))
+    return ", ".join(labels)
+
+
+MOVIE_PHRASES = {
+    "movie_cast": "{movie} stars {names}.",
+    "movie_directors": "{movie} was directed by {names}.",
+    "movie_writers": "{movie} was written by {names}.",
+    "movie_genres": "{movie} is listed under {names}.",
+}
+
+LIST_HEADERS = {
+    "person_directed": "Movies directed by {entity}",
+    "person_acted": "Movies featuring {entity}",
+    "person_wrote": "Movies written by {entity}",
+    "genre_movies": "Top-rated {entity} movies",
+    "top_rated_year": "Top-rated movies from {entity}",
+    "year_movies": "Movies released in {entity}, highest rated first",
+}
+
+
+def format_answer(route: Route, rows: List[dict]) -> str:
+    if route.intent in MOVIE_PHRASES or route.intent == "movie_awards":
+        by_movie = {}
+        for row in rows:
+            by_movie.setdefault(row["imdb_id"], []).append(row)
+        sentences = []
+        for movie in route.entity:
+            movie_rows = by_movie.get(movie["imdb_id"])
+            if not movie_rows:
+                continue
+            label = _movie_label(movie["name"], movie.get("year"))
+            if route.intent == "movie_awards":
+                won = [r["name"] for r in movie_rows if r["kind"] == "WON"]
+                nominated = [r["name"] for r in movie_rows if r["kind"] != "WON"]
+                parts = []
+                if won:
+                    parts.append(f"{label} won {_join(won)}.")
+                if nominated:
+                    parts.append(f"{label if not won else 'It'} was nominated for {_join(nominated)}.")
+                sentences.append(" ".join(parts))
+            else:
+                names = _join([r["name"] for r in movie_rows])
+                sentences.append(MOVIE_PHRASES[route.intent].format(movie=label, names=names))
+        answer = " ".join(sentences)
+    else:
+        rated = route.intent in ("genre_movies", "top_rated_year", "year_movies")
+        header = LIST_HEADERS[route.intent].format(entity=route.entity)
+        answer = f"{header}: {_movie_list(rows, rated=rated)}."
+    if len(rows) >= route.limit:
+        answer += f" (Showing the first {route.limit}.)"
+    return answer
+
+
+class FastPath:
+    def __init__(self, query_runner: Optional[Callable] = None, entity_ttl: float = FASTPATH_ENTITY_TTL,
+                 max_results: int = FASTPATH_MAX_RESULTS, enabled: bool = FASTPATH_ENABLED):
+        self.query_runner = query_runner  # (cypher, params) -> rows; defaults to graph_db.run_query
+        self.entity_ttl = entity_ttl
+        self.max_results = max_results
+        self.enabled = enabled
+        self._entities: Optional[EntityIndex] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def run_query(self, cypher: str, params: dict) -> List[dict]:
+        if self.query_runner is None:
+            from modules.graph_db import run_query
+            self.query_runner = run_query
+        return self.query_runner(cypher, params)
+
+    def _load(self):
+        started = time.perf_counter()
+        index = EntityIndex.load(self.run_query)
+        self._entities, self._loaded_at = index, time.monotonic()
+        print(f"[FASTPATH] Loaded {len(index)} entity names in {time.perf_counter() - started:.2f}s")
+
+    def _refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"[FASTPATH] Entity refresh failed, keeping the previous names: {e}")
+        finally:
+            self._lock.release()
+
+    def entities(self) -> EntityIndex:
+        """The entity index; loads it on first use and refreshes it in the background once stale."""
+        if self._entities is None:
+            with self._lock:
+                if self._entities is None:
+                    self._load()
+        elif time.monotonic() - self._loaded_at > self.entity_ttl and self._lock.acquire(blocking=False):
+            threading.Thread(target=self._refresh, name="fastpath-refresh", daemon=True).start()
+        return self._entities
+
+    def invalidate(self):
+        """Makes the next question re-read the entity names (e.g. after reloading the graph)."""
+        self._loaded_at = 0.0
+
+    def route(self, question: str) -> Optional[Route]:
+        tokens = normalize(question).split()
+        spans = self.entities().spans(tokens)
+        if not spans or len(spans) > 3:
+            return None
+
+        options = [[(kind, values) for kind, values in kinds.items()] for _, _, kinds in spans]
+        for typing in itertools.islice(itertools.product(*options), MAX_VARIANTS):
+            pieces, last = [], 0
+            for (start, end, _), (kind, _) in zip(spans, typing):
+                pieces += tokens[last:start] + [f"<{kind}>"]
+                last = end
+            text = " ".join(pieces + tokens[last:])
+            for intent, kind, pattern in _COMPILED:
+                m = pattern.match(text)
+                if m is None:
+                    continue
+                values = [v for k, v in typing if k == kind]
+                if len(values) != 1:
+                    continue
+                entity = values[0] if kind == "MOVIE" else values[0][0]
+                n = m.groupdict().get("n")
+                limit = min(int(n), self.max_results) if n and int(n) > 0 else self.max_results
+                return Route(intent, entity, limit)
+        return None
+
+    def params(self, route: Route) -> dict:
+        params = {"limit": route.limit}
+        if route.intent.startswith("movie_"):
+            params["imdb_ids"] = [movie["imdb_id"] for movie in route.entity]
+        elif route.intent in ("top_rated_year", "year_movies"):
+            params["year"] = route.entity
+        else:
+            params["name"] = route.entity
+        return params
+
+    def answer(self, question: str) -> Optional[str]:
+        """A formatted answer, or None when the agent should handle the question."""
+        if not self.enabled or not question:
+            return None
+        intent = "none"
+        try:
+            with metrics.stage("fastpath.answer"):
+                route = self.route(question)
+                if route is None:
+                    metrics.fastpath_requests_total.inc(intent=intent, result="no_match")
+                    return None
+                intent = route.intent
+                rows = self.run_query(CYPHER[intent], self.params(route))
+                if not rows:
+                    # Could be a phrasing the template misread; let the agent try.
+                    metrics.fastpath_requests_total.inc(intent=intent, result="empty")
+                    return None
+                answer = format_answer(route, rows)
+            metrics.fastpath_requests_total.inc(intent=intent, result="answered")
+            return answer
+        except Exception as e:
+            metrics.fastpath_requests_total.inc(intent=intent, result="error")
+            print(f"[FASTPATH] Falling back to the agent ({type(e).__name__}: {e})")
+            return None
+
+
+fast_path = FastPath()
@@ -0,0 +1,50 @@
+# modules/graph_db.py
+"""
+One pooled Neo4j driver per process, for code that runs its own Cypher (the
+fast path) instead of going through GraphCypherQAChain.
+"""
+import os
+import threading
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from neo4j import GraphDatabase, Query, READ_ACCESS
+
+from modules import metrics
+
+load_dotenv()
+
+NEO4J_URL = os.getenv("NEO4J_URL", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "12345678")
+NEO4J_DB = os.getenv("NEO4J_DB", "moviesdb")
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+NEO4J_QUERY_TIMEOUT = float(os.getenv("NEO4J_QUERY_TIMEOUT", "10"))
+
+_driver = None
+_driver_lock = threading.Lock()
+
+
+def get_driver():
+    global _driver
+    if _driver is None:
+        with _driver_lock:
+            if _driver is None:
+                _driver = GraphDatabase.driver(NEO4J_URL, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                               max_connection_pool_size=NEO4J_POOL_SIZE)
+    return _driver
+
+
+def run_query(cypher: str, params: Optional[dict] = None, timeout: float = NEO4J_QUERY_TIMEOUT) -> List[dict]:
+    """Runs a read query in its own session (connections come from the pool) and returns the rows as dicts."""
+    with metrics.stage("neo4j.query"):
+        with get_driver().session(database=NEO4J_DB, default_access_mode=READ_ACCESS) as session:
+            return session.run(Query(cypher, timeout=timeout), params or {}).data()
+
+
+def close_driver():
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
@@ -0,0 +1,208 @@
+# modules/graph_schema.py
+"""
+Schema management for the movies graph.
+
+- ensure_schema() creates the uniqueness constraints behind every MERGE key
+  (Movie.imdb_id, Person/Genre/Company/Award.name) and the indexes used for
+  lookups. It is idempotent (IF NOT EXISTS); utils.graph_loader runs it before
+  loading.
+- SchemaSnapshot turns the graph's structured schema into a compact schema
+  text for one question: only the relationships the question points at, the
+  labels on either end, and the properties it mentions plus a few core ones.
+  The Cypher-generation prompt gets that instead of the whole schema.
+
+    python -m modules.graph_schema ensure
+    python -m modules.graph_schema show "Who directed Inception?"
+"""
+import os
+import re
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GRAPH_SCHEMA_COMPACT = os.getenv("GRAPH_SCHEMA_COMPACT", "1") == "1"
+GRAPH_SCHEMA_CACHE_SIZE = int(os.getenv("GRAPH_SCHEMA_CACHE_SIZE", "256"))
+
+CONSTRAINTS = [
+    "CREATE CONSTRAINT movie_imdb_id IF NOT EXISTS FOR (m:Movie) REQUIRE m.imdb_id IS UNIQUE",
+    "CREATE CONSTRAINT person_name IF NOT EXISTS FOR (p:Person) REQUIRE p.name IS UNIQUE",
+    "CREATE CONSTRAINT genre_name IF NOT EXISTS FOR (g:Genre) REQUIRE g.name IS UNIQUE",
+    "CREATE CONSTRAINT company_name IF NOT EXISTS FOR (c:Company) REQUIRE c.name IS UNIQUE",
+    "CREATE CONSTRAINT award_name IF NOT EXISTS FOR (a:Award) REQUIRE a.name IS UNIQUE",
+]
+
+INDEXES = [
+    "CREATE INDEX movie_title IF NOT EXISTS FOR (m:Movie) ON (m.title)",
+    "CREATE INDEX movie_year IF NOT EXISTS FOR (m:Movie) ON (m.year)",
+    "CREATE INDEX movie_imdb_rating IF NOT EXISTS FOR (m:Movie) ON (m.imdb_rating)",
+]
+
+
+def ensure_schema(driver, database: Optional[str] = None, wait_seconds: float = 300) -> List[str]:
+    """Creates missing constraints and indexes and waits until they are online; returns the statements run."""
+    statements = CONSTRAINTS + INDEXES
+    with driver.session(database=database) as session:
+        for statement in statements:
+            session.run(statement).consume()
+        session.run("CALL db.awaitIndexes($seconds)", seconds=int(wait_seconds)).consume()
+    print(f"[GRAPH_SCHEMA] {len(CONSTRAINTS)} constraints and {len(INDEXES)} indexes in place")
+    return statements
+
+
+# --- compact schema for prompts --------------------------------------------------
+
+TOKEN_PATTERN = r"[a-z0-9]+"
+
+# Question words that point at a relationship type.
+RELATIONSHIP_HINTS = {
+    "DIRECTED_BY": {"direct", "directed", "directs", "director", "directors", "filmmaker", "by"},  # "movies by X"
+    "WRITTEN_BY": {"wrote", "write", "writes", "writer", "writers", "written", "screenplay", "screenwriter"},
+    "ACTED_IN": {"act", "acted", "acts", "actor", "actors", "actress", "cast", "star", "stars", "starred",
+                 "starring", "played", "plays", "role", "appeared", "with"},
+    "PRODUCED_BY": {"produce", "produced", "producer", "producers", "company", "companies", "studio", "studios"},
+    "CASTING_DIRECTED_BY": {"casting"},
+    "HAS_GENRE": {"genre", "genres", "kind", "type", "comedy", "comedies", "drama", "dramas", "horror",
+                  "thriller", "thrillers", "action", "romance", "animated", "animation", "documentary", "sci"},
+    "WON": {"won", "win", "wins", "winning", "award", "awards", "oscar", "oscars", "bafta", "prize"},
+    "NOMINATED_FOR": {"nominated", "nomination", "nominations", "nominee", "award", "awards"},
+}
+
+# Question words that point at a property.
+PROPERTY_HINTS = {
+    "imdb_rating": {"rating", "rated", "ratings", "imdb", "best", "top", "highest", "lowest", "worst"},
+    "imdb_votes": {"votes", "popular", "popularity"},
+    "metascore": {"metascore", "metacritic", "critics", "critic"},
+    "budget": {"budget", "cost", "expensive", "cheapest", "money"},
+    "plot": {"plot", "about", "story", "summary"},
+    "countries": {"country", "countries"},
+    "keywords": {"keyword", "keywords", "theme", "themes"},
+    "taglines": {"tagline", "taglines", "slogan"},
+    "age_restrictions": {"age", "restriction", "restrictions", "certificate", "pg"},
+    "akas": {"aka", "akas", "alternative", "known"},
+    "roles": {"roles", "role", "job"},
+}
+
+# Always listed for a label that is included.
+CORE_PROPERTIES = {
+    "Movie": ["title", "year", "imdb_id"],
+    "Person": ["name"],
+    "Genre": ["name"],
+    "Company": ["name"],
+    "Award": ["name"],
+}
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(TOKEN_PATTERN, (text or "").lower()))
+
+
+class SchemaSnapshot:
+    """
+    Compact per-question schema text from a graph's structured schema. Texts are
+    cached by the parts they include; a changed graph schema clears the cache.
+    """
+
+    def __init__(self, graph, cache_size: int = GRAPH_SCHEMA_CACHE_SIZE):
+        self.graph = graph
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._source = None
+
+    def _structured(self) -> dict:
+        schema = self.graph.get_structured_schema or {}
+        with self._lock:
+            if schema is not self._source:
+                self._source = schema
+                self._cache.clear()
+        return schema
+
+    def select(self, question: str, schema: dict):
+        """(labels, relationships, properties) relevant to the question."""
+        words = _tokens(question)
+        relationships = schema.get("relationships") or []
+        chosen = [r for r in relationships if words & RELATIONSHIP_HINTS.get(r["type"], set())]
+        if not chosen:
+            chosen = list(relationships)  # no hint: every relationship, still without the extra properties
+        labels = {"Movie"} | {r["start"] for r in chosen} | {r["end"] for r in chosen}
+        properties = {name for name, hints in PROPERTY_HINTS.items() if words & hints}
+        for label, props in (schema.get("node_props") or {}).items():
+            if label.lower() in words or label.lower() + "s" in words:
+                labels.add(label)
+            properties |= {p["property"] for p in props if p["property"].lower() in words}
+        return labels, chosen, properties
+
+    def for_question(self, question: str) -> str:
+        schema = self._structured()
+        if not schema.get("node_props"):
+            return self.graph.schema  # nothing structured to pick from
+        labels, chosen, properties = self.select(question, schema)
+        key = (frozenset(labels), frozenset((r["start"], r["type"], r["end"]) for r in chosen), frozenset(properties))
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return text
+        text = self.format(schema, labels, chosen, properties)
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    @staticmethod
+    def format(schema: dict, labels, relationships, properties) -> str:
+        node_props: Dict[str, list] = schema.get("node_props") or {}
+        rel_props: Dict[str, list] = schema.get("rel_props") or {}
+        lines = ["Node properties:"]
+        for label in sorted(labels):
+            wanted = set(CORE_PROPERTIES.get(label, [])) | properties
+            props = [p for p in node_props.get(label, []) if p["property"] in wanted]
+            lines.append(f"{label} {{" + ", ".join(f"{p['property']}: {p['type']}" for p in props) + "}")
+        types = sorted({r["type"] for r in relationships})
+        with_props = [t for t in types if rel_props.get(t)]
+        if with_props:
+            lines.append("Relationship properties:")
+            for t in with_props:
+                lines.append(f"{t} {{" + ", ".join(f"{p['property']}: {p['type']}" for p in rel_props[t]) + "}")
+        lines.append("The relationships:")
+        lines += [f"(:{r['start']})-[:{r['type']}]->(:{r['end']})" for r in relationships]
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Graph schema: constraints/indexes and compact prompt schema.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ensure", help="Create missing constraints and indexes.")
+    show = sub.add_parser("show", help="Print the compact schema for a question next to the full one's size.")
+    show.add_argument("question")
+    args = parser.parse_args(argv)
+
+    if args.command == "ensure":
+        from neo4j import GraphDatabase
+        from modules.graph_db import NEO4J_URL, NEO4J_USER, NEO4J_PASSWORD, NEO4J_DB
+
+        driver = GraphDatabase.driver(NEO4J_URL, auth=(NEO4J_USER, NEO4J_PASSWORD))
+        try:
+            for statement in ensure_schema(driver, NEO4J_DB):
+                print(statement)
+        finally:
+            driver.close()
+        return 0
+
+    from modules.agent import get_graph_qa
+
+    graph = get_graph_qa().graph
+    compact = SchemaSnapshot(graph).for_question(args.question)
+    print(compact)
+    print(f"\n[GRAPH_SCHEMA] {len(compact)} chars (full schema: {len(graph.schema)} chars)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
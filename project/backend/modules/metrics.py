@@ -0,0 +1,303 @@
+# modules/metrics.py
+"""
+In-process metrics in the Prometheus text format, served on /metrics.
+
+Hot paths wrap their work in stage("name"), which feeds the stage latency
+histogram and, while a request is being handled, that request's trace. A client
+sending "X-Trace: 1" gets the trace back as a Server-Timing header. Requests
+slower than SLOW_REQUEST_MS are logged with their stages whether or not they
+asked for it.
+"""
+import os
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "5000"))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def totals(self):
+        """{label values: (sum, count)}, e.g. for diffing two points in time."""
+        with self._lock:
+            return {key: (state[-2], state[-1]) for key, state in self._values.items()}
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, cls, name, help_text, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def add_collector(self, fn):
+        """
+        fn() is called at scrape time and returns (name, kind, help, samples)
+        tuples, samples being [(labels_dict, value), ...]; for gauges or counters
+        that other modules already keep.
+        """
+        self._collectors.append(fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[METRICS] Collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_seconds = registry.histogram(
+    "cinegraph_http_request_seconds", "HTTP request latency.", ("endpoint", "method", "status"))
+stage_seconds = registry.histogram(
+    "cinegraph_stage_seconds", "Latency of one stage of request handling.", ("stage",))
+errors_total = registry.counter(
+    "cinegraph_errors_total", "Errors by stage.", ("stage",))
+llm_calls_total = registry.counter(
+    "cinegraph_llm_calls_total", "LLM calls by model.", ("model",))
+llm_tokens_total = registry.counter(
+    "cinegraph_llm_tokens_total", "LLM tokens by model and kind (prompt/completion).", ("model", "kind"))
+tool_calls_total = registry.counter(
+    "cinegraph_tool_calls_total", "Agent tool calls by tool.", ("tool",))
+agent_iterations_total = registry.counter(
+    "cinegraph_agent_iterations_total", "Agent model turns (ReAct loop iterations).")
+cache_requests_total = registry.counter(
+    "cinegraph_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+fastpath_requests_total = registry.counter(
+    "cinegraph_fastpath_requests_total", "Fast-path routing by intent and result (answered/no_match/empty/error).",
+    ("intent", "result"))
+cypher_guard_total = registry.counter(
+    "cinegraph_cypher_guard_total", "Generated Cypher by guard outcome (passed/rewritten/rejected).", ("result",))
+agent_tool_calls_total = registry.counter(
+    "cinegraph_agent_tool_calls_total", "Agent tool calls by tool and outcome (ok/error/timeout).", ("tool", "result"))
+singleflight_requests_total = registry.counter(
+    "cinegraph_singleflight_requests_total",
+    "Coalescable requests by endpoint and role (leader/follower/fallback).", ("endpoint", "role"))
+
+
+def render():
+    return registry.render()
+
+
+# --- per-request traces -------------------------------------------------------
+
+class RequestTrace:
+    def __init__(self, endpoint, trace_id=None, requested=False):
+        self.endpoint = endpoint
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.requested = requested
+        self.started = time.perf_counter()
+        self.stages = []  # (name, ms); appended from worker threads too
+
+    def add(self, name, seconds):
+        self.stages.append((name, round(seconds * 1000, 1)))
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def server_timing(self):
+        return ", ".join(f"{name.replace(' ', '_')};dur={ms}" for name, ms in self.stages)
+
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def begin_request(endpoint, headers):
+    """Starts a trace for the current context; pass the result to finish_request."""
+    requested = (headers.get("X-Trace") or "").lower() in ("1", "true", "yes")
+    trace = RequestTrace(endpoint, headers.get("X-Trace-Id"), requested)
+    return trace, _current_trace.set(trace)
+
+
+def finish_request(state, method, status, record=True):
+    """
+    Records the request and returns the headers to add to the response (the
+    trace, when the client asked for it). With record=False (a streamed body
+    still to come) call record_request when the response closes.
+    """
+    trace, token = state
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        pass  # finished from a different context (e.g. a copied one)
+    elapsed_ms = trace.elapsed_ms()
+    if record:
+        record_request(trace, method, status)
+    if not trace.requested:
+        return {}
+    return {"X-Trace-Id": trace.trace_id, "Server-Timing": f"total;dur={elapsed_ms}" +
+            (", " + trace.server_timing() if trace.stages else "")}
+
+
+def record_request(trace, method, status):
+    elapsed_ms = trace.elapsed_ms()
+    http_request_seconds.observe(elapsed_ms / 1000, endpoint=trace.endpoint, method=method, status=status)
+    if elapsed_ms >= SLOW_REQUEST_MS:
+        print(f"[SLOW] {method} {trace.endpoint} {status} {elapsed_ms}ms trace={trace.trace_id} stages={trace.stages}")
+
+
+def observe_stage(name, seconds):
+    stage_seconds.observe(seconds, stage=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(stage=name)
+        raise
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Times every LLM call and counts its tokens; attach via callbacks=[...]."""
+
+    def __init__(self, stage_name="llm.call"):
+        self.stage_name = stage_name
+        self._started = {}
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            observe_stage(self.stage_name, time.perf_counter() - started)
+        output = response.llm_output or {}
+        model = output.get("model_name") or output.get("model") or "unknown"
+        llm_calls_total.inc(model=model)
+
+        prompt_tokens = completion_tokens = 0
+        usage = output.get("token_usage") or {}
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0) or 0
+            completion_tokens = usage.get("completion_tokens", 0) or 0
+        else:
+            for generations in response.generations:
+                for generation in generations:
+                    meta = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += meta.get("input_tokens", 0) or 0
+                    completion_tokens += meta.get("output_tokens", 0) or 0
+        if prompt_tokens:
+            llm_tokens_total.inc(prompt_tokens, model=model, kind="prompt")
+        if completion_tokens:
+            llm_tokens_total.inc(completion_tokens, model=model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        errors_total.inc(stage=self.stage_name)
@@ -0,0 +1,204 @@
+# modules/rag_index.py
+import os
+import json
+import time
+import glob
+import shutil
+import pickle
+import hashlib
+import argparse
+
+from langchain_community.vectorstores import FAISS
+
+# Bump when the on-disk layout or the way documents are built changes.
+INDEX_FORMAT_VERSION = 1
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+META_FILE = "meta.json"
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def index_key(pdf_path: str, embedding_model: str, splitter_settings: dict) -> str:
+    """
+    Identity of a persisted index: the PDF's content hash, the embedding model
+    and the splitter settings. Any change to one of them means a rebuild.
+    """
+    payload = {
+        "format": INDEX_FORMAT_VERSION,
+        "pdf_sha256": file_sha256(pdf_path),
+        "embedding_model": embedding_model,
+        "splitter": splitter_settings,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _read_faiss_index(path: str):
+    import faiss
+
+    # Prefer a memory-mapped, read-only open so several workers on the same
+    # host share the page cache instead of each holding a private copy.
+    flags = [getattr(faiss, "IO_FLAG_MMAP_IFC", None), getattr(faiss, "IO_FLAG_MMAP", None)]
+    for flag in flags:
+        if flag is None:
+            continue
+        try:
+            return faiss.read_index(path, flag | getattr(faiss, "IO_FLAG_READ_ONLY", 0))
+        except Exception:
+            continue
+    return faiss.read_index(path)
+
+
+def read_meta(index_dir: str):
+    meta_path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_index(index_dir: str, key: str, embeddings):
+    """
+    Returns the persisted FAISS store if its key matches, otherwise None.
+    """
+    # Resolved once, so every file comes from the same version even if save_index swaps it meanwhile.
+    index_dir = os.path.realpath(index_dir)
+    meta = read_meta(index_dir)
+    if not meta or meta.get("key") != key:
+        return None
+
+    index = _read_faiss_index(os.path.join(index_dir, INDEX_FILE))
+    # The docstore is written by this module only (see save_index).
+    with open(os.path.join(index_dir, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def save_index(vectorstore, index_dir: str, key: str, extra_meta: dict = None):
+    """
+    Writes the store to a new versioned dir next to index_dir, then points
+    index_dir (a symlink) at it in one rename, so a reader never sees a
+    half-written or missing index. The previous version is kept for readers
+    still loading it; older ones are removed.
+    """
+    index_dir = os.path.abspath(index_dir).rstrip("/\\")
+    os.makedirs(os.path.dirname(index_dir), exist_ok=True)
+    version_dir = f"{index_dir}.v{time.time_ns()}-{os.getpid()}"
+
+    vectorstore.save_local(version_dir)
+    meta = {"key": key, "format": INDEX_FORMAT_VERSION, "vectors": vectorstore.index.ntotal}
+    meta.update(extra_meta or {})
+    with open(os.path.join(version_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    previous = os.path.realpath(index_dir) if os.path.islink(index_dir) else None
+    try:
+        _point(index_dir, version_dir)
+    except (OSError, NotImplementedError) as e:
+        # No symlinks here (e.g. Windows without the privilege): move the old dir aside, then rename.
+        print(f"[RAG_INDEX] Could not link {index_dir} ({e}); replacing the directory")
+        _swap_dir(index_dir, version_dir)
+        previous = None
+    for old in glob.glob(f"{glob.escape(index_dir)}.v*"):
+        if os.path.realpath(old) not in (os.path.realpath(version_dir), previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def _point(index_dir: str, version_dir: str):
+    link = f"{index_dir}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_dir), link, target_is_directory=True)
+    try:
+        if os.path.isdir(index_dir) and not os.path.islink(index_dir):
+            # An index saved before index_dir became a link; the rename below cannot replace a directory.
+            _swap_dir(index_dir, None)
+        os.replace(link, index_dir)
+    except BaseException:
+        os.remove(link)
+        raise
+
+
+def _swap_dir(index_dir: str, new_dir):
+    """Renames index_dir aside, moves new_dir (if any) into its place, then deletes the old one."""
+    aside = f"{index_dir}.old-{os.getpid()}"
+    if os.path.lexists(index_dir):
+        os.replace(index_dir, aside)
+    if new_dir is not None:
+        os.replace(new_dir, index_dir)
+    shutil.rmtree(aside, ignore_errors=True)
+
+
+def load_or_build(index_dir: str, key: str, embeddings, build_fn, rebuild: bool = False, extra_meta: dict = None):
+    """
+    Loads the index stored under index_dir when its key matches; otherwise calls
+    build_fn() to create a fresh FAISS store and persists it.
+
+    Returns (vectorstore, loaded_from_disk).
+    """
+    if not rebuild:
+        try:
+            store = load_index(index_dir, key, embeddings)
+            if store is not None:
+                print(f"[RAG_INDEX] Loaded index from {index_dir}")
+                return store, True
+        except Exception as e:
+            print(f"[RAG_INDEX] Could not load index from {index_dir}, rebuilding: {e}")
+
+    store = build_fn()
+    try:
+        save_index(store, index_dir, key, extra_meta)
+        print(f"[RAG_INDEX] Saved index to {index_dir}")
+    except Exception as e:
+        # A read-only filesystem should not stop the bot from serving.
+        print(f"[RAG_INDEX] Could not persist index to {index_dir}: {e}")
+    return store, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prebuild the /rag FAISS index.")
+    parser.add_argument("--pdf", default=None, help="Source PDF (defaults to the ChatBot config).")
+    parser.add_argument("--index-dir", default=None, help="Output directory (defaults to the ChatBot config).")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the stored key matches.")
+    parser.add_argument("--check", action="store_true", help="Only report whether the stored index is current.")
+    parser.add_argument("--chunk-vectors", choices=["embed", "pool"], default=None,
+                        help="Embed each chunk, or pool the splitter's sentence vectors (defaults to RAG_CHUNK_VECTORS).")
+    args = parser.parse_args(argv)
+
+    from modules.chatbot import Config, VectorStoreIndex
+
+    config = Config()
+    pdf_path = args.pdf or config.pdf_path
+    index_dir = args.index_dir or config.index_dir
+    chunk_vectors = args.chunk_vectors or config.chunk_vectors
+
+    if args.check:
+        key = VectorStoreIndex.key_for(pdf_path, chunk_vectors=chunk_vectors)
+        meta = read_meta(index_dir)
+        current = bool(meta) and meta.get("key") == key
+        print(f"[RAG_INDEX] {index_dir}: {'current' if current else 'stale or missing'}")
+        return 0 if current else 1
+
+    index = VectorStoreIndex.load_or_build(pdf_path, index_dir, rebuild=args.rebuild, chunk_vectors=chunk_vectors)
+    print(f"[RAG_INDEX] {index.vectorstore.index.ntotal} vectors ready in {index_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,208 @@
+# modules/registry.py
+"""
+Lazily built, process-wide components (ChatBot, agent, Chroma, metacritic model,
+fast-path entity names).
+
+Nothing heavy happens at import: a component is built the first time get() asks
+for it, or up front by warmup(). ENABLED_COMPONENTS lists what this deployment
+serves; /ready is green once all of those are loaded.
+
+    python -m modules.registry warmup            # build the enabled components, print timings
+    python -m modules.registry profile app       # top imports by cumulative time (python -X importtime)
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import subprocess
+import traceback
+
+DEFAULT_COMPONENTS = "agent,chatbot,metacritic"
+# Start building the enabled components in the background as soon as the app imports.
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "0") == "1"
+
+
+def enabled_components():
+    names = os.getenv("ENABLED_COMPONENTS", DEFAULT_COMPONENTS)
+    return [n.strip() for n in names.split(",") if n.strip()]
+
+
+class Component:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.instance = None
+        self.error = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.instance is not None
+
+
+class Registry:
+    def __init__(self):
+        self._components = {}
+
+    def register(self, name, factory):
+        self._components[name] = Component(name, factory)
+
+    def override(self, name, instance):
+        """Installs a ready-made instance, e.g. a fake for benchmarks."""
+        component = self._components.get(name) or Component(name, None)
+        component.instance, component.error = instance, None
+        self._components[name] = component
+
+    def names(self):
+        return list(self._components)
+
+    def peek(self, name):
+        """The instance if it is already built, else None; never builds."""
+        component = self._components.get(name)
+        return component.instance if component else None
+
+    def get(self, name):
+        component = self._components.get(name)
+        if component is None:
+            raise KeyError(f"Unknown component '{name}'")
+        if component.instance is not None:
+            return component.instance
+        with component.lock:
+            if component.instance is None:
+                started = time.perf_counter()
+                try:
+                    component.instance = component.factory()
+                    component.error = None
+                except Exception as e:
+                    component.error = f"{type(e).__name__}: {e}"
+                    raise RuntimeError(f"Failed to initialize {name}: {e}") from e
+                finally:
+                    component.load_seconds = round(time.perf_counter() - started, 3)
+                print(f"[REGISTRY] {name} ready in {component.load_seconds}s")
+        return component.instance
+
+    def warmup(self, names=None):
+        """Builds the given (default: enabled) components; returns {name: error or None}."""
+        results = {}
+        for name in names or enabled_components():
+            try:
+                self.get(name)
+                results[name] = None
+            except Exception as e:
+                traceback.print_exc()
+                results[name] = str(e)
+        return results
+
+    def warmup_in_background(self, names=None):
+        thread = threading.Thread(target=self.warmup, args=(names,), name="registry-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self, names=None):
+        names = names or enabled_components()
+        components = {}
+        for name in names:
+            component = self._components.get(name)
+            if component is None:
+                components[name] = {"loaded": False, "error": "not registered"}
+                continue
+            components[name] = {
+                "loaded": component.loaded,
+                "load_seconds": component.load_seconds,
+                "error": component.error,
+            }
+        return {"ready": all(c["loaded"] for c in components.values()), "components": components}
+
+
+def _chatbot():
+    from modules.chatbot import ChatBot
+    return ChatBot()
+
+
+def _agent():
+    from modules import agent
+    return agent.get_agent()
+
+
+def _chroma():
+    from modules import chroma_client
+    from modules.embeddings import get_embedding_service
+
+    get_embedding_service(chroma_client.EMBEDDING_MODEL)
+    return chroma_client.get_collection()
+
+
+def _fastpath():
+    from modules.fastpath import fast_path
+    fast_path.entities()
+    return fast_path
+
+
+def _metacritic():
+    # Loads the vectorizer and XGBoost model on import.
+    from models import metacritic
+    return metacritic
+
+
+registry = Registry()
+registry.register("chatbot", _chatbot)
+registry.register("agent", _agent)
+registry.register("chroma", _chroma)
+registry.register("metacritic", _metacritic)
+registry.register("fastpath", _fastpath)
+
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(module, top=25):
+    """
+    Imports `module` in a fresh interpreter with -X importtime and returns the
+    slowest imports as (cumulative_ms, self_ms, name), slowest first.
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=backend_dir, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, name))
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else f"import {module} failed")
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Component warmup and startup profiling.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm = sub.add_parser("warmup", help="Build components now (default: ENABLED_COMPONENTS).")
+    warm.add_argument("components", nargs="*")
+    prof = sub.add_parser("profile", help="Import-time report for a module.")
+    prof.add_argument("module", nargs="?", default="app")
+    prof.add_argument("--top", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    if args.command == "warmup":
+        results = registry.warmup(args.components or None)
+        for name, info in registry.status(list(results))["components"].items():
+            state = "ok" if info["loaded"] else f"failed ({info['error']})"
+            print(f"[REGISTRY] {name}: {state} in {info['load_seconds']}s")
+        return 0 if all(err is None for err in results.values()) else 1
+
+    rows = profile_imports(args.module, args.top)
+    print(f"{'cumulative ms':>14} {'self ms':>10}  module")
+    for cumulative_ms, self_ms, name in rows:
+        print(f"{cumulative_ms:14.1f} {self_ms:10.1f}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
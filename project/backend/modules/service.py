@@ -0,0 +1,173 @@
+# modules/service.py
+# Request logic shared by the Flask app (app.py) and the async app (async_app.py).
+import os
+import re
+import hmac
+import json
+import uuid
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
+
+system_instruction = """
+You are an assistant connected to tools.
+- For any question about movies, genres, people, awards, reviews, or data stored in the Neo4j graph, ALWAYS use the Neo4jGraphQA tool.
+- For real-world facts not in the graph, use the WebSearch tool.
+- Do not answer directly without using a tool unless the question is purely about yourself or general instructions.
+"""
+
+feedback_system_instruction = (
+    "You are an assistant that can use tools (Neo4j/WebSearch). "
+    "The user said the previous answer was not good; produce an improved, concise reply."
+)
+
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+def resolve_session_id(data, headers=None):
+    """
+    Conversation id supplied by the client (JSON "session_id" or X-Session-Id
+    header). A fresh one is issued when it is missing or malformed.
+    """
+    session_id = (data or {}).get("session_id") or (headers or {}).get("X-Session-Id")
+    if session_id and SESSION_ID_RE.match(str(session_id)):
+        return str(session_id)
+    return uuid.uuid4().hex
+
+
+def thread_config(session_id):
+    return {"configurable": {"thread_id": f"chat:{session_id}"}}
+
+
+def _with_system(existing, system_txt, user_message):
+    messages = [] if existing else [SystemMessage(content=system_txt)]
+    return messages + [HumanMessage(content=user_message)], not existing
+
+
+def conversation_messages(agent_app, config, system_txt, user_message):
+    """
+    Returns (messages, is_new_thread). The system prompt goes in once per thread;
+    trim_history keeps it from then on.
+    """
+    try:
+        existing = agent_app.get_state(config).values.get("messages")
+    except Exception:
+        existing = None
+    return _with_system(existing, system_txt, user_message)
+
+
+async def aconversation_messages(agent_app, config, system_txt, user_message):
+    try:
+        existing = (await agent_app.aget_state(config)).values.get("messages")
+    except Exception:
+        existing = None
+    return _with_system(existing, system_txt, user_message)
+
+
+def remember_exchange(agent_app, config, messages, answer):
+    """
+    Records a question answered outside the agent (e.g. from the answer cache) in
+    the thread, so follow-up questions still have it as context.
+    """
+    try:
+        agent_app.update_state(config, {"messages": messages + [AIMessage(content=answer)]}, as_node="agent")
+    except Exception as e:
+        print(f"[CHAT] Could not record cached answer in thread: {e}")
+
+
+async def aremember_exchange(agent_app, config, messages, answer):
+    try:
+        await agent_app.aupdate_state(config, {"messages": messages + [AIMessage(content=answer)]}, as_node="agent")
+    except Exception as e:
+        print(f"[CHAT] Could not record cached answer in thread: {e}")
+
+
+def admin_authorized(headers, remote_addr):
+    """
+    Admin endpoints need the X-Admin-Token header when ADMIN_TOKEN is set, and
+    are limited to localhost when it is not.
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    if token:
+        return hmac.compare_digest(headers.get("X-Admin-Token", ""), token)
+    return remote_addr in ("127.0.0.1", "::1")
+
+
+def feedback_messages(user_message, bot_message, feedback):
+    retry_prompt = (
+        f"The user originally asked: {user_message}\n\n"
+        f"The assistant responded:\n{bot_message}\n\n"
+        f"The user rated the previous answer: {feedback}.\n\n"
+        "Produce an improved, concise and actionable answer. Use the graph or web tools if necessary."
+    )
+    return [
+        SystemMessage(content=feedback_system_instruction),
+        HumanMessage(content=retry_prompt),
+    ]
+
+
+retry_system_instruction = (
+    "You are an assistant that can use tools (Neo4j/CSV). The user said your previous answer was not good. "
+    "The tool results it was built from are in the conversation; answer from them. Call a tool only if "
+    "they do not contain the data needed."
+)
+
+
+def _tool_result_content(call):
+    content = str(call.get("output") or "")
+    data = call.get("data") or {}
+    if data.get("cypher"):
+        content += f"\n\nCypher: {data['cypher']}"
+    if data.get("rows") is not None:
+        content += f"\nRows: {json.dumps(data['rows'], default=str)}"
+    return content
+
+
+def retry_messages(turn, bot_message, feedback):
+    """
+    The stored turn replayed for re-synthesis: the question, its tool calls with
+    their outputs (and Cypher/rows), then the feedback on the previous answer.
+    """
+    messages = [SystemMessage(content=retry_system_instruction), HumanMessage(content=turn["question"])]
+    calls = turn["tool_calls"]
+    if calls:
+        messages.append(AIMessage(content="", tool_calls=[
+            {"id": c["id"], "name": c["name"], "args": c["args"], "type": "tool_call"} for c in calls
+        ]))
+        messages += [ToolMessage(content=_tool_result_content(c), tool_call_id=c["id"], name=c["name"])
+                     for c in calls]
+    messages.append(HumanMessage(content=(
+        f"Your previous answer was:\n{bot_message or turn['answer']}\n\n"
+        f"The user rated it: {feedback}.\n\n"
+        "Produce an improved, concise and actionable answer from the tool results above."
+    )))
+    return messages
+
+
+def feedback_turn(feedback):
+    """What the thread records for a /feedback retry: the user's rating, not the re-synthesis prompt."""
+    return [HumanMessage(content=f"Feedback on your previous answer: {feedback}. Please try again.")]
+
+
+def extract_answer(result):
+    """Text of the last AI message in an agent result."""
+    if "messages" in result and result["messages"]:
+        # find the last AI message
+        ai_messages = [m for m in result["messages"] if isinstance(m, AIMessage)]
+        if ai_messages:
+            return ai_messages[-1].content
+        last = result["messages"][-1]
+        return getattr(last, "content", str(last))
+    # fallback
+    return result.get("output", "(no output)")
+
+
+def map_metacritic_input(data):
+    """Maps the API's field names onto the training dataset's column names."""
+    return {
+        "year": data.get("year"),
+        "imdb user rating": data.get("imdb_rating"),
+        "number of imdb user votes": data.get("imdb_votes"),
+        "budget": data.get("budget"),
+        "opening weekend": data.get("opening_weekend"),
+        "text": data.get("text", ""),
+    }
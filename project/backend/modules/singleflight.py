@@ -0,0 +1,337 @@
+# modules/singleflight.py
+"""
+Coalesces identical requests that are in flight at the same time. The first
+request for a key (the leader) does the work; duplicates that arrive before it
+finishes (followers) wait for its result instead of calling Groq/Neo4j again.
+
+- SingleFlight / AsyncSingleFlight share one result (the /chat answer).
+- StreamFlight / AsyncStreamFlight share one token stream (/rag): a follower
+  first replays the chunks already produced, then follows the live stream. The
+  source runs on its own and is stopped once every subscriber has gone.
+
+Keys are normalized questions, one flight per endpoint. A follower that waits
+longer than SINGLEFLIGHT_WAIT_TIMEOUT seconds gives up and does the work itself.
+"""
+import os
+import asyncio
+import threading
+import contextvars
+from typing import Callable, Optional
+
+from modules.cypher_cache import normalize_question
+from modules import metrics
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_WAIT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_WAIT_TIMEOUT", "120"))
+
+_flights = []
+
+
+def _count(endpoint: str, role: str):
+    metrics.singleflight_requests_total.inc(endpoint=endpoint, role=role)
+
+
+class _Flight:
+    def __init__(self, endpoint: str, enabled: bool = SINGLEFLIGHT_ENABLED,
+                 wait_timeout: float = SINGLEFLIGHT_WAIT_TIMEOUT):
+        self.endpoint = endpoint
+        self.enabled = enabled
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        _flights.append(self)
+
+    @staticmethod
+    def key(question: str) -> str:
+        return normalize_question(question)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def _forget(self, key: str, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+
+# --- one shared result -----------------------------------------------------------
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight(_Flight):
+    def do(self, question: str, fn: Callable):
+        """(fn's result, shared) where shared is True when another request produced it."""
+        if not self.enabled:
+            return fn(), False
+        key = self.key(question)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            _count(self.endpoint, "leader")
+            try:
+                call.result = fn()
+                return call.result, False
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                self._forget(key, call)
+                call.done.set()
+
+        if not call.done.wait(self.wait_timeout):
+            _count(self.endpoint, "fallback")
+            return fn(), False
+        _count(self.endpoint, "follower")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+
+class AsyncSingleFlight(_Flight):
+    """
+    The leader's work runs as its own task, so a leader whose client disconnects
+    does not cancel the result its followers are waiting for.
+    """
+
+    async def do(self, question: str, coro_fn: Callable):
+        if not self.enabled:
+            return await coro_fn(), False
+        key = self.key(question)
+        task = self._calls.get(key)
+        if task is None:
+            _count(self.endpoint, "leader")
+            task = self._calls[key] = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda t: self._forget(key, t))
+            return await asyncio.shield(task), False
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            _count(self.endpoint, "fallback")
+            return await coro_fn(), False
+        _count(self.endpoint, "follower")
+        return result, True
+
+
+# --- one shared stream -----------------------------------------------------------
+
+class SharedStream:
+    """Chunks of one source generator, buffered for every subscriber. `context` is shared state (e.g. timings)."""
+
+    def __init__(self, flight: "StreamFlight", key: str, source_factory: Callable, context=None):
+        self.flight = flight
+        self.key = key
+        self.context = context
+        self.chunks = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cancel_event = threading.Event()
+        self._cond = threading.Condition()
+        self._source_factory = source_factory
+
+    def start(self):
+        # Run in a copy of the leader's context so stage timings land in its trace.
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(self._pump,), daemon=True,
+                         name=f"singleflight-{self.flight.endpoint}").start()
+
+    def _pump(self):
+        source = self._source_factory(self.cancel_event)
+        try:
+            for chunk in source:
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+                if self.cancel_event.is_set():
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            source.close()
+            self.flight._forget(self.key, self)
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
+
+    def _follow(self):
+        """Every chunk so far, then the live ones."""
+        sent = 0
+        while True:
+            with self._cond:
+                while sent >= len(self.chunks) and not self.finished:
+                    self._cond.wait()
+                pending = self.chunks[sent:]
+                finished = self.finished
+            for chunk in pending:
+                sent += 1
+                yield chunk
+            if finished:
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class Subscription:
+    """
+    One opener's interest in a SharedStream, counted from open() until close().
+    close() is idempotent: it runs when the body finishes and again from the
+    response's close callback, which also covers a body that never started.
+    """
+
+    def __init__(self, stream: SharedStream):
+        self.stream = stream
+        self.context = stream.context
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Every chunk so far, then the live ones. Closing it leaves the stream."""
+        try:
+            yield from self.stream._follow()
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.stream.flight._leave(self.stream)
+
+
+class StreamFlight(_Flight):
+    def open(self, question: str, source_factory: Callable, context=None):
+        """
+        (subscription, shared). source_factory(cancel_event) returns the
+        generator to share; it is only called for the leader. Iterate
+        subscription.subscribe(), and make sure subscription.close() runs even
+        if that never happens (e.g. Response.call_on_close).
+        """
+        key = self.key(question)
+        with self._lock:
+            # A stream stays registered only while it has subscribers and is still running.
+            stream = self._calls.get(key) if self.enabled else None
+            shared = stream is not None
+            if not shared:
+                stream = SharedStream(self, key, source_factory, context)
+                if self.enabled:
+                    self._calls[key] = stream
+            # Counted now: a follower that comes and goes before this body starts must not stop the stream.
+            stream.subscribers += 1
+        _count(self.endpoint, "follower" if shared else "leader")
+        if not shared:
+            stream.start()
+        return Subscription(stream), shared
+
+    def _leave(self, stream: SharedStream):
+        with self._lock:
+            stream.subscribers -= 1
+            if stream.subscribers <= 0:
+                # Nobody is listening any more: stop pulling from Groq.
+                stream.cancel_event.set()
+                if self._calls.get(stream.key) is stream:
+                    del self._calls[stream.key]
+
+
+class AsyncSharedStream:
+    def __init__(self, flight: "AsyncStreamFlight", key: str, source_factory: Callable, context=None):
+        self.flight = flight
+        self.key = key
+        self.context = context
+        self.chunks = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._source_factory = source_factory
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._pump())
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self):
+        try:
+            async for chunk in self._source_factory():
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self.flight._forget(self.key, self)
+            self.finished = True
+            self._notify()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                if sent >= len(self.chunks) and not self.finished:
+                    await self._changed.wait()
+                    continue
+                pending = self.chunks[sent:]
+                finished = self.finished
+                for chunk in pending:
+                    sent += 1
+                    yield chunk
+                if finished and sent >= len(self.chunks):
+                    break
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.flight._leave(self)
+
+
+class AsyncStreamFlight(_Flight):
+    def open(self, question: str, source_factory: Callable, context=None):
+        """
+        Async twin of StreamFlight.open; source_factory() returns an async iterator.
+        A subscriber counts from the start of subscribe(), so open and subscribe
+        in the same body with no await in between (as async_app's /rag does).
+        """
+        key = self.key(question)
+        stream = self._calls.get(key) if self.enabled else None
+        shared = stream is not None
+        if not shared:
+            stream = AsyncSharedStream(self, key, source_factory, context)
+            if self.enabled:
+                self._calls[key] = stream
+        _count(self.endpoint, "follower" if shared else "leader")
+        if not shared:
+            stream.start()
+        return stream, shared
+
+    def _leave(self, stream: AsyncSharedStream):
+        stream.subscribers -= 1
+        if stream.subscribers <= 0:
+            self._forget(stream.key, stream)
+            if stream.task is not None and not stream.task.done():
+                stream.task.cancel()
+
+
+def _inflight_metrics():
+    totals = {}
+    for flight in _flights:
+        totals[flight.endpoint] = totals.get(flight.endpoint, 0) + flight.in_flight()
+    return [("cinegraph_singleflight_in_flight", "gauge", "Distinct coalesced requests in flight.",
+             [({"endpoint": endpoint}, n) for endpoint, n in sorted(totals.items())])]
+
+
+metrics.registry.add_collector(_inflight_metrics)
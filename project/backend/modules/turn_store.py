@@ -0,0 +1,130 @@
+# modules/turn_store.py
+"""
+What each /chat turn was built from: the question, the answer and every tool
+call with its output (plus the Cypher and rows behind Neo4j answers), under a
+turn id returned to the client. /feedback uses it to re-synthesize an answer
+from the same tool results instead of re-running the agent from scratch.
+
+Turns live for TURN_STORE_TTL seconds; at most TURN_STORE_MAX_TURNS are kept.
+"""
+import os
+import time
+import uuid
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from modules import metrics
+
+TURN_STORE_TTL = float(os.getenv("TURN_STORE_TTL", "1800"))
+TURN_STORE_MAX_TURNS = int(os.getenv("TURN_STORE_MAX_TURNS", "10000"))
+
+# Data tools note while a turn runs (e.g. the Neo4j tool's Cypher and rows). The
+# list is shared, so notes made in copied contexts (tool threads) land here too.
+_notes = contextvars.ContextVar("turn_tool_notes", default=None)
+
+
+@contextmanager
+def capture():
+    notes = []
+    token = _notes.set(notes)
+    try:
+        yield notes
+    finally:
+        _notes.reset(token)
+
+
+def note(tool: str, **data):
+    """Called by tools; a no-op outside capture()."""
+    notes = _notes.get()
+    if notes is not None:
+        notes.append({"tool": tool, **data})
+
+
+def tool_calls_from(messages, question: str, notes=None) -> List[dict]:
+    """
+    The tool calls made after the last `question` message, each as
+    {"id", "name", "args", "output"} plus "data" when a tool noted any.
+    """
+    start = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage) and messages[i].content == question:
+            start = i + 1
+            break
+    calls = OrderedDict()
+    for message in messages[start:]:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls or []:
+                calls[call["id"]] = {"id": call["id"], "name": call["name"], "args": call.get("args") or {},
+                                     "output": None}
+        elif isinstance(message, ToolMessage) and message.tool_call_id in calls:
+            calls[message.tool_call_id]["output"] = message.content
+
+    pending = list(notes or [])
+    out = []
+    for call in calls.values():
+        if call["output"] is None:
+            continue
+        arg = next(iter(call["args"].values()), None) if call["args"] else None
+        for i, entry in enumerate(pending):
+            if entry["tool"] == call["name"] and entry.get("question") in (arg, None):
+                call["data"] = {k: v for k, v in entry.items() if k not in ("tool", "question")}
+                del pending[i]
+                break
+        out.append(call)
+    return out
+
+
+def answered_call(name: str, question: str, output: str) -> dict:
+    """A tool call record for data fetched outside the agent (e.g. by the fast path)."""
+    return {"id": "call_" + uuid.uuid4().hex[:16], "name": name, "args": {"__arg1": question}, "output": output}
+
+
+class TurnStore:
+    def __init__(self, ttl: float = TURN_STORE_TTL, max_turns: int = TURN_STORE_MAX_TURNS):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._turns = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def put(self, turn_id: str, session_id: str, question: str, answer: str, tool_calls: List[dict]):
+        record = {"session_id": session_id, "question": question, "answer": answer,
+                  "tool_calls": tool_calls, "created": time.time()}
+        with self._lock:
+            self._turns[turn_id] = record
+            self._turns.move_to_end(turn_id)
+            while len(self._turns) > self.max_turns:
+                self._turns.popitem(last=False)
+
+    def get(self, turn_id: Optional[str], session_id: Optional[str] = None) -> Optional[dict]:
+        """The turn, if it exists, has not expired and (when given) belongs to session_id."""
+        if not turn_id:
+            return None
+        with self._lock:
+            record = self._turns.get(turn_id)
+            if record is not None and time.time() - record["created"] > self.ttl:
+                del self._turns[turn_id]
+                record = None
+        if record is not None and session_id is not None and record["session_id"] != session_id:
+            record = None
+        metrics.cache_requests_total.inc(cache="turn", result="miss" if record is None else "hit")
+        return record
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"turns": len(self._turns), "max_turns": self.max_turns, "ttl": self.ttl}
+
+
+turn_store = TurnStore()
+
+metrics.registry.add_collector(lambda: [
+    ("cinegraph_turn_store_entries", "gauge", "Stored /chat turns.", [({}, turn_store.stats()["turns"])]),
+])
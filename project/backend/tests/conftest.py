@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend's modules are imported as top-level packages (modules.*, utils.*).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+from modules.cypher_cache import CypherCache
+
+NOLAN = "MATCH (p:Person {name: 'Christopher Nolan'})-[:DIRECTED]->(m:Movie) RETURN m.title"
+
+
+def make_cache():
+    cache = CypherCache()
+    cache.set_schema("schema")
+    cache.store("Movies directed by Christopher Nolan?", NOLAN)
+    return cache
+
+
+def test_slot_fills_same_length_value():
+    cache = make_cache()
+    assert cache.lookup("Movies directed by Greta Gerwig") == NOLAN.replace("Christopher Nolan", "Greta Gerwig")
+
+
+def test_slot_does_not_swallow_trailing_words():
+    cache = make_cache()
+    assert cache.lookup("Movies directed by Christopher Nolan after 2010 with rating above 8") is None
+    assert cache.lookup("Movies directed by Christopher Nolan or Spielberg") is None
+
+
+def test_single_word_slot():
+    cache = CypherCache()
+    cache.set_schema("schema")
+    cache.store("Who acted in Heat?", "MATCH (p:Person)-[:ACTED_IN]->(:Movie {title: 'Heat'}) RETURN p.name")
+    assert cache.lookup("Who acted in Alien") is not None
+    assert cache.lookup("Who acted in Heat and also directed it") is None
+
+
+def test_drops_persisted_entries_with_old_slot_patterns(tmp_path):
+    path = tmp_path / "cache.json"
+    old = CypherCache(path=str(path))
+    old.set_schema("schema")
+    old.store("Movies directed by Christopher Nolan?", NOLAN)
+    old.store("How many movies are there", "MATCH (m:Movie) RETURN count(m)")
+    with old._lock:
+        for entry in old._entries.values():
+            entry.pop("slot_version", None)
+        old._save()
+
+    cache = CypherCache(path=str(path))
+    cache.set_schema("schema")
+    assert cache.lookup("Movies directed by Greta Gerwig") is None
+    assert cache.lookup("how many movies are there?") == "MATCH (m:Movie) RETURN count(m)"
+
+
+def rows_for(titles):
+    """A case-sensitive stand-in for graph.query: rows only for the exact titles given."""
+    def run(cypher):
+        return [{"title": t} for t in titles if f"'{t}'" in cypher]
+    return run
+
+
+def test_resolve_falls_through_when_slot_casing_finds_nothing():
+    cache = CypherCache()
+    cache.set_schema("schema")
+    cache.store("Who directed Inception?", "MATCH (m:Movie {title: 'Inception'})<-[:DIRECTED]-(p) RETURN p.name")
+    run = rows_for(["Inception", "Heat"])
+
+    assert cache.lookup("who directed inception") == \
+        "MATCH (m:Movie {title: 'inception'})<-[:DIRECTED]-(p) RETURN p.name"
+    assert cache.resolve("who directed inception", run) is None
+    assert cache.resolve("WHO DIRECTED HEAT", run) is None
+    cypher, rows = cache.resolve("Who directed Heat", run)
+    assert "'Heat'" in cypher and rows == [{"title": "Heat"}]
+    assert cache.stats()["empty"] == 2
+
+
+def test_resolve_skips_rejected_queries():
+    cache = make_cache()
+    assert cache.resolve("Movies directed by Greta Gerwig", lambda cypher: None) is None
@@ -1,10 +1,83 @@
+import re
+
+import numpy as np
 from langchain_experimental.text_splitter import SemanticChunker
-from langchain_huggingface import HuggingFaceEmbeddings
+from modules.embeddings import get_embeddings
 # from langchain_openai.embeddings import OpenAIEmbeddings
 
+# SemanticChunker's defaults; the helpers below reproduce its chunking so that
+# batch pipelines (utils/embed_pipeline.py) can embed many files in one call.
+SENTENCE_SPLIT_REGEX = r"(?<=[.?!])\s+"
+BREAKPOINT_DEFAULTS = {"percentile": 95, "standard_deviation": 3, "interquartile": 1.5, "gradient": 95}
+
+
+def split_sentences(text):
+    return re.split(SENTENCE_SPLIT_REGEX, text)
+
+
+def combine_sentences(sentences, buffer_size=1):
+    """Each sentence with its neighbours, the text SemanticChunker embeds."""
+    return [" ".join(sentences[max(0, i - buffer_size):i + 1 + buffer_size]) for i in range(len(sentences))]
+
+
+def breakpoints_from_embeddings(embeddings, threshold_type="percentile", amount=None):
+    """
+    Indices of the sentences after which a chunk ends, given the embeddings of
+    the combined sentences. Same rule as SemanticChunker.split_text.
+    """
+    n = len(embeddings)
+    if n < 2:
+        return []
+    if threshold_type == "gradient" and n == 2:
+        return [0]
+    amount = BREAKPOINT_DEFAULTS[threshold_type] if amount is None else amount
+
+    vectors = np.asarray(embeddings, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    distances = 1 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+
+    if threshold_type == "percentile":
+        threshold, values = np.percentile(distances, amount), distances
+    elif threshold_type == "standard_deviation":
+        threshold, values = np.mean(distances) + amount * np.std(distances), distances
+    elif threshold_type == "interquartile":
+        q1, q3 = np.percentile(distances, [25, 75])
+        threshold, values = np.mean(distances) + amount * (q3 - q1), distances
+    elif threshold_type == "gradient":
+        values = np.gradient(distances, range(0, len(distances)))
+        threshold = np.percentile(values, amount)
+    else:
+        raise ValueError(f"Invalid breakpoint_threshold_type '{threshold_type}'")
+    return [int(i) for i in np.flatnonzero(values > threshold)]
+
+
+def chunk_spans(n_sentences, breakpoints):
+    """(start, end) sentence ranges, end exclusive, for the given breakpoints."""
+    spans, start = [], 0
+    for index in breakpoints:
+        spans.append((start, index + 1))
+        start = index + 1
+    if start < n_sentences:
+        spans.append((start, n_sentences))
+    return spans
+
+
+def pool_chunk_vectors(vectors, spans):
+    """
+    One vector per chunk: the mean of its sentence-window embeddings, renormalized.
+    Saves embedding every chunk a second time, at a small cost in fidelity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    pooled = np.stack([vectors[start:end].mean(axis=0) for start, end in spans]) if spans else \
+        np.zeros((0, vectors.shape[1] if vectors.ndim == 2 else 0), dtype=np.float32)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return pooled / np.where(norms == 0, 1, norms)
+
+
 class SemanticSplitter:
     def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", threshold_type="percentile"):
-        self.embedding_model = HuggingFaceEmbeddings(model_name=model_name)
+        self.embedding_model = get_embeddings(model_name)
 
         valid_threshold_types = ["percentile", "standard_deviation", "interquartile", "gradient"]
         if threshold_type not in valid_threshold_types:
@@ -13,6 +86,33 @@ class SemanticSplitter:
         self.threshold_type = threshold_type
         self.splitter = SemanticChunker(self.embedding_model, breakpoint_threshold_type=self.threshold_type) # SemanticChunker(OpenAIEmbeddings())
 
+    @staticmethod
+    def settings_for(model_name="sentence-transformers/all-MiniLM-L6-v2", threshold_type="percentile",
+                     chunk_vectors="embed"):
+        """Settings that change the produced chunks or vectors; used to key persisted indexes."""
+        settings = {"splitter": "SemanticChunker", "model_name": model_name, "threshold_type": threshold_type}
+        if chunk_vectors != "embed":  # keeps keys of existing "embed" indexes unchanged
+            settings["chunk_vectors"] = chunk_vectors
+        return settings
+
+    def settings(self):
+        return self.settings_for(self.embedding_model.model_name, self.threshold_type)
+
+    def split_with_embeddings(self, transcript):
+        """
+        Splits like split_transcript, but also returns what was computed on the way:
+        (chunks, spans, window_vectors), where spans are the (start, end) sentence
+        ranges of each chunk and window_vectors the embeddings used for breakpoints.
+        Pass them to pool_chunk_vectors to get chunk vectors without another model call.
+        """
+        sentences = split_sentences(transcript)
+        windows = combine_sentences(sentences)
+        vectors = np.asarray(self.embedding_model.embed_documents(windows), dtype=np.float32)
+        breakpoints = breakpoints_from_embeddings(vectors, self.threshold_type)
+        spans = chunk_spans(len(sentences), breakpoints)
+        chunks = [" ".join(sentences[start:end]) for start, end in spans]
+        return chunks, spans, vectors
+
     def split_transcript(self, transcript):
         docs=self.splitter.create_documents([transcript])
         print(len(docs))
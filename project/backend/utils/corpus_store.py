@@ -0,0 +1,409 @@
+# utils/corpus_store.py
+"""
+Columnar, memory-mapped store of the character dialogue corpus.
+
+    python -m utils.corpus_store build path/to/movie_character_texts corpus_store/
+    python -m utils.corpus_store info corpus_store/
+    python -m utils.corpus_store show corpus_store/ --movie tt0468569 --character JOKER
+
+The corpus is <movie>_<imdb_id>/<character>_text.txt files of lines like
+"12)3) dialog: Why so serious?" (segment 12, scene 3, label dialog). A line
+without that prefix continues the previous one. build streams the files once,
+line by line, into one row per line:
+
+    imdb_id, character, label   dictionary codes (uint32 / uint32 / uint8)
+    segment, scene              int32
+    text                        UTF-8 bytes in text.bin, row i at text_offsets[i]:text_offsets[i + 1]
+
+Every column is a raw little-endian file described by meta.json and opened
+with np.memmap, so nothing is read until it is used. Rows are written movie by
+movie and file by file. A movie, or one character file, is therefore one
+contiguous row range, and filtering by either returns views into the mapped
+columns instead of copies. Each file's range is kept with its folder and file
+name (groups.bin and meta.json), so two folders with the same imdb id (or none,
+"unknown") and the same character stay separate documents. The store is built
+in <out>.tmp and moved into place when complete.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 2
+LINE_RE = re.compile(r"^\s*(\d+)\)\s*(\d+)\)\s*([A-Za-z_ ]+?)\s*:\s?(.*)$")
+TEXT_SUFFIX = "_text"
+WRITE_BATCH = 65536
+
+COLUMNS = {
+    "imdb_id": "<u4",
+    "character": "<u4",
+    "segment": "<i4",
+    "scene": "<i4",
+    "label": "u1",
+    "text_offsets": "<i8",
+}
+
+
+def corpus_files(parent_path: str) -> List[Tuple[str, str, str, str]]:
+    """
+    (path, folder, imdb_id, character) for every character file, movie by
+    movie: folders that share an imdb id are listed next to each other.
+    """
+    out = []
+    for folder in sorted(os.listdir(parent_path)):
+        movie_dir = os.path.join(parent_path, folder)
+        if not os.path.isdir(movie_dir):
+            continue
+        imdb_id = folder.rsplit("_", 1)[1] if "_" in folder else "unknown"
+        for name in sorted(os.listdir(movie_dir)):
+            if not name.endswith(".txt"):
+                continue
+            character = os.path.splitext(name)[0]
+            if character.endswith(TEXT_SUFFIX):
+                character = character[:-len(TEXT_SUFFIX)]
+            out.append((os.path.join(movie_dir, name), folder, imdb_id, character))
+    out.sort(key=lambda f: (f[2], f[1]))  # stable: files keep their name order within a folder
+    return out
+
+
+def parse_lines(lines) -> Iterator[Tuple[int, int, str, str]]:
+    """
+    Yields (segment, scene, label, text) per entry. Lines before the first
+    entry are skipped, and a line without the i)k) prefix is appended to the
+    entry before it.
+    """
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        m = LINE_RE.match(line)
+        if m:
+            if current is not None:
+                yield current
+            current = (int(m.group(1)), int(m.group(2)), m.group(3).strip().lower(), m.group(4))
+        elif current is not None and line.strip():
+            current = current[:3] + (current[3] + "\n" + line,)
+    if current is not None:
+        yield current
+
+
+def parse_file(path: str) -> Iterator[Tuple[int, int, str, str]]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        yield from parse_lines(f)
+
+
+class _Dictionary:
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CorpusWriter:
+    """Appends rows to the column files in batches; close() writes meta.json."""
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dictionaries = {name: _Dictionary() for name in ("imdb_id", "character", "label")}
+        self.folders = _Dictionary()
+        # One per character file: (folder code, imdb_id code, character code, start, end), and its file name
+        self.groups: List[Tuple[int, int, int, int, int]] = []
+        self.filenames: List[str] = []
+        self._movies_written = set()
+        self.rows = 0
+        self.text_bytes = 0
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "wb") for name in COLUMNS}
+        self._text = open(os.path.join(path, "text.bin"), "wb")
+        self._batch = {name: [] for name in COLUMNS}
+        self._files["text_offsets"].write(np.zeros(1, dtype=COLUMNS["text_offsets"]).tobytes())
+
+    def add_file(self, folder: str, imdb_id: str, character: str, entries, filename: Optional[str] = None) -> int:
+        """Adds one character file's entries; returns the rows added."""
+        movie = self.dictionaries["imdb_id"].code(imdb_id)
+        if movie in self._movies_written and self.groups[-1][1] != movie:
+            raise ValueError(f"Files of {imdb_id} are not added one after another; its rows would not be contiguous")
+        folder_code = self.folders.code(folder)
+        char = self.dictionaries["character"].code(character)
+        start = self.rows
+        batch = self._batch
+        try:
+            for segment, scene, label, text in entries:
+                data = text.encode("utf-8")
+                self._text.write(data)
+                self.text_bytes += len(data)
+                batch["imdb_id"].append(movie)
+                batch["character"].append(char)
+                batch["segment"].append(segment)
+                batch["scene"].append(scene)
+                batch["label"].append(self.dictionaries["label"].code(label))
+                batch["text_offsets"].append(self.text_bytes)
+                self.rows += 1
+                if len(batch["text_offsets"]) >= WRITE_BATCH:
+                    self._flush()
+        finally:
+            # Rows already written stay addressable even if the file failed part way.
+            if self.rows > start:
+                self.groups.append((folder_code, movie, char, start, self.rows))
+                self.filenames.append(filename or f"{character}{TEXT_SUFFIX}.txt")
+                self._movies_written.add(movie)
+        return self.rows - start
+
+    def _flush(self):
+        for name, values in self._batch.items():
+            if values:
+                self._files[name].write(np.asarray(values, dtype=COLUMNS[name]).tobytes())
+                values.clear()
+
+    def close(self, source: Optional[str] = None, files: int = 0):
+        self._flush()
+        for f in list(self._files.values()) + [self._text]:
+            f.close()
+        if len(self.dictionaries["label"].values) > 256:
+            raise ValueError("More than 256 distinct labels; the label column is uint8")
+        np.asarray(self.groups, dtype="<i8").reshape(-1, 5).tofile(os.path.join(self.path, "groups.bin"))
+        meta = {
+            "format": FORMAT_VERSION,
+            "rows": self.rows,
+            "text_bytes": self.text_bytes,
+            "groups": len(self.groups),
+            "columns": COLUMNS,
+            "dictionaries": {name: d.values for name, d in self.dictionaries.items()},
+            "folders": self.folders.values,
+            "filenames": self.filenames,
+            "source": source,
+            "files": files,
+            "built_at": time.time(),
+        }
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+
+def build(parent_path: str, out_path: str, limit: Optional[int] = None, report_every: float = 10.0) -> dict:
+    """Parses the corpus tree into a new store at out_path (replacing any existing one); returns its meta."""
+    files = corpus_files(parent_path)
+    if limit:
+        files = files[:limit]
+    print(f"[CORPUS] Found {len(files)} character files.")
+    tmp_path = out_path.rstrip("/\\") + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    writer = CorpusWriter(tmp_path)
+    started = last_report = time.monotonic()
+    failed = 0
+    try:
+        for i, (path, folder, imdb_id, character) in enumerate(files, 1):
+            try:
+                writer.add_file(folder, imdb_id, character, parse_file(path), os.path.basename(path))
+            except OSError as e:
+                failed += 1
+                print(f"[CORPUS] Could not read {path}: {e}")
+            if time.monotonic() - last_report >= report_every:
+                print(f"[CORPUS] {i}/{len(files)} files, {writer.rows:,} rows")
+                last_report = time.monotonic()
+        writer.close(source=os.path.abspath(parent_path), files=len(files) - failed)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    shutil.rmtree(out_path, ignore_errors=True)
+    os.replace(tmp_path, out_path)
+    print(f"[CORPUS] Done: {writer.rows:,} rows from {len(files) - failed} files "
+          f"({writer.text_bytes / 1e6:,.1f} MB text, failed {failed}) in {time.monotonic() - started:.1f}s")
+    return CorpusStore(out_path).meta
+
+
+def _map(path: str, dtype: str, count: int) -> np.ndarray:
+    if count == 0:
+        return np.empty(0, dtype=dtype)  # np.memmap cannot map an empty file
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+class CorpusSlice:
+    """Rows start:end of a store. Column properties are views into the mapped files, not copies."""
+
+    def __init__(self, store: "CorpusStore", start: int, end: int):
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def column(self, name: str) -> np.ndarray:
+        return self.store.columns[name][self.start:self.end]
+
+    @property
+    def segment(self) -> np.ndarray:
+        return self.column("segment")
+
+    @property
+    def scene(self) -> np.ndarray:
+        return self.column("scene")
+
+    def text_bytes(self, i: int) -> memoryview:
+        """Row i (relative to the slice) as a view of its UTF-8 bytes."""
+        offsets = self.store.columns["text_offsets"]
+        return memoryview(self.store.text)[offsets[self.start + i]:offsets[self.start + i + 1]]
+
+    def text(self, i: int) -> str:
+        return bytes(self.text_bytes(i)).decode("utf-8")
+
+    def texts(self, label: Optional[str] = None) -> List[str]:
+        return [self.text(i) for i in self.indices(label)]
+
+    def indices(self, label: Optional[str] = None) -> np.ndarray:
+        if label is None:
+            return np.arange(len(self))
+        code = self.store.code("label", label)
+        return np.flatnonzero(self.column("label") == code) if code is not None else np.empty(0, dtype=np.int64)
+
+    def rows(self) -> Iterator[dict]:
+        decode, cols = self.store.decode, self.store.columns
+        for i in range(len(self)):
+            row = self.start + i
+            yield {"imdb_id": decode("imdb_id", cols["imdb_id"][row]),
+                   "character": decode("character", cols["character"][row]),
+                   "segment": int(cols["segment"][row]), "scene": int(cols["scene"][row]),
+                   "label": decode("label", cols["label"][row]), "text": self.text(i)}
+
+    def to_frame(self):
+        import pandas as pd
+
+        cols = {name: self.column(name) for name in ("imdb_id", "character", "label")}
+        return pd.DataFrame({
+            "imdb_id": pd.Categorical.from_codes(cols["imdb_id"], self.store.dictionaries["imdb_id"]),
+            "character": pd.Categorical.from_codes(cols["character"], self.store.dictionaries["character"]),
+            "segment": self.segment,
+            "scene": self.scene,
+            "label": pd.Categorical.from_codes(cols["label"], self.store.dictionaries["label"]),
+            "text": [self.text(i) for i in range(len(self))],
+        })
+
+
+class CorpusStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus store format {self.meta.get('format')} in {path}")
+        rows = self.meta["rows"]
+        self.columns = {name: _map(os.path.join(path, f"{name}.bin"), dtype, rows + (name == "text_offsets"))
+                        for name, dtype in self.meta["columns"].items()}
+        self.text = _map(os.path.join(path, "text.bin"), "u1", self.meta["text_bytes"])
+        self.dictionaries: Dict[str, List[str]] = self.meta["dictionaries"]
+        self._codes = {name: {v: i for i, v in enumerate(values)} for name, values in self.dictionaries.items()}
+        groups = _map(os.path.join(path, "groups.bin"), "<i8", self.meta["groups"] * 5).reshape(-1, 5)
+        # One entry per character file, in build order: (folder code, imdb_id code, character code, start, end)
+        self._groups: List[Tuple[int, int, int, int, int]] = [tuple(g) for g in groups.tolist()]
+        self._movie_ranges: Dict[int, Tuple[int, int]] = {}
+        for _, movie, _, start, end in self._groups:
+            first, _ = self._movie_ranges.get(movie, (start, end))
+            self._movie_ranges[movie] = (first, end)  # the writer keeps a movie's files together
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def code(self, column: str, value: str) -> Optional[int]:
+        return self._codes[column].get(value)
+
+    def decode(self, column: str, code) -> str:
+        return self.dictionaries[column][int(code)]
+
+    def all(self) -> CorpusSlice:
+        return CorpusSlice(self, 0, len(self))
+
+    def movie(self, imdb_id: str) -> Optional[CorpusSlice]:
+        code = self.code("imdb_id", imdb_id)
+        if code is None or code not in self._movie_ranges:
+            return None
+        return CorpusSlice(self, *self._movie_ranges[code])
+
+    def character(self, character: str, imdb_id: Optional[str] = None) -> List[CorpusSlice]:
+        """One slice per movie the character speaks in (or just imdb_id's)."""
+        char = self.code("character", character)
+        if char is None:
+            return []
+        movie = self.code("imdb_id", imdb_id) if imdb_id is not None else None
+        if imdb_id is not None and movie is None:
+            return []
+        return [CorpusSlice(self, start, end) for _, m, c, start, end in self._groups
+                if c == char and (movie is None or m == movie)]
+
+    def characters(self, imdb_id: str) -> List[str]:
+        movie = self.code("imdb_id", imdb_id)
+        return list(dict.fromkeys(self.decode("character", c) for _, m, c, _, _ in self._groups if m == movie))
+
+    def documents(self) -> Iterator[Tuple[dict, CorpusSlice]]:
+        """
+        (metadata, rows) per character file, in build order. metadata["key"] is
+        the file's path relative to the corpus root, as embed_pipeline keys it.
+        """
+        for (folder_code, movie, char, start, end), filename in zip(self._groups, self.meta["filenames"]):
+            imdb_id = self.decode("imdb_id", movie)
+            folder = self.meta["folders"][folder_code]
+            name = folder.rsplit("_", 1)[0] if "_" in folder else folder
+            character = self.decode("character", char)
+            yield ({"folder": folder, "imdb_id": imdb_id, "movie": name, "character": character,
+                    "filename": filename, "key": f"{folder}/{filename}"}, CorpusSlice(self, start, end))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar, memory-mapped character dialogue store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Parse movie_character_texts into a store.")
+    b.add_argument("parent", help="Directory of <movie>_<imdb_id>/<character>_text.txt files")
+    b.add_argument("out", help="Store directory (replaced when the build completes)")
+    b.add_argument("--limit", type=int, help="Only parse the first N files.")
+    info = sub.add_parser("info", help="Row, movie and character counts.")
+    info.add_argument("store")
+    show = sub.add_parser("show", help="Print the rows of a movie and/or character.")
+    show.add_argument("store")
+    show.add_argument("--movie", help="imdb id, e.g. tt0468569")
+    show.add_argument("--character")
+    show.add_argument("--label", help="dialog or text")
+    show.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build(args.parent, args.out, limit=args.limit)
+        return 0
+
+    store = CorpusStore(args.store)
+    if args.command == "info":
+        meta = store.meta
+        print(f"[CORPUS] {meta['rows']:,} rows, {len(store.dictionaries['imdb_id'])} movies, "
+              f"{meta['groups']} character files, {len(store.dictionaries['character'])} distinct characters, "
+              f"labels {store.dictionaries['label']}, {meta['text_bytes'] / 1e6:,.1f} MB text, "
+              f"source {meta['source']}")
+        return 0
+
+    if args.character:
+        slices = store.character(args.character, args.movie)
+    else:
+        found = store.movie(args.movie) if args.movie else store.all()
+        slices = [found] if found is not None else []
+    shown = 0
+    for part in slices:
+        for row in part.rows():
+            if args.label and row["label"] != args.label:
+                continue
+            print(f"{row['imdb_id']} {row['character']} "
+                  f"{row['segment']}){row['scene']}) {row['label']}: {row['text']}")
+            shown += 1
+            if shown >= args.limit:
+                return 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
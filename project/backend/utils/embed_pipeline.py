@@ -0,0 +1,504 @@
+# utils/embed_pipeline.py
+"""
+Embeds the per-character dialogue files into Chroma (replaces process_all in Embed.ipynb).
+
+    python -m utils.embed_pipeline path/to/movie_character_texts
+    python -m utils.embed_pipeline --corpus-store corpus_store/
+
+Expects <parent>/<movie>_<imdb_id>/<character>.txt, or a store built by
+utils.corpus_store. From the store, a file's document is its text column (the
+"i)k) label:" prefixes are dropped), and files are compared by content hash
+alone. The work runs in three stages:
+
+1. Worker processes read files and split them into sentences and sentence windows.
+2. The main process embeds the windows of many files in one model call and
+   finds chunk breakpoints the way SemanticChunker does. It then embeds the
+   resulting chunks, again across files. With --chunk-vectors pool, chunk
+   vectors are pooled from the window embeddings instead, so no second pass runs.
+3. A writer thread upserts chunks into Chroma. It is fed through a bounded
+   queue, so embedding pauses when Chroma falls behind.
+
+Runs are incremental. A SQLite manifest records, per source file, its content
+hash, its chunk ids and the model/splitter version used. A re-run only embeds
+new or changed files and deletes the chunks of files that are gone. A file is
+recorded right after its chunks are written, so an interrupted run resumes
+where it stopped. Pass --rebuild to re-embed everything.
+"""
+import os
+import re
+import glob
+import json
+import time
+import queue
+import sqlite3
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.SemanticSplitter import (
+    SemanticSplitter, split_sentences, combine_sentences, breakpoints_from_embeddings, chunk_spans,
+    pool_chunk_vectors,
+)
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./embedded")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "movies")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBED_MANIFEST_PATH = os.getenv("EMBED_MANIFEST_PATH", "embed_manifest.sqlite")
+
+
+def sanitize_tag(s):
+    return re.sub(r"[^0-9A-Za-z_-]", "_", s)
+
+
+def list_files(parent_path):
+    return sorted(glob.glob(os.path.join(parent_path, "*", "*.txt")))
+
+
+def file_metadata(file_path):
+    folder_name = os.path.basename(os.path.dirname(file_path))
+    if "_" in folder_name:
+        movie_name, imdb_id = folder_name.rsplit("_", 1)
+    else:
+        movie_name, imdb_id = folder_name, "unknown"
+    return {
+        "folder": folder_name,
+        "imdb_id": imdb_id,
+        "movie": movie_name,
+        "character": os.path.splitext(os.path.basename(file_path))[0],
+        "filename": os.path.basename(file_path),
+    }
+
+
+def chunk_id(meta, index):
+    return f"{sanitize_tag(meta['folder'])}__{sanitize_tag(meta['character'])}__{index}"
+
+
+def file_key(parent_path, file_path):
+    return os.path.relpath(file_path, parent_path).replace(os.sep, "/")
+
+
+def read_file(file_path):
+    """Stage 1, in a worker process: one file's hash, sentences and sentence windows."""
+    st = os.stat(file_path)
+    with open(file_path, "rb") as f:
+        data = f.read()
+    text = data.decode("utf-8")
+    sentences = split_sentences(text) if text.strip() else []
+    return {
+        "path": file_path,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sentences": sentences,
+        "windows": combine_sentences(sentences),
+    }
+
+
+def read_text(path, text):
+    """Stage 1 for a corpus-store document: read_file, with the text already in hand."""
+    data = text.encode("utf-8")
+    sentences = split_sentences(text) if text.strip() else []
+    return {
+        "path": path,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "mtime_ns": 0,
+        "sentences": sentences,
+        "windows": combine_sentences(sentences),
+    }
+
+
+def read_files(files, workers, max_in_flight, text_of=None):
+    """
+    Yields read_file results in order, with at most max_in_flight files read
+    ahead. With text_of(path), documents come from it instead of the disk.
+    """
+    # spawn: never fork a parent that may already hold torch threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        def submit(path):
+            return pool.submit(read_file, path) if text_of is None else pool.submit(read_text, path, text_of(path))
+
+        remaining = iter(files)
+        pending = deque()
+        for path in remaining:
+            pending.append((path, submit(path)))
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            path, future = pending.popleft()
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"[EMBED] Could not read {path}: {type(e).__name__}: {e}")
+                yield {"path": path, "sentences": [], "windows": [], "error": True}
+            path = next(remaining, None)
+            if path is not None:
+                pending.append((path, submit(path)))
+
+
+class Manifest:
+    """
+    What the collection holds, per source file: content hash, size and mtime,
+    chunk ids, and the model/splitter version it was embedded with. Rows are
+    cached in memory. The writer thread records files, so access is locked.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, mtime_ns INTEGER,
+                chunk_ids TEXT, version TEXT, updated_at REAL)""")
+            rows = self.conn.execute("SELECT path, sha256, size, mtime_ns, chunk_ids, version FROM files").fetchall()
+        self._rows = {
+            row[0]: {"sha256": row[1], "size": row[2], "mtime_ns": row[3],
+                     "chunk_ids": json.loads(row[4]), "version": row[5]}
+            for row in rows
+        }
+
+    def get(self, key):
+        with self.lock:
+            return self._rows.get(key)
+
+    def paths(self):
+        with self.lock:
+            return set(self._rows)
+
+    def unchanged(self, key, size, mtime_ns):
+        """Same size, mtime and version: skip without reading the file."""
+        row = self.get(key)
+        return (row is not None and row["version"] == self.version
+                and row["size"] == size and row["mtime_ns"] == mtime_ns)
+
+    def same_content(self, key, sha256):
+        row = self.get(key)
+        return row is not None and row["version"] == self.version and row["sha256"] == sha256
+
+    def touch(self, key, size, mtime_ns):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?", (size, mtime_ns, key))
+            self._rows[key].update(size=size, mtime_ns=mtime_ns)
+
+    def record(self, entries):
+        with self.lock, self.conn:
+            now = time.time()
+            for e in entries:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (e["key"], e["sha256"], e["size"], e["mtime_ns"], json.dumps(e["chunk_ids"]), self.version, now),
+                )
+                self._rows[e["key"]] = {"sha256": e["sha256"], "size": e["size"], "mtime_ns": e["mtime_ns"],
+                                        "chunk_ids": e["chunk_ids"], "version": self.version}
+
+    def remove(self, key):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (key,))
+            self._rows.pop(key, None)
+
+    def close(self):
+        self.conn.close()
+
+
+def manifest_version(model_name, threshold_type, chunk_vectors="embed"):
+    return json.dumps(SemanticSplitter.settings_for(model_name, threshold_type, chunk_vectors), sort_keys=True)
+
+
+class PipelineStats:
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.files = 0
+        self.failed = 0
+        self.skipped = 0
+        self.removed = 0
+        self.chunks = 0
+        self.written = 0
+        self.embed_seconds = 0.0
+        self.write_seconds = 0.0
+        self.stall_seconds = 0.0  # embedding stage blocked on a full write queue
+        self.started = time.monotonic()
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.files}/{self.total_files} files, {self.written} chunks written "
+                f"({self.rate():,.1f} chunks/sec), skipped {self.skipped}, removed {self.removed}, "
+                f"failed {self.failed}, "
+                f"embed {self.embed_seconds:.1f}s, write {self.write_seconds:.1f}s, "
+                f"backpressure {self.stall_seconds:.1f}s")
+
+
+def embed_group(service, group, threshold_type, chunk_vectors="embed"):
+    """
+    Stage 2: chunks and embeds a group of parsed files. One model call covers all
+    sentence windows. In "embed" mode a second call covers the chunks, skipping
+    any chunk whose text was already embedded as a window. In "pool" mode the
+    chunk vectors are pooled from the window vectors.
+    """
+    windows = [w for parsed in group for w in parsed["windows"]]
+    window_vectors = service.encode(windows)
+
+    ids, documents, metadatas, files, pooled = [], [], [], [], []
+    offset = 0
+    for parsed in group:
+        sentences = parsed["sentences"]
+        vectors = window_vectors[offset:offset + len(sentences)]
+        offset += len(sentences)
+
+        meta = file_metadata(parsed["path"])
+        spans = chunk_spans(len(sentences), breakpoints_from_embeddings(vectors, threshold_type))
+        if chunk_vectors == "pool" and spans:
+            pooled.append(pool_chunk_vectors(vectors, spans))
+        file_ids = [chunk_id(meta, i) for i in range(len(spans))]
+        files.append({"key": parsed["key"], "sha256": parsed["sha256"], "size": parsed["size"],
+                      "mtime_ns": parsed["mtime_ns"], "chunk_ids": file_ids})
+        for i, (start, end) in enumerate(spans):
+            ids.append(file_ids[i])
+            documents.append(" ".join(sentences[start:end]))
+            metadatas.append({
+                "imdb_id": meta["imdb_id"],
+                "movie": meta["movie"],
+                "character": meta["character"],
+                "filename": meta["filename"],
+                "chunk_index": i,
+            })
+
+    if chunk_vectors == "pool":
+        embeddings = np.concatenate(pooled) if pooled else np.zeros((0, window_vectors.shape[1]), dtype=np.float32)
+    else:
+        embeddings = _embed_chunks(service, documents, windows, window_vectors)
+    return {"ids": ids, "documents": documents, "embeddings": embeddings, "metadatas": metadatas, "files": files}
+
+
+def _embed_chunks(service, documents, windows, window_vectors):
+    # Single-sentence files (and short ones) yield chunks identical to a window.
+    known = {hashlib.sha1(w.encode("utf-8")).digest(): i for i, w in enumerate(windows)}
+    hits = [known.get(hashlib.sha1(doc.encode("utf-8")).digest()) for doc in documents]
+    missing = [i for i, hit in enumerate(hits) if hit is None]
+    embeddings = np.empty((len(documents), window_vectors.shape[1]), dtype=window_vectors.dtype)
+    if missing:
+        embeddings[missing] = service.encode([documents[i] for i in missing])
+    for i, hit in enumerate(hits):
+        if hit is not None:
+            embeddings[i] = window_vectors[hit]
+    return embeddings
+
+
+class ChromaWriter(threading.Thread):
+    """
+    Stage 3: upserts embedded groups into Chroma, drops chunk ids a changed file
+    no longer produces, then records the group's files in the manifest. put()
+    blocks while the queue is full, which holds back the embedding stage
+    instead of buffering vectors.
+    """
+
+    def __init__(self, collection, manifest, stats, queue_size=4, write_batch=1000):
+        super().__init__(name="chroma-writer", daemon=True)
+        self.collection = collection
+        self.manifest = manifest
+        self.stats = stats
+        self.write_batch = write_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+
+    def put(self, group):
+        if self.error is not None:
+            raise RuntimeError("Chroma writer failed") from self.error
+        started = time.monotonic()
+        self.queue.put(group)
+        self.stats.stall_seconds += time.monotonic() - started
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise RuntimeError("Chroma writer failed") from self.error
+
+    def run(self):
+        while True:
+            group = self.queue.get()
+            if group is None:
+                return
+            if self.error is not None:
+                continue  # keep draining so the producer never blocks forever
+            try:
+                self._write(group)
+            except Exception as e:
+                print(f"[EMBED] Chroma write failed: {type(e).__name__}: {e}")
+                self.error = e
+
+    def _write(self, group):
+        started = time.monotonic()
+        for i in range(0, len(group["ids"]), self.write_batch):
+            end = i + self.write_batch
+            self.collection.upsert(
+                ids=group["ids"][i:end],
+                documents=group["documents"][i:end],
+                embeddings=group["embeddings"][i:end].tolist(),
+                metadatas=group["metadatas"][i:end],
+            )
+        stale = []
+        for entry in group["files"]:
+            old = self.manifest.get(entry["key"])
+            if old is not None:
+                stale.extend(set(old["chunk_ids"]) - set(entry["chunk_ids"]))
+        if stale:
+            self.collection.delete(ids=stale)
+        self.manifest.record(group["files"])
+        self.stats.written += len(group["ids"])
+        self.stats.write_seconds += time.monotonic() - started
+
+
+def remove_deleted(collection, manifest, keys, write_batch=1000):
+    """Deletes the chunks of files that are in the manifest but no longer on disk."""
+    removed = 0
+    for key in sorted(manifest.paths() - set(keys)):
+        ids = manifest.get(key)["chunk_ids"]
+        for i in range(0, len(ids), write_batch):
+            collection.delete(ids=ids[i:i + write_batch])
+        manifest.remove(key)
+        removed += 1
+    return removed
+
+
+def run(parent_path, chroma_path=CHROMA_PATH, collection_name=CHROMA_COLLECTION, model_name=EMBEDDING_MODEL,
+        device=None, workers=None, embed_batch=4096, encode_batch_size=256, write_batch=1000, queue_size=4,
+        threshold_type="percentile", limit=None, report_every=10.0, manifest_path=EMBED_MANIFEST_PATH,
+        rebuild=False, chunk_vectors="embed", corpus_store=None):
+    import chromadb
+    from modules.embeddings import EmbeddingService
+
+    text_of = None
+    if corpus_store:
+        from utils.corpus_store import CorpusStore
+
+        documents = {meta["key"]: rows for meta, rows in CorpusStore(corpus_store).documents()}
+        files = sorted(documents)  # store keys stand in for paths; file_metadata reads the same names
+
+        def text_of(key):
+            return "\n".join(documents[key].texts())
+    else:
+        files = list_files(parent_path)
+    if limit:
+        files = files[:limit]
+    print(f"[EMBED] Found {len(files)} files to process.")
+    if not files:
+        return None
+
+    stats = PipelineStats(len(files))
+    manifest = Manifest(manifest_path, manifest_version(model_name, threshold_type, chunk_vectors))
+    collection = chromadb.PersistentClient(path=chroma_path).get_or_create_collection(collection_name)
+
+    keys = {path: path if text_of else file_key(parent_path, path) for path in files}
+    if not limit:  # a partial listing says nothing about which files were removed
+        stats.removed = remove_deleted(collection, manifest, keys.values(), write_batch)
+
+    todo = []
+    for path in files:
+        if rebuild:
+            unchanged = False
+        elif text_of is not None:
+            # Reading from the mapped store is cheap, so compare content directly.
+            unchanged = manifest.same_content(keys[path], hashlib.sha256(text_of(path).encode("utf-8")).hexdigest())
+        else:
+            st = os.stat(path)
+            unchanged = manifest.unchanged(keys[path], st.st_size, st.st_mtime_ns)
+        if unchanged:
+            stats.skipped += 1
+        else:
+            todo.append(path)
+    stats.files = stats.skipped
+    print(f"[EMBED] {len(todo)} new or modified files, {stats.skipped} unchanged, {stats.removed} removed.")
+    if not todo:
+        manifest.close()
+        return stats
+
+    workers = workers or max(1, min(32, (os.cpu_count() or 2) - 1))
+    service = EmbeddingService(model_name, device=device, batch_size=encode_batch_size)
+    writer = ChromaWriter(collection, manifest, stats, queue_size=queue_size, write_batch=write_batch)
+    writer.start()
+
+    def flush(group):
+        started = time.monotonic()
+        embedded = embed_group(service, group, threshold_type, chunk_vectors)
+        stats.embed_seconds += time.monotonic() - started
+        stats.chunks += len(embedded["ids"])
+        writer.put(embedded)
+
+    group, pending_windows = [], 0
+    last_report = time.monotonic()
+    try:
+        for parsed in read_files(todo, workers, max_in_flight=workers * 4, text_of=text_of):
+            stats.files += 1
+            key = parsed["key"] = keys[parsed["path"]]
+            if parsed.get("error"):
+                stats.failed += 1
+            elif not rebuild and manifest.same_content(key, parsed["sha256"]):
+                manifest.touch(key, parsed["size"], parsed["mtime_ns"])  # only the mtime moved
+                stats.skipped += 1
+            else:
+                # Empty files go through too, so their old chunks are dropped.
+                group.append(parsed)
+                pending_windows += len(parsed["windows"])
+            if pending_windows >= embed_batch:
+                flush(group)
+                group, pending_windows = [], 0
+            if time.monotonic() - last_report >= report_every:
+                print(f"[EMBED] {stats.summary()}, queue {writer.queue.qsize()}/{queue_size}")
+                last_report = time.monotonic()
+        if group:
+            flush(group)
+    finally:
+        writer.close()
+        manifest.close()
+
+    print(f"[EMBED] Done: {stats.summary()}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chunk and embed character dialogue files into Chroma.")
+    parser.add_argument("parent", nargs="?", help="Directory of <movie>_<imdb_id>/<character>.txt files")
+    parser.add_argument("--corpus-store", help="Read the documents from a utils.corpus_store store instead.")
+    parser.add_argument("--chroma-path", default=CHROMA_PATH)
+    parser.add_argument("--collection", default=CHROMA_COLLECTION)
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--device", default=os.getenv("EMBED_DEVICE") or None, help="e.g. cuda or cpu")
+    parser.add_argument("--workers", type=int, help="Reader processes (default: cores - 1, max 32).")
+    parser.add_argument("--embed-batch", type=int, default=4096,
+                        help="Sentence windows gathered across files per embedding step.")
+    parser.add_argument("--encode-batch-size", type=int, default=256, help="Model batch size.")
+    parser.add_argument("--write-batch", type=int, default=1000, help="Chunks per Chroma upsert.")
+    parser.add_argument("--queue-size", type=int, default=4, help="Embedded groups waiting for the writer.")
+    parser.add_argument("--threshold-type", default="percentile",
+                        choices=["percentile", "standard_deviation", "interquartile", "gradient"])
+    parser.add_argument("--chunk-vectors", choices=["embed", "pool"], default="embed",
+                        help="Embed each chunk, or pool its sentence-window embeddings (no second pass).")
+    parser.add_argument("--limit", type=int, help="Only process the first N files.")
+    parser.add_argument("--manifest", default=EMBED_MANIFEST_PATH, help="SQLite manifest for incremental runs.")
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed every file, ignoring the manifest.")
+    args = parser.parse_args(argv)
+    if not args.parent and not args.corpus_store:
+        parser.error("give the corpus directory or --corpus-store")
+
+    run(args.parent, chroma_path=args.chroma_path, collection_name=args.collection, model_name=args.model,
+        device=args.device, workers=args.workers, embed_batch=args.embed_batch,
+        encode_batch_size=args.encode_batch_size, write_batch=args.write_batch, queue_size=args.queue_size,
+        threshold_type=args.threshold_type, limit=args.limit, manifest_path=args.manifest, rebuild=args.rebuild,
+        chunk_vectors=args.chunk_vectors, corpus_store=args.corpus_store)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
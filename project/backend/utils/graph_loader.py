@@ -0,0 +1,327 @@
+# utils/graph_loader.py
+"""
+Bulk loader for the movies graph (replaces the per-row cells in Graph.ipynb).
+
+    python -m utils.graph_loader --movies movie_meta_data.csv --awards screenplay_awards.csv
+
+Each CSV is parsed once. Rows are written with UNWIND in batches of
+--batch-size. Node phases run first; relationship phases then run in parallel
+sessions, except the award phases, which MERGE movies and so run one at a time.
+Finished batches are recorded in a checkpoint file, so a failed run
+picks up where it stopped.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from dotenv import load_dotenv
+from neo4j import GraphDatabase
+
+from modules.graph_schema import ensure_schema
+from utils.graph_parsing import (
+    parse_movie_row, parse_genres, parse_companies, parse_people,
+    parse_award_movie, role_mapping, role_names, nomination_awards,
+)
+
+load_dotenv()
+
+NEO4J_URL = os.getenv("NEO4J_URL", "bolt://localhost:7687")
+NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "12345678")
+NEO4J_DB = os.getenv("NEO4J_DB", "moviesdb")
+
+
+# --- Cypher -----------------------------------------------------------------
+
+MOVIE_NODES = """
+UNWIND $rows AS row
+MERGE (m:Movie {imdb_id: row.imdb_id})
+SET m.title = row.title,
+    m.year = row.year,
+    m.akas = row.akas,
+    m.metascore = row.metascore,
+    m.imdb_rating = row.imdb_rating,
+    m.imdb_votes = row.imdb_votes,
+    m.budget = row.budget,
+    m.countries = row.countries,
+    m.age_restrictions = row.age_restrictions,
+    m.keywords = row.keywords,
+    m.taglines = row.taglines,
+    m.plot = row.plot
+"""
+
+GENRE_NODES = "UNWIND $rows AS name MERGE (:Genre {name: name})"
+COMPANY_NODES = "UNWIND $rows AS name MERGE (:Company {name: name})"
+AWARD_NODES = "UNWIND $rows AS name MERGE (:Award {name: name})"
+
+PERSON_NODES = """
+UNWIND $rows AS row
+MERGE (p:Person {name: row.name})
+SET p.roles = coalesce(p.roles, []) + [r IN row.roles WHERE NOT r IN coalesce(p.roles, [])]
+"""
+
+MOVIE_GENRE_RELS = """
+UNWIND $rows AS row
+MATCH (m:Movie {imdb_id: row.imdb_id})
+MATCH (g:Genre {name: row.name})
+MERGE (m)-[:HAS_GENRE]->(g)
+"""
+
+MOVIE_COMPANY_RELS = """
+UNWIND $rows AS row
+MATCH (m:Movie {imdb_id: row.imdb_id})
+MATCH (c:Company {name: row.name})
+MERGE (m)-[:PRODUCED_BY]->(c)
+"""
+
+# Relationship types cannot be parameters; they come from the fixed mappings above.
+MOVIE_PERSON_RELS = """
+UNWIND $rows AS row
+MATCH (m:Movie {{imdb_id: row.imdb_id}})
+MATCH (p:Person {{name: row.name}})
+MERGE (m)-[:{rel_type}]->(p)
+"""
+
+MOVIE_AWARD_RELS = """
+UNWIND $rows AS row
+MERGE (m:Movie {{imdb_id: row.imdb_id}})
+  ON CREATE SET m.title = row.title
+WITH m, row
+MATCH (a:Award {{name: row.award}})
+MERGE (m)-[:{rel_type}]->(a)
+"""
+
+
+# --- Parsing (each CSV once) --------------------------------------------------
+
+def build_phases(movies_df=None, awards_df=None):
+    """
+    Returns (node_phases, rel_phases); each phase is (name, query, rows).
+    """
+    node_phases, rel_phases = [], []
+
+    if movies_df is not None:
+        movies, genres, companies = [], set(), set()
+        genre_rels, company_rels = [], []
+        people_roles = defaultdict(set)
+        person_rels = defaultdict(list)
+
+        for row in movies_df.to_dict(orient="records"):
+            params = parse_movie_row(row)
+            if params is None:
+                continue
+            imdb_id = params["imdb_id"]
+            movies.append(params)
+
+            for g in parse_genres(row.get("genres", None)):
+                genres.add(g)
+                genre_rels.append({"imdb_id": imdb_id, "name": g})
+
+            for c in parse_companies(row.get("production companies", None)):
+                companies.add(c)
+                company_rels.append({"imdb_id": imdb_id, "name": c})
+
+            for col, rel in role_mapping.items():
+                for person in parse_people(row.get(col, None)):
+                    people_roles[person].add(role_names[col])
+                    person_rels[rel].append({"imdb_id": imdb_id, "name": person})
+
+        people = [{"name": name, "roles": sorted(roles)} for name, roles in people_roles.items()]
+        node_phases += [
+            ("movies", MOVIE_NODES, movies),
+            ("genres", GENRE_NODES, sorted(genres)),
+            ("companies", COMPANY_NODES, sorted(companies)),
+            ("people", PERSON_NODES, people),
+        ]
+        rel_phases += [
+            ("movie_genres", MOVIE_GENRE_RELS, genre_rels),
+            ("movie_companies", MOVIE_COMPANY_RELS, company_rels),
+        ]
+        for rel, rows in person_rels.items():
+            rel_phases.append((f"movie_people_{rel.lower()}", MOVIE_PERSON_RELS.format(rel_type=rel), rows))
+
+    if awards_df is not None:
+        movie_col = awards_df.columns[0]
+        award_columns = list(awards_df.columns[1:])
+        award_rels = defaultdict(list)
+
+        for row in awards_df.to_dict(orient="records"):
+            parsed = parse_award_movie(row[movie_col])
+            if parsed is None:
+                continue
+            title, imdb_id = parsed
+            for award_name in award_columns:
+                value = row[award_name]
+                if pd.isna(value) or str(value).strip() == "":
+                    continue  # no award info
+                rel_type = "NOMINATED_FOR" if award_name in nomination_awards else "WON"
+                award_rels[rel_type].append({"imdb_id": imdb_id, "title": title, "award": award_name})
+
+        node_phases.append(("awards", AWARD_NODES, award_columns))
+        for rel, rows in award_rels.items():
+            rel_phases.append((f"movie_awards_{rel.lower()}", MOVIE_AWARD_RELS.format(rel_type=rel), rows))
+
+    return node_phases, rel_phases
+
+
+# --- Checkpointing ------------------------------------------------------------
+
+class Checkpoint:
+    """
+    Records finished (phase, batch) pairs in a JSON file. The fingerprint ties the
+    record to the input files and batch size; a mismatch starts from scratch.
+    """
+
+    def __init__(self, path, fingerprint, fresh=False):
+        self.path = path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self.done = defaultdict(set)
+        if path and not fresh and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("fingerprint") == fingerprint:
+                for phase, batches in data.get("done", {}).items():
+                    self.done[phase] = set(batches)
+                print(f"[GRAPH_LOADER] Resuming from {path}")
+
+    def is_done(self, phase, batch):
+        return batch in self.done[phase]
+
+    def mark(self, phase, batch):
+        with self._lock:
+            self.done[phase].add(batch)
+            self._write()
+
+    def _write(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint,
+                       "done": {k: sorted(v) for k, v in self.done.items()}}, f)
+        os.replace(tmp, self.path)
+
+
+def fingerprint_inputs(paths, batch_size):
+    h = hashlib.sha256(str(batch_size).encode())
+    for path in paths:
+        if not path:
+            continue
+        st = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+# --- Loading --------------------------------------------------------------------
+
+def _write_batch(tx, query, rows):
+    tx.run(query, rows=rows).consume()
+
+
+def run_phase(driver, database, name, query, rows, batch_size, checkpoint):
+    """Writes one phase in its own session; returns (name, rows_written, seconds)."""
+    start = time.perf_counter()
+    written = 0
+    with driver.session(database=database) as session:
+        for batch_no, i in enumerate(range(0, len(rows), batch_size)):
+            if checkpoint.is_done(name, batch_no):
+                continue
+            batch = rows[i:i + batch_size]
+            session.execute_write(_write_batch, query, batch)
+            checkpoint.mark(name, batch_no)
+            written += len(batch)
+    return name, written, time.perf_counter() - start
+
+
+def run_phases(driver, database, phases, batch_size, workers, checkpoint):
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(run_phase, driver, database, name, query, rows, batch_size, checkpoint): name
+            for name, query, rows in phases
+        }
+        for f in as_completed(futures):
+            name = futures[f]
+            try:
+                _, written, seconds = f.result()
+                rate = written / seconds if seconds > 0 else 0.0
+                print(f"[GRAPH_LOADER] {name}: {written} rows in {seconds:.1f}s ({rate:,.0f} rows/sec)")
+            except Exception as e:
+                print(f"[GRAPH_LOADER] {name} failed: {type(e).__name__}: {e}")
+                failed.append(name)
+    return failed
+
+
+def load(movies_path=None, awards_path=None, batch_size=1000, workers=4, database=NEO4J_DB,
+         checkpoint_path="graph_load.checkpoint.json", fresh=False, phases=None, driver=None, schema=True):
+    movies_df = pd.read_csv(movies_path) if movies_path else None
+    awards_df = pd.read_csv(awards_path) if awards_path else None
+
+    node_phases, rel_phases = build_phases(movies_df, awards_df)
+    if phases:
+        node_phases = [p for p in node_phases if p[0] in phases]
+        rel_phases = [p for p in rel_phases if p[0] in phases]
+
+    checkpoint = Checkpoint(checkpoint_path, fingerprint_inputs([movies_path, awards_path], batch_size), fresh)
+
+    own_driver = driver is None
+    if own_driver:
+        driver = GraphDatabase.driver(NEO4J_URL, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                      max_connection_pool_size=max(workers * 2, 10))
+    try:
+        # Uniqueness constraints first, so every MERGE is an index lookup rather than a label scan.
+        if schema:
+            ensure_schema(driver, database)
+        # Node labels never overlap, so node phases can also run side by side;
+        # relationships need every node in place first.
+        failed = run_phases(driver, database, node_phases, batch_size, workers, checkpoint)
+        if failed:
+            raise RuntimeError(f"Node phases failed: {failed}; re-run to resume.")
+        # Award phases MERGE the movies they point at; two of them side by side could
+        # create the same movie twice (nothing stops it without the uniqueness constraint).
+        merging = [p for p in rel_phases if p[0].startswith("movie_awards_")]
+        matching = [p for p in rel_phases if p not in merging]
+        failed = run_phases(driver, database, matching, batch_size, workers, checkpoint)
+        failed += run_phases(driver, database, merging, batch_size, 1, checkpoint)
+        if failed:
+            raise RuntimeError(f"Relationship phases failed: {failed}; re-run to resume.")
+    finally:
+        if own_driver:
+            driver.close()
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print("[GRAPH_LOADER] Done.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load movie metadata and awards into Neo4j.")
+    parser.add_argument("--movies", help="Path to movie_meta_data.csv")
+    parser.add_argument("--awards", help="Path to screenplay_awards.csv")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4, help="Parallel sessions per stage.")
+    parser.add_argument("--database", default=NEO4J_DB)
+    parser.add_argument("--checkpoint", default="graph_load.checkpoint.json")
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint.")
+    parser.add_argument("--phases", nargs="*", help="Only run these phases (e.g. movies movie_genres).")
+    parser.add_argument("--no-schema", action="store_true", help="Skip creating constraints and indexes.")
+    args = parser.parse_args(argv)
+
+    if not args.movies and not args.awards:
+        parser.error("pass --movies and/or --awards")
+
+    load(args.movies, args.awards, batch_size=args.batch_size, workers=args.workers,
+         database=args.database, checkpoint_path=args.checkpoint, fresh=args.fresh, phases=args.phases,
+         schema=not args.no_schema)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,207 @@
+# parse helpers for movies metadata (moved out of Graph.ipynb)
+
+import re
+import json
+import pandas as pd
+
+# movie_meta_data.csv column -> relationship type from Movie to Person
+role_mapping = {
+    "producers": "PRODUCED_BY",
+    "writers": "WRITTEN_BY",
+    "directors": "DIRECTED_BY",
+    "casting directors": "CASTING_DIRECTED_BY",
+    "cast": "ACTED_IN"
+}
+
+# movie_meta_data.csv column -> value stored in Person.roles
+role_names = {
+    "producers": "producer",
+    "writers": "writer",
+    "directors": "director",
+    "casting directors": "casting director",
+    "cast": "actor",  # the notebook used col[:-1], which gave "cas"
+}
+
+# screenplay_awards.csv columns that list nominees rather than winners
+nomination_awards = {
+    "BAFTA nominations",
+    "Writers Guild Awards Winners & Nominees 2020-2013"
+}
+
+
+def _clean_text(s):
+    if not isinstance(s, str):
+        return s
+    s = s.strip()
+    # remove leading/trailing punctuation often found in your raws (commas, quotes, colons)
+    s = re.sub(r'^[,:\s"\']+', '', s)
+    s = re.sub(r'[,:\s"\']+$', '', s)
+    return s.strip()
+
+def parse_akas_to_dict(akas_str):
+    if akas_str is None or (isinstance(akas_str, float) and pd.isna(akas_str)):
+        return None
+    s = str(akas_str).strip()
+    if not s:
+        return None
+
+    pattern = r"(.+?)\s*\(([^)]+)\)"
+    matches = re.findall(pattern, s)
+
+    if not matches:
+        parts = [p.strip() for p in s.split(",") if p.strip()]
+        if not parts:
+            return None
+        return {f"title_{i+1}": _clean_text(p) for i, p in enumerate(parts)}
+
+    aka_dict = {}
+    for title, country in matches:
+        title_clean = _clean_text(title)
+        country_clean = _clean_text(country)
+        if not country_clean:
+            key = f"unknown_{len(aka_dict)+1}"
+        else:
+            key = country_clean
+        aka_dict[key] = title_clean
+
+    return aka_dict if aka_dict else None
+
+def parse_age_restrictions_to_dict(age_str):
+    if age_str is None or (isinstance(age_str, float) and pd.isna(age_str)):
+        return None
+    s = str(age_str).strip()
+    if not s:
+        return None
+
+    entries = [e.strip() for e in s.split(",") if e.strip()]
+    restrictions = {}
+    for entry in entries:
+        m = re.match(r"([^:]+):([^:]+?)(?:::\((.+?)\))?$", entry)
+        if m:
+            country = _clean_text(m.group(1))
+            rating = _clean_text(m.group(2))
+            region = m.group(3)
+            if region:
+                region_clean = _clean_text(region)
+                key = f"{country} ({region_clean})" if country else region_clean
+            else:
+                key = country
+            if key and rating:
+                restrictions[key] = rating
+        else:
+            continue
+
+    return restrictions if restrictions else None
+
+
+def parse_taglines(tagline_str): # only the commas followed by capital letter is considered a new element in the list.
+    if tagline_str is None or (isinstance(tagline_str, float) and pd.isna(tagline_str)):
+        return None
+    s = str(tagline_str).strip()
+    if not s:
+        return None
+    # split on comma + space only when next char is uppercase
+    parts = re.split(r', (?=[A-Z])', s)
+    taglines = [t.strip() for t in parts if t.strip()]
+    return taglines if taglines else None
+
+def parse_keywords(keyword_str):
+    if not isinstance(keyword_str, str) or not keyword_str.strip():
+        return None
+
+    keywords = [k.strip() for k in keyword_str.split(",") if k.strip()]
+    return keywords if keywords else None
+
+def parse_countries(country_str):
+    if not isinstance(country_str, str) or not country_str.strip():
+        return None
+
+    countries = [c.strip() for c in country_str.split(",") if c.strip()]
+    return countries if countries else None
+
+# used in mapping the movies and genres
+def parse_genres(genre_str):
+    if not isinstance(genre_str, str) or not genre_str.strip():
+        return []
+    return [g.strip() for g in genre_str.split(",") if g.strip()]
+
+def parse_companies(companies_str):
+    if not isinstance(companies_str, str) or not companies_str.strip():
+        return []
+    return [c.strip() for c in companies_str.split(",") if c.strip()]
+
+def parse_people(people_str):
+    if not isinstance(people_str, str) or not people_str.strip():
+        return []
+    return [p.strip() for p in people_str.split(",") if p.strip()]
+
+
+def to_int(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    try:
+        return int(v)
+    except Exception:
+        try:
+            return int(float(v))
+        except Exception:
+            return None
+
+def to_float(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    try:
+        return float(v)
+    except Exception:
+        return None
+
+
+def parse_imdb_id(row):
+    imdb_raw = row.get("imdbid")
+    if imdb_raw is None or pd.isna(imdb_raw):
+        return None
+    imdb_id = str(imdb_raw).strip()
+    return imdb_id or None
+
+
+def parse_movie_row(row):
+    """
+    Movie node properties for one movie_meta_data.csv row, or None if the row has
+    no imdb id. Dicts are serialized to JSON strings (Neo4j has no map properties).
+    """
+    imdb_id = parse_imdb_id(row)
+    if imdb_id is None:
+        return None
+
+    title = str(row.get("title")).strip() if pd.notna(row.get("title")) else None
+
+    akas_dict = parse_akas_to_dict(row.get("akas", None))
+    age_dict = parse_age_restrictions_to_dict(row.get("age restrict", None))
+    plot = row.get("plot", None)
+
+    return {
+        "imdb_id": imdb_id,
+        "title": title,
+        "year": to_int(row.get("year", None)),
+        "akas": json.dumps(akas_dict, ensure_ascii=False) if akas_dict else None,
+        "metascore": to_int(row.get("metascore", None)),
+        "imdb_rating": to_float(row.get("imdb user rating", None)),
+        "imdb_votes": to_int(row.get("number of imdb user votes", None)),
+        "budget": to_int(row.get("budget", None)),
+        "countries": parse_countries(row.get("countries", None)),
+        "age_restrictions": json.dumps(age_dict, ensure_ascii=False) if age_dict else None,
+        "keywords": parse_keywords(row.get("keywords", None)),
+        "taglines": parse_taglines(row.get("taglines", None)),
+        "plot": plot if pd.notna(plot) else None,
+    }
+
+
+def parse_award_movie(movie_str):
+    """'<title>_<imdb_id>' from screenplay_awards.csv -> (title, imdb_id), or None."""
+    if not isinstance(movie_str, str) or "_" not in movie_str:
+        return None
+    title, imdb_id = movie_str.rsplit("_", 1)
+    title, imdb_id = title.strip(), imdb_id.strip()
+    if not imdb_id:
+        return None
+    return title, imdb_id
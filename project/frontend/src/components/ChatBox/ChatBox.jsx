@@ -5,8 +5,18 @@ import remarkGfm from "remark-gfm";
 import "./ChatBox.css";
 import Header from "../../ui/Header";
 
+// One conversation per browser tab; the backend keeps a separate history per id.
+const getSessionId = () => {
+  let id = sessionStorage.getItem("chat_session_id");
+  if (!id) {
+    id = window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem("chat_session_id", id);
+  }
+  return id;
+};
+
 function ChatBox() {
-  const [messages, setMessages] = useState([]); // { role, text, feedback }
+  const [messages, setMessages] = useState([]); // { role, text, feedback, turnId }
   const [input, setInput] = useState("");
   const [loading, setLoading] = useState(false);
   const [feedbackLoadingIndex, setFeedbackLoadingIndex] = useState(null);
@@ -31,11 +41,11 @@ function ChatBox() {
       const res = await fetch("http://localhost:8000/chat", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: text }),
+        body: JSON.stringify({ message: text, session_id: getSessionId() }),
       });
       const data = await res.json();
       const botText = data.answer || data.error || "Error: No response";
-      setMessages((prev) => [...prev, { role: "bot", text: botText, feedback: null }]);
+      setMessages((prev) => [...prev, { role: "bot", text: botText, feedback: null, turnId: data.turn_id }]);
     } catch (err) {
       setMessages((prev) => [...prev, { role: "bot", text: "⚠️ Error connecting to backend", feedback: null }]);
     } finally {
@@ -65,6 +75,8 @@ function ChatBox() {
     if (feedbackLoadingIndex !== null) return; // prevent concurrent retries
     setMessages((prev) => prev.map((m, idx) => (idx === botIndex ? { ...m, feedback: "down" } : m)));
     const botMessage = messages[botIndex]?.text || "";
+    // With the turn id the backend re-answers from that turn's stored tool results.
+    const turnId = messages[botIndex]?.turnId;
     const userMessage = findUserBefore(botIndex) || "";
 
     setFeedbackLoadingIndex(botIndex);
@@ -76,11 +88,13 @@ function ChatBox() {
           user_message: userMessage,
           bot_message: botMessage,
           feedback: "down",
+          session_id: getSessionId(),
+          turn_id: turnId,
         }),
       });
       const data = await res.json();
       const improved = data.answer || data.error || "No improved answer.";
-      setMessages((prev) => [...prev, { role: "bot", text: improved, feedback: null }]);
+      setMessages((prev) => [...prev, { role: "bot", text: improved, feedback: null, turnId: data.turn_id }]);
     } catch (err) {
       setMessages((prev) => [...prev, { role: "bot", text: "⚠️ Feedback failed — can't retry right now.", feedback: null }]);
     } finally {